@@ -1,29 +1,36 @@
 # app.py
+import time
+_import_started = time.perf_counter()  # for the startup report
+
+import importlib
 import os
 import sqlite3
-import markdown
 import json
 import re
+import tempfile
 import uuid
-import requests
-from flask import Flask, render_template, request, redirect, url_for, session, flash, send_file, send_from_directory, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, send_file, send_from_directory, jsonify, g
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 from functools import wraps
 from dotenv import load_dotenv
-import google.generativeai as genai
-from flask import make_response
-
-# MoviePy Imports - Including Audio tools
-from moviepy.editor import (
-    VideoFileClip, 
-    AudioFileClip, 
-    TextClip, 
-    CompositeVideoClip, 
-    concatenate_videoclips, 
-    concatenate_audioclips
-)
-from moviepy.config import change_settings
+from flask import make_response, Response, stream_with_context
+
+from utils.files import allowed_file, generate_unique_filename, prune_folder, safe_float, VIDEO_EXTENSIONS, AUDIO_EXTENSIONS
+from utils import db, exports, metrics
+from utils.jobs import JobQueue, QueueFullError
+from utils.media_index import MediaIndex, media_kind
+from utils import proxies
+from utils.chunked_upload import UploadSessions, UploadError
+from utils.media_server import serve_media
+from utils.render_cache import RenderCache
+from utils.trend_cache import TrendCache
+from utils.ai_stream import sse, JsonObjectStream
+from utils.prompt_cache import PromptCache
+from utils.scheduler import Scheduler
+from utils.scratch import ScratchSpace
+from utils.snapshots import SnapshotStore
+from utils.subsystems import Subsystem, preload, mark_ready, report as startup_report
 
 # --- App & Environment Setup ---
 app = Flask(__name__)
@@ -34,55 +41,203 @@ app.secret_key = os.getenv("SECRET_KEY", "a_super_secret_default_key")
 # CRITICAL: Use absolute path for uploads
 app.config["UPLOAD_FOLDER"] = os.path.abspath("uploads")
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500 MB max
-app.config['ALLOWED_VIDEO_EXTENSIONS'] = {'mp4', 'avi', 'mov', 'mkv', 'webm', 'flv'}
-app.config['ALLOWED_AUDIO_EXTENSIONS'] = {'mp3', 'wav', 'ogg', 'm4a', 'aac', 'flac'}
+app.config['ALLOWED_VIDEO_EXTENSIONS'] = VIDEO_EXTENSIONS
+app.config['ALLOWED_AUDIO_EXTENSIONS'] = AUDIO_EXTENSIONS
+app.config['UPLOAD_CHUNK_SIZE'] = int(os.getenv("UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024))  # resumable uploads
+app.config['MAX_UPLOAD_SIZE'] = int(os.getenv("MAX_UPLOAD_SIZE", 2 * 1024 * 1024 * 1024))
+# Each open upload reserves its full size on disk, so cap them per user and in total (0 = no total cap)
+app.config['UPLOAD_MAX_SESSIONS_PER_USER'] = int(os.getenv("UPLOAD_MAX_SESSIONS_PER_USER", 3))
+app.config['UPLOAD_MAX_RESERVED_BYTES'] = int(os.getenv("UPLOAD_MAX_RESERVED_BYTES", 20 * 1024 * 1024 * 1024))
+# Let nginx ("x-accel") or Apache/lighttpd ("x-sendfile") stream /uploads instead of Python
+app.config['MEDIA_OFFLOAD'] = os.getenv("MEDIA_OFFLOAD") or None
+app.config['MEDIA_OFFLOAD_PREFIX'] = os.getenv("MEDIA_OFFLOAD_PREFIX", "/protected-uploads/")
+
+# --- Render Queue Configuration ---
+app.config['RENDER_WORKERS'] = int(os.getenv("RENDER_WORKERS", 2))                   # pool size per web process
+app.config['RENDER_MAX_CONCURRENT'] = int(os.getenv("RENDER_MAX_CONCURRENT", 2))     # across all web processes
+app.config['RENDER_MAX_QUEUE'] = int(os.getenv("RENDER_MAX_QUEUE", 50))
+app.config['RENDER_MAX_QUEUED_PER_USER'] = int(os.getenv("RENDER_MAX_QUEUED_PER_USER", 5))
+app.config['RENDER_MAX_RUNNING_PER_USER'] = int(os.getenv("RENDER_MAX_RUNNING_PER_USER", 1))
+# Long MoviePy renders are encoded segment-parallel; the render workers read RENDER_SEGMENT_WORKERS
+# (default: CPU count, max 8; 0 or 1 disables) and RENDER_SEGMENT_SECONDS (default 10) from the environment
+# Disk budget for reusing identical renders (0 turns the cache off)
+app.config['RENDER_CACHE_MAX_BYTES'] = int(os.getenv("RENDER_CACHE_MAX_BYTES", 5 * 1024 * 1024 * 1024))
+# Per-job temp files; point at a tmpfs (e.g. /dev/shm/hypeup-scratch) to keep them in memory
+app.config['RENDER_SCRATCH_DIR'] = os.path.abspath(os.getenv("RENDER_SCRATCH_DIR", os.path.join(tempfile.gettempdir(), "hypeup-scratch")))
+app.config['RENDER_SCRATCH_QUOTA'] = int(os.getenv("RENDER_SCRATCH_QUOTA", 4 * 1024 * 1024 * 1024))       # per job, 0 = unlimited
+app.config['RENDER_SCRATCH_MIN_FREE'] = int(os.getenv("RENDER_SCRATCH_MIN_FREE", 512 * 1024 * 1024))    # fail renders below this
+
+app.config['GOALS_PAGE_SIZE'] = int(os.getenv("GOALS_PAGE_SIZE", 20))
+
+# --- Data Exports ---
+app.config['EXPORT_FOLDER'] = os.path.abspath(os.getenv("EXPORT_FOLDER", "exports"))
+app.config['EXPORT_TTL'] = int(os.getenv("EXPORT_TTL", 24 * 3600))  # background exports are deleted after this
+
+# --- Meme Catalog ---
+app.config['MEME_CACHE_FOLDER'] = os.path.abspath(os.getenv("MEME_CACHE_FOLDER", "meme_cache"))
+app.config['MEME_CATALOG_TTL'] = int(os.getenv("MEME_CATALOG_TTL", 6 * 3600))
+# Server-side meme renders (content-hashed, so safe to cache anywhere; MEME_CDN_URL prefixes their URLs)
+app.config['MEME_RENDER_FOLDER'] = os.path.abspath(os.getenv("MEME_RENDER_FOLDER", os.path.join("meme_cache", "rendered")))
+app.config['MEME_RENDER_WORKERS'] = int(os.getenv("MEME_RENDER_WORKERS", min(4, os.cpu_count() or 1)))
+app.config['MEME_BATCH_MAX'] = int(os.getenv("MEME_BATCH_MAX", 20))
+app.config['MEME_RENDER_TTL'] = int(os.getenv("MEME_RENDER_TTL", 7 * 24 * 3600))  # unrequested renders are deleted after this
+app.config['MEME_CDN_URL'] = os.getenv("MEME_CDN_URL", "").rstrip("/")
+
+# --- Trend Cache ---
+app.config['TREND_CACHE_TTL'] = int(os.getenv("TREND_CACHE_TTL", 3600))             # fresh for an hour
+app.config['TREND_STALE_TTL'] = int(os.getenv("TREND_STALE_TTL", 24 * 3600))        # then served while refreshing
+app.config['TREND_WARM_INTERVAL'] = int(os.getenv("TREND_WARM_INTERVAL", 600))      # 0 disables the warmer
+app.config['TREND_WARM_REGIONS'] = int(os.getenv("TREND_WARM_REGIONS", 10))
+
+# --- Background Snapshots ---
+# /trendy reads precomputed snapshots; these intervals set how often (and how much) upstreams get paid for
+app.config['SCHEDULER_ENABLED'] = os.getenv("SCHEDULER_ENABLED", "1") != "0"
+app.config['SNAPSHOT_INTERVAL'] = int(os.getenv("SNAPSHOT_INTERVAL", 900))                  # trends, per region
+app.config['HASHTAG_SNAPSHOT_INTERVAL'] = int(os.getenv("HASHTAG_SNAPSHOT_INTERVAL", 6 * 3600))
+app.config['SNAPSHOT_REGIONS'] = [r.strip() for r in os.getenv("SNAPSHOT_REGIONS", "India,USA,UK,Australia").split(",") if r.strip()]
+app.config['SNAPSHOT_MAX_REGIONS'] = int(os.getenv("SNAPSHOT_MAX_REGIONS", 20))     # configured + most requested
+app.config['SNAPSHOT_KEEP_DAYS'] = int(os.getenv("SNAPSHOT_KEEP_DAYS", 30))
+
+# --- AI Prompt Cache ---
+app.config['PROMPT_CACHE_MAX_BYTES'] = int(os.getenv("PROMPT_CACHE_MAX_BYTES", 50 * 1024 * 1024))
+# Opt-in fuzzy reuse (e.g. 0.9): near-duplicate prompts share an answer. 0 = exact matches only
+app.config['PROMPT_CACHE_NEAR_THRESHOLD'] = float(os.getenv("PROMPT_CACHE_NEAR_THRESHOLD", 0))
+app.config['PROMPT_CACHE_TTLS'] = {
+    "create_post": int(os.getenv("PROMPT_CACHE_TTL_POST", 7 * 24 * 3600)),
+    "recommendations": int(os.getenv("PROMPT_CACHE_TTL_RECOMMENDATIONS", 3 * 24 * 3600)),
+}
+
+# --- Instrumentation ---
+# Every process (web and render workers) writes its metrics here, and /metrics sums them
+app.config['METRICS_DIR'] = os.path.abspath(os.getenv("METRICS_DIR", "metrics"))
+app.config['METRICS_TOKEN'] = os.getenv("METRICS_TOKEN")                             # Bearer token for /metrics, if set
+# Sampled cProfile: PROFILE_SAMPLE_RATE=0.01 profiles 1% of requests and keeps those slower than PROFILE_SLOW_SECONDS
+app.config['PROFILE_SAMPLE_RATE'] = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+app.config['PROFILE_SLOW_SECONDS'] = float(os.getenv("PROFILE_SLOW_SECONDS", 1.0))
+app.config['PROFILE_FOLDER'] = os.path.abspath(os.getenv("PROFILE_FOLDER", "profiles"))
+
+# --- Cold Start ---
+# Heavy subsystems (video engine, AI client, trends, meme catalog) load on first use.
+# Long-lived workers can set PRELOAD_SUBSYSTEMS=all (or a comma list) to load them at boot instead.
+app.config['PRELOAD_SUBSYSTEMS'] = os.getenv("PRELOAD_SUBSYSTEMS", "")
+app.config['STARTUP_BUDGET_MS'] = int(os.getenv("STARTUP_BUDGET_MS", 1500))        # warn when import takes longer
 
 os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
 
-# --- Optional: ImageMagick Configuration ---
-# If TextClip fails on Windows, uncomment and point to your magick.exe
-# change_settings({"IMAGEMAGICK_BINARY": r"C:\\Program Files\\ImageMagick-7.1.0-Q16\\magick.exe"})
+metrics.configure(app.config['METRICS_DIR'])
+profiler = metrics.Profiler(app.config['PROFILE_FOLDER'], sample_rate=app.config['PROFILE_SAMPLE_RATE'],
+                            slow_seconds=app.config['PROFILE_SLOW_SECONDS'])
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    # With profiling on, "X-Profile: 1" forces (and always keeps) a profile of this request
+    g.profile_forced = request.headers.get("X-Profile") == "1"
+    g.profile = profiler.start(force=g.profile_forced)
+
+@app.after_request
+def record_request_time(response):
+    started = g.pop("request_started", None)
+    if started is None: return response
+    elapsed = time.perf_counter() - started
+    # The route template, not the URL, so /jobs/<job_id> is one series
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.observe("http_request_duration_seconds", elapsed, route=route, method=request.method,
+                    status=response.status_code)
+    profile = g.pop("profile", None)
+    if profile is not None:
+        path = profiler.finish(profile, f"{request.method} {route}", elapsed, force=g.get("profile_forced"))
+        if path: print(f"🐢 {request.method} {request.path} took {elapsed:.2f}s, profile: {path}")
+    return response
+
+# --- Lazily Loaded Subsystems ---
+# Each is imported and built on first attribute access (see utils/subsystems.py)
+video_engine = Subsystem("video_engine", lambda: importlib.import_module("utils.video_engine"))  # MoviePy, PIL
+markdown = Subsystem("markdown", lambda: importlib.import_module("markdown"))
 
 # --- API Client Configuration ---
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+# Gemini, then OpenRouter (whichever have keys); see utils/ai_client.py
 DEFAULT_GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash-lite")
-GENAI_AVAILABLE = False
-
-if GEMINI_API_KEY:
-    try:
-        genai.configure(api_key=GEMINI_API_KEY)
-        GENAI_AVAILABLE = True
-        print(f"✅ Gemini Client initialized.")
-    except Exception as e:
-        print(f"⚠️ ERROR: Failed to configure Gemini: {e}")
+# The same check the client makes, without building it (and importing the HTTP stack) at startup
+GENAI_AVAILABLE = bool(os.getenv("GEMINI_API_KEY") or os.getenv("OPENROUTER_API_KEY"))
+
+def build_ai_client():
+    from utils.ai_client import default_client
+    client = default_client()
+    print(f"✅ AI providers: {', '.join(p.name for p in client.providers)}")
+    return client
+
+ai = Subsystem("ai", build_ai_client)
+
+# Shown when every provider fails, so the page still has something to work with
+RECOMMENDATIONS_FALLBACK = json.dumps({
+    "memes": ["Before vs. after using our product", "Nobody: / Our customers:"],
+    "reels": ["15-second behind-the-scenes clip", "Customer reaction compilation"],
+    "hashtags": ["#MarketingTips", "#SocialBuzz", "#ViralNow", "#Trendy2025", "#DigitalHype"],
+    "best_time": "Weekdays 6-9 PM local time",
+    "tip": "Engage audiences with short, emotion-driven captions and trending sounds.",
+})
 
 # ==========================================
 #           DATABASE & AUTH HELPERS
 # ==========================================
 DATABASE_FILE = "hypeup.db"
 
+media_index = MediaIndex(DATABASE_FILE, app.config["UPLOAD_FOLDER"])
+
+upload_sessions = UploadSessions(
+    DATABASE_FILE,
+    app.config["UPLOAD_FOLDER"],
+    chunk_size=app.config['UPLOAD_CHUNK_SIZE'],
+    max_size=app.config['MAX_UPLOAD_SIZE'],
+    max_sessions_per_user=app.config['UPLOAD_MAX_SESSIONS_PER_USER'],
+    max_reserved_bytes=app.config['UPLOAD_MAX_RESERVED_BYTES'],
+)
+
+job_queue = JobQueue(
+    DATABASE_FILE,
+    app.config["UPLOAD_FOLDER"],
+    max_workers=app.config['RENDER_WORKERS'],
+    max_concurrent=app.config['RENDER_MAX_CONCURRENT'],
+    max_queue=app.config['RENDER_MAX_QUEUE'],
+    max_queued_per_user=app.config['RENDER_MAX_QUEUED_PER_USER'],
+    max_running_per_user=app.config['RENDER_MAX_RUNNING_PER_USER'],
+    cache_max_bytes=app.config['RENDER_CACHE_MAX_BYTES'],
+    scratch=ScratchSpace(app.config['RENDER_SCRATCH_DIR'], app.config['RENDER_SCRATCH_QUOTA'],
+                         app.config['RENDER_SCRATCH_MIN_FREE']),
+)
+
+export_jobs = exports.ExportJobs(DATABASE_FILE, app.config["UPLOAD_FOLDER"], app.config['EXPORT_FOLDER'],
+                                 ttl=app.config['EXPORT_TTL'])
+
+def build_meme_catalog():
+    from utils.meme_catalog import MemeCatalog
+    return MemeCatalog(app.config['MEME_CACHE_FOLDER'], ttl=app.config['MEME_CATALOG_TTL'],
+                       static_folder=app.static_folder)
+
+meme_catalog = Subsystem("meme_catalog", build_meme_catalog)
+
+def build_meme_renderer():
+    from utils.meme_render import MemeRenderer
+    return MemeRenderer(meme_catalog.get(), app.config['MEME_RENDER_FOLDER'],
+                        workers=app.config['MEME_RENDER_WORKERS'], batch_max=app.config['MEME_BATCH_MAX'])
+
+meme_renderer = Subsystem("meme_renderer", build_meme_renderer)
+
+render_cache = (RenderCache(DATABASE_FILE, app.config["UPLOAD_FOLDER"], app.config['RENDER_CACHE_MAX_BYTES'])
+                if app.config['RENDER_CACHE_MAX_BYTES'] else None)
+
 def init_db():
-    with sqlite3.connect(DATABASE_FILE) as conn:
-        cursor = conn.cursor()
-        cursor.execute('''CREATE TABLE IF NOT EXISTS goals (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            task TEXT NOT NULL, duration TEXT NOT NULL,
-                            completed BOOLEAN NOT NULL CHECK (completed IN (0, 1)))''')
-        conn.commit()
+    """Create or upgrade the users/goals schema; every worker runs this once at import."""
+    applied = db.migrate(DATABASE_FILE)
+    if applied: print(f"🗄️ Applied {applied} database migration(s)")
 
-def create_user_table():
-    with sqlite3.connect(DATABASE_FILE) as conn:
-        cursor = conn.cursor()
-        cursor.execute('''CREATE TABLE IF NOT EXISTS users (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            username TEXT NOT NULL, email TEXT UNIQUE NOT NULL,
-                            password_hash TEXT NOT NULL)''')
-        conn.commit()
+init_db()
 
 def register_user(username, email, password):
     password_hash = generate_password_hash(password)
     try:
-        with sqlite3.connect(DATABASE_FILE) as conn:
+        with db.connect(DATABASE_FILE) as conn:
             conn.cursor().execute("INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)", 
                                 (username, email, password_hash))
             conn.commit()
@@ -90,11 +245,36 @@ def register_user(username, email, password):
     except: return False
 
 def validate_user(email, password):
-    with sqlite3.connect(DATABASE_FILE) as conn:
+    with db.connect(DATABASE_FILE) as conn:
         res = conn.cursor().execute("SELECT password_hash FROM users WHERE email = ?", (email,)).fetchone()
         if res and check_password_hash(res[0], password): return True
     return False
 
+def current_user_id(conn):
+    """id of the logged-in user (the session holds their email), or None if the account is gone"""
+    row = conn.execute("SELECT id FROM users WHERE email = ?", (session.get("user"),)).fetchone()
+    return row["id"] if row else None
+
+def session_user_id():
+    """current_user_id for this request (looked up once); jobs and exports belong to the id, not the email"""
+    if "user_id" not in g:
+        g.user_id = current_user_id(db.connect(DATABASE_FILE))
+    return g.user_id
+
+def goal_page(conn, user_id, before=None, limit=20):
+    """One page of a user's goals, newest first, plus the id to pass as ``before`` for the next page.
+    Keyset pagination: each page is a range scan on idx_goals_user, however deep it is."""
+    if before: rows = conn.execute("SELECT * FROM goals WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                                   (user_id, before, limit + 1)).fetchall()
+    else: rows = conn.execute("SELECT * FROM goals WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+                              (user_id, limit + 1)).fetchall()
+    return rows[:limit], rows[limit - 1]["id"] if len(rows) > limit else None
+
+def goal_stats(conn, user_id):
+    row = conn.execute("SELECT COUNT(*) AS total, COALESCE(SUM(completed), 0) AS completed FROM goals WHERE user_id = ?",
+                       (user_id,)).fetchone()
+    return {"total": row["total"], "completed": row["completed"]}
+
 def login_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -106,39 +286,109 @@ def login_required(f):
 #           FILE & EDITOR HELPERS
 # ==========================================
 
-def allowed_file(filename, allowed_extensions):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions
-
-def generate_unique_filename(original_filename, prefix=''):
-    name, ext = os.path.splitext(original_filename)
-    clean_name = secure_filename(name)
-    unique_id = uuid.uuid4().hex[:8]
-    if prefix:
-        return f"{prefix}_{clean_name}_{unique_id}{ext}"
-    return f"{clean_name}_{unique_id}{ext}"
-
-def safe_float(value, default=0.0):
-    try: return float(value)
-    except: return default
-
 def get_video_files():
-    if not os.path.exists(app.config['UPLOAD_FOLDER']): return []
-    files = os.listdir(app.config['UPLOAD_FOLDER'])
-    return sorted([f for f in files if allowed_file(f, app.config['ALLOWED_VIDEO_EXTENSIONS'])])
+    """Indexed videos (filename, duration, size...) from the media index"""
+    return media_index.list_files("video")
 
 def get_audio_files():
-    if not os.path.exists(app.config['UPLOAD_FOLDER']): return []
-    files = os.listdir(app.config['UPLOAD_FOLDER'])
-    return sorted([f for f in files if allowed_file(f, app.config['ALLOWED_AUDIO_EXTENSIONS'])])
+    return media_index.list_files("audio")
 
 # --- AI Logic Helper ---
-def generate_trends_with_gemini(region: str):
-    if not GENAI_AVAILABLE: return ["AI Offline"]
-    try:
-        model = genai.GenerativeModel(DEFAULT_GEMINI_MODEL)
-        resp = model.generate_content(f"5 trending search queries for {region}. Plain list.")
-        return [l.strip('-• ') for l in resp.text.splitlines() if l.strip()][:5]
-    except: return ["Error fetching trends"]
+def generate_trends(region: str, model_name=DEFAULT_GEMINI_MODEL):
+    """Ask the AI for trends; raises on failure so the trend cache never stores an error.
+    ``model_name`` only labels the cache entry: the AI client picks the provider."""
+    resp = ai.generate(f"5 trending search queries for {region}. Plain list.")
+    trends = [l.strip('-• ') for l in resp.text.splitlines() if l.strip()][:5]
+    if not trends: raise ValueError("The AI returned no trends")
+    return trends
+
+trend_cache = TrendCache(DATABASE_FILE, generate_trends, DEFAULT_GEMINI_MODEL,
+                         ttl=app.config['TREND_CACHE_TTL'], stale_ttl=app.config['TREND_STALE_TTL'])
+
+prompt_cache = PromptCache(DATABASE_FILE, ttls=app.config['PROMPT_CACHE_TTLS'],
+                           max_bytes=app.config['PROMPT_CACHE_MAX_BYTES'],
+                           near_threshold=app.config['PROMPT_CACHE_NEAR_THRESHOLD'])
+
+def lookup_prompt(feature, text, scope=""):
+    """Cached AI answer for this form, unless the user ticked 'regenerate'"""
+    if request.form.get("regenerate"):
+        prompt_cache.bypass()
+        return None
+    return prompt_cache.lookup(feature, text, scope)
+
+# SerpAPI, Reddit and the (cached) AI trends, queried in parallel and merged
+def build_trend_aggregator():
+    from utils.trend_aggregator import FunctionSource, default_aggregator, enabled_sources
+    aggregator = default_aggregator()
+    aggregator.add(FunctionSource("ai", trend_cache.get, configured=GENAI_AVAILABLE and "ai" in enabled_sources(),
+                                  timeout=8, ttl=0))  # trend_cache does its own caching
+    return aggregator
+
+trend_aggregator = Subsystem("trends", build_trend_aggregator)
+
+def post_prompt(platform, content):
+    return f"Viral {platform} post about: {content}"
+
+def recommendations_prompt(campaign):
+    return f"Marketing ideas for '{campaign}'. Return JSON keys: memes, reels, hashtags."
+
+def sse_response(events):
+    # X-Accel-Buffering stops nginx from holding the stream back until it ends
+    return Response(stream_with_context(events), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# ==========================================
+#           SCHEDULED SNAPSHOTS
+# ==========================================
+snapshots = SnapshotStore(DATABASE_FILE)
+scheduler = Scheduler(DATABASE_FILE)
+
+def snapshot_regions():
+    return snapshots.regions(app.config['SNAPSHOT_REGIONS'], limit=app.config['SNAPSHOT_MAX_REGIONS'])
+
+def snapshot_trends(region: str):
+    """Collect one region's merged trends from all sources and store them unless nothing came back"""
+    result = trend_aggregator.collect(region)
+    for name, status in result["sources"].items():
+        if status["status"] in ("timeout", "error"):
+            print(f"⚠️ Trend source {name} {status['status']} for {region}: {status.get('error', '')}")
+    if result["trends"]: snapshots.save_trends(region, result["trends"], result["sources"])
+    return result
+
+def snapshot_all_trends():
+    if not trend_aggregator.sources: return {"regions": 0}
+    regions = snapshot_regions()
+    saved = sum(1 for region in regions if snapshot_trends(region)["trends"])
+    return {"regions": len(regions), "saved": saved}
+
+def snapshot_hashtags():
+    """Hashtag set and viral tip per region from the recommendations prompt; the fallback is never stored"""
+    if not GENAI_AVAILABLE: return {"regions": 0}
+    saved = 0
+    for region in snapshot_regions():
+        try:
+            resp = ai.generate(recommendations_prompt(f"trending content in {region}")
+                               + " Also a 'tip' key with one short viral strategy tip.")
+            match = re.search(r"\{.*\}", resp.text, re.DOTALL)
+            data = json.loads(match.group()) if match else {}
+            if data.get("hashtags"):
+                snapshots.save_hashtags(region, data["hashtags"], data.get("tip"))
+                saved += 1
+        except Exception as e:
+            print(f"⚠️ Hashtag snapshot failed for {region}: {e}")
+    return {"saved": saved}
+
+scheduler.every("trend_snapshots", app.config['SNAPSHOT_INTERVAL'], snapshot_all_trends)
+scheduler.every("hashtag_snapshots", app.config['HASHTAG_SNAPSHOT_INTERVAL'], snapshot_hashtags)
+scheduler.every("prune_snapshots", 24 * 3600, lambda: snapshots.prune(app.config['SNAPSHOT_KEEP_DAYS']))
+scheduler.every("prune_exports", 3600, export_jobs.prune)
+scheduler.every("sweep_scratch", 3600, job_queue.scratch.sweep)
+# Straight on the folder: going through meme_renderer would load it and the catalog (an imgflip fetch)
+scheduler.every("prune_memes", 24 * 3600, lambda: prune_folder(app.config['MEME_RENDER_FOLDER'], app.config['MEME_RENDER_TTL']))
+if GENAI_AVAILABLE and app.config['TREND_WARM_INTERVAL']:
+    scheduler.every("trend_warm", app.config['TREND_WARM_INTERVAL'],
+                    lambda: trend_cache.warm(app.config['TREND_WARM_REGIONS']),
+                    initial_delay=app.config['TREND_WARM_INTERVAL'])
 
 # ==========================================
 #               CORE ROUTES
@@ -175,21 +425,19 @@ def logout():
 def dashboard():
     user_email = session.get("user")
 
-    with sqlite3.connect(DATABASE_FILE) as conn:
-        conn.row_factory = sqlite3.Row
+    with db.connect(DATABASE_FILE) as conn:
         cursor = conn.cursor()
 
-        # Fetch goals
-        cursor.execute("SELECT * FROM goals ORDER BY id DESC")
-        goals = cursor.fetchall()
-
         # Fetch username using email
         cursor.execute(
-            "SELECT username FROM users WHERE email = ?",
+            "SELECT id, username FROM users WHERE email = ?",
             (user_email,)
         )
         user = cursor.fetchone()
 
+        # Fetch the latest goals ("View All" pages through the rest)
+        goals, _ = goal_page(conn, user["id"], limit=5) if user else ([], None)
+
         username = user["username"] if user else "Creator"
 
     return render_template(
@@ -204,36 +452,68 @@ def dashboard():
 @app.route("/goals", methods=["GET", "POST"])
 @login_required
 def goals():
-    with sqlite3.connect(DATABASE_FILE) as conn:
-        conn.row_factory = sqlite3.Row
+    with db.connect(DATABASE_FILE) as conn:
+        user_id = current_user_id(conn)
+        if user_id is None:
+            session.clear()
+            return redirect(url_for("login"))
         if request.method == 'POST':
             if request.form.get('task'):
-                conn.cursor().execute("INSERT INTO goals (task, duration, completed) VALUES (?, ?, ?)", 
-                                    (request.form.get('task'), request.form.get('duration'), 0))
+                conn.cursor().execute("INSERT INTO goals (task, duration, completed, user_id) VALUES (?, ?, ?, ?)",
+                                    (request.form.get('task'), request.form.get('duration'), 0, user_id))
                 conn.commit()
             return redirect(url_for('goals'))
-        all_goals = conn.cursor().execute("SELECT * FROM goals ORDER BY id DESC").fetchall()
-    return render_template("goal.html", goals=all_goals)
+        before = request.args.get("before", type=int)
+        page, next_before = goal_page(conn, user_id, before, app.config['GOALS_PAGE_SIZE'])
+        stats = goal_stats(conn, user_id)
+    return render_template("goal.html", goals=page, stats=stats, before=before, next_before=next_before)
 
 @app.route("/delete_goal/<int:goal_id>", methods=["POST"])
 @login_required
 def delete_goal(goal_id):
-    with sqlite3.connect(DATABASE_FILE) as conn:
-        conn.cursor().execute("DELETE FROM goals WHERE id = ?", (goal_id,))
+    with db.connect(DATABASE_FILE) as conn:
+        conn.cursor().execute("DELETE FROM goals WHERE id = ? AND user_id = ?", (goal_id, current_user_id(conn)))
         conn.commit()
     return redirect(url_for("goals"))
 
 @app.route("/create_post", methods=["GET", "POST"])
 @login_required
 def create_post():
-    ai, html = None, None
+    raw, html = None, None
     if request.method == "POST" and GENAI_AVAILABLE:
+        platform, content = request.form.get('platform'), request.form.get('content')
+        try:
+            hit = lookup_prompt("create_post", content, platform)
+            if hit: raw = hit["response"]
+            else:
+                raw = ai.generate(post_prompt(platform, content)).text
+                prompt_cache.store("create_post", content, raw, platform)
+            html = markdown.markdown(raw)
+        except Exception as e: raw = f"Error: {e}"
+    return render_template("create_post.html", ai_generated=html, raw_ai=raw)
+
+@app.route("/create_post/stream", methods=["POST"])
+@login_required
+def create_post_stream():
+    """SSE version of create_post: deltas are plain text, the markdown is rendered once at the end"""
+    if not GENAI_AVAILABLE: return jsonify({"error": "AI is offline"}), 503
+    platform, content = request.form.get('platform'), request.form.get('content')
+    hit = lookup_prompt("create_post", content, platform)
+
+    def events():
+        if hit:
+            yield sse("done", {"text": hit["response"], "html": markdown.markdown(hit["response"]), "cached": hit["match"]})
+            return
+        text = ""
         try:
-            model = genai.GenerativeModel(DEFAULT_GEMINI_MODEL)
-            resp = model.generate_content(f"Viral {request.form.get('platform')} post about: {request.form.get('content')}")
-            ai, html = resp.text, markdown.markdown(resp.text)
-        except Exception as e: ai = f"Error: {e}"
-    return render_template("create_post.html", ai_generated=html, raw_ai=ai)
+            for delta in ai.stream(post_prompt(platform, content)):
+                text += delta
+                yield sse("delta", {"text": delta})  # re-rendering the whole answer each time is quadratic
+            prompt_cache.store("create_post", content, text, platform)
+            yield sse("done", {"text": text, "html": markdown.markdown(text)})
+        except Exception as e:
+            yield sse("error", {"error": str(e)})
+    return sse_response(events())
 
 # FIXED PROFILE ROUTE - Replace your current /profile route with this
 
@@ -243,17 +523,15 @@ def profile():
     """User profile and settings page"""
     user_email = session.get("user")  # Session stores email
     
-    with sqlite3.connect(DATABASE_FILE) as conn:
-        conn.row_factory = sqlite3.Row
+    with db.connect(DATABASE_FILE) as conn:
         cursor = conn.cursor()
         
         # Get user info by EMAIL (not username)
         cursor.execute("SELECT * FROM users WHERE email = ?", (user_email,))
         user = cursor.fetchone()
         
-        # Get goals for stats
-        cursor.execute("SELECT * FROM goals")
-        goals = cursor.fetchall()
+        # Goal counts for the stats box
+        stats = goal_stats(conn, user["id"]) if user else None
 
     # Handle missing user
     if user is None:
@@ -271,7 +549,7 @@ def profile():
             return redirect(url_for('profile'))
         
         try:
-            with sqlite3.connect(DATABASE_FILE) as conn:
+            with db.connect(DATABASE_FILE) as conn:
                 cursor = conn.cursor()
                 
                 # Check if new email/username is taken by another user
@@ -298,7 +576,7 @@ def profile():
         except Exception as e:
             flash(f"Error: {str(e)}", "error")
 
-    return render_template("profile.html", user=user, goals=goals)
+    return render_template("profile.html", user=user, goal_stats=stats, exports=export_jobs.list_for_user(user["id"]))
 
 
 @app.route("/change_password", methods=["POST"])
@@ -323,7 +601,7 @@ def change_password():
     
     user_email = session.get("user")
     
-    with sqlite3.connect(DATABASE_FILE) as conn:
+    with db.connect(DATABASE_FILE) as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT password_hash FROM users WHERE email = ?", (user_email,))
         user_data = cursor.fetchone()
@@ -349,7 +627,7 @@ def delete_account():
     user_email = session.get("user")
     
     try:
-        with sqlite3.connect(DATABASE_FILE) as conn:
+        with db.connect(DATABASE_FILE) as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM users WHERE email = ?", (user_email,))
             conn.commit()
@@ -364,44 +642,49 @@ def delete_account():
 @app.route("/export_data")
 @login_required
 def export_data():
-    """Export user data as JSON"""
-    user_email = session.get("user")
-    
-    with sqlite3.connect(DATABASE_FILE) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        # Get user info
-        cursor.execute("SELECT username, email FROM users WHERE email = ?", (user_email,))
-        user = cursor.fetchone()
-        
-        # Get all goals
-        cursor.execute("SELECT task, duration, completed FROM goals")
-        goals = [dict(row) for row in cursor.fetchall()]
-    
-    # Create export data
-    from datetime import datetime
-    export_data_dict = {
-        "exported_at": datetime.now().isoformat(),
-        "user": {
-            "username": user['username'] if user else "Unknown",
-            "email": user['email'] if user else "Unknown"
-        },
-        "goals": goals,
-        "statistics": {
-            "total_goals": len(goals),
-            "completed_goals": sum(1 for g in goals if g['completed'])
-        }
-    }
-    
-    # Create JSON response
-    data_json = json.dumps(export_data_dict, indent=2)
-    response = make_response(data_json)
-    response.headers['Content-Disposition'] = f'attachment; filename=hypeitup_data_{user["username"]}.json'
-    response.headers['Content-Type'] = 'application/json'
-    
+    """Stream the user's data as JSON (default), NDJSON or a zip with their media"""
+    fmt = request.args.get("format", "json")
+    if fmt not in exports.FORMATS: return jsonify({"error": f"Unknown format: {fmt}"}), 400
+
+    with db.connect(DATABASE_FILE) as conn:
+        user = conn.execute("SELECT id, username FROM users WHERE email = ?", (session.get("user"),)).fetchone()
+    if user is None: return redirect(url_for("login"))
+
+    mimetype, ext = exports.FORMATS[fmt]
+    chunks = exports.stream(fmt, DATABASE_FILE, app.config["UPLOAD_FOLDER"], user["id"])
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=hypeitup_data_{secure_filename(user["username"])}.{ext}'
     return response
 
+@app.route("/export_data/jobs", methods=["POST"])
+@login_required
+def start_export():
+    """Build a (large) export in the background; it is downloadable from the profile page or the job's URL"""
+    fmt = request.form.get("format", "zip")
+    if session_user_id() is None: return redirect(url_for("login"))
+    try: export_id = export_jobs.start(session_user_id(), fmt)
+    except ValueError as e: return jsonify({"error": str(e)}), 400
+    if wants_json():
+        return jsonify({"id": export_id, "status_url": url_for("export_status", export_id=export_id)}), 202
+    flash("Your export is being prepared. It will appear under Data & Storage when ready.", "info")
+    return redirect(url_for("profile"))
+
+@app.route("/export_data/jobs/<export_id>")
+@login_required
+def export_status(export_id):
+    job = export_jobs.get(export_id, session_user_id())
+    if job is None: return jsonify({"error": "Export not found"}), 404
+    if job["status"] == "done": job["url"] = url_for("download_export", export_id=export_id)
+    return jsonify(job)
+
+@app.route("/export_data/jobs/<export_id>/download")
+@login_required
+def download_export(export_id):
+    job = export_jobs.get(export_id, session_user_id())
+    if job is None or job["status"] != "done": return jsonify({"error": "Export not ready"}), 404
+    return send_from_directory(export_jobs.folder, job["filename"], as_attachment=True,
+                               download_name=f"hypeitup_data.{exports.FORMATS[job['format']][1]}")
+
 
 # @app.route("/meme_templates")
 # @login_required
@@ -422,87 +705,129 @@ def export_data():
 @app.route("/meme_templates")
 @login_required
 def meme_templates():
-    memes = []
-
-    try:
-        response = requests.get("https://api.imgflip.com/get_memes", timeout=5)
-        data = response.json()
-        if data.get("success"):
-            memes = data["data"]["memes"][:20]
-    except Exception as e:
-        print("⚠️ Could not fetch memes:", e)
-
-    # Local fallback if no internet
-    if not memes:
-        memes = [
-            {"id": "drake", "name": "Drake Hotline Bling", "url": "/static/memes/drake.jpg"},
-            {"id": "boyfriend", "name": "Distracted Boyfriend", "url": "/static/memes/distracted_boyfriend.jpg"},
-            {"id": "success", "name": "Success Kid", "url": "/static/memes/success_kid.jpg"},
-            {"id": "two_buttons", "name": "Two Buttons", "url": "/static/memes/two_buttons.jpg"},
-            {"id": "gru_plan", "name": "Gru’s Plan", "url": "/static/memes/gru_plan.jpg"},
-            {"id": "shaq", "name": "Sleeping Shaq", "url": "/static/memes/sleeping_shaq.jpg"},
-            {"id": "change_mind", "name": "Change My Mind", "url": "/static/memes/change_my_mind.jpg"}
-        ]
-
-    return render_template("meme_templates.html", memes=memes)
+    return render_template("meme_templates.html", memes=meme_catalog.templates(20))
 
-
-
-import requests
 @app.route("/meme_editor/<template_name>")
 @login_required
 def meme_editor(template_name):
-    # Try to find the meme by ID from Imgflip API first
-    meme_url = None
-    meme_name = None
+    meme = meme_catalog.get(template_name)
+    return render_template("meme_editor.html", meme_name=meme["name"] if meme else None,
+                           meme_url=meme["url"] if meme else None, template_id=meme["id"] if meme else None)
 
+@app.route("/memes/<filename>")
+@login_required
+def meme_image(filename):
+    """Mirrored Imgflip template images"""
+    return serve_media(request, meme_catalog.image_folder, filename)
+
+def meme_url(filename):
+    if app.config['MEME_CDN_URL']: return f"{app.config['MEME_CDN_URL']}/{filename}"
+    return url_for("rendered_meme", filename=filename, _external=True)
+
+def render_memes(variants):
+    """Shared by the single and batch endpoints: JSON body -> (response, status)"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict): return {"error": "Expected a JSON body"}, 400
+    fmt = data.get("format", "webp")
     try:
-        response = requests.get("https://api.imgflip.com/get_memes", timeout=5)
-        data = response.json()
-        if data.get("success"):
-            for meme in data["data"]["memes"]:
-                if str(meme["id"]) == template_name:
-                    meme_url = meme["url"]
-                    meme_name = meme["name"]
-                    break
-    except:
-        pass
-
-    # If not found, fallback to local static memes
-    local_memes = {
-        "drake": "/static/memes/drake.jpg",
-        "boyfriend": "/static/memes/distracted_boyfriend.jpg",
-        "success": "/static/memes/success_kid.jpg",
-        "two_buttons": "/static/memes/two_buttons.jpg",
-        "gru_plan": "/static/memes/gru_plan.jpg",
-        "shaq": "/static/memes/sleeping_shaq.jpg",
-        "change_mind": "/static/memes/change_my_mind.jpg"
-    }
-
-    if not meme_url and template_name in local_memes:
-        meme_url = local_memes[template_name]
-        meme_name = template_name.replace("_", " ").title()
-
-    return render_template("meme_editor.html", meme_name=meme_name, meme_url=meme_url)
+        results = meme_renderer.render(data.get("template_id"), variants(data), fmt)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    except LookupError as e:
+        return {"error": str(e)}, 404
+    return {"format": fmt, "results": [{**r, "url": meme_url(r["filename"])} for r in results]}, 200
+
+@app.route("/memes/render", methods=["POST"])
+@login_required
+def render_meme():
+    """JSON API: {"template_id", "top", "bottom", "format": "webp"|"png"} -> {"url", ...}"""
+    body, status = render_memes(lambda data: [{"top": data.get("top"), "bottom": data.get("bottom")}])
+    if status != 200: return jsonify(body), status
+    return jsonify({"format": body["format"], **body["results"][0]})
+
+@app.route("/memes/render/batch", methods=["POST"])
+@login_required
+def render_meme_batch():
+    """JSON API: {"template_id", "variants": [{"top", "bottom"} or "top / bottom", ...]} -> one result per variant.
+    Variants that aren't on disk yet render in parallel across the meme worker processes."""
+    body, status = render_memes(lambda data: data.get("variants"))
+    return jsonify(body), status
+
+@app.route("/memes/rendered/<filename>")
+def rendered_meme(filename):
+    """Rendered memes, public and cacheable forever: the name is a hash of everything that went into the image"""
+    response = serve_media(request, app.config['MEME_RENDER_FOLDER'], filename)
+    if response.status_code in (200, 206, 304):
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
 
 @app.route("/trendy", methods=["GET"])
 @login_required
 def trendy():
-    return render_template("trendy.html", country=request.args.get("country", "India"), trends=generate_trends_with_gemini(request.args.get("country", "India")))
+    """Latest scheduled snapshot; only a region never snapshotted before is collected live (and saved)"""
+    country = request.args.get("country", "India")
+    snapshots.note_request(country)
+    snap = snapshots.latest_trends(country)
+    if snap is None and trend_aggregator.sources: snap = snapshot_trends(country)
+    if snap is None: trends, sources = ["AI Offline"], {}
+    else: trends, sources = [t["title"] for t in snap["trends"]] or ["Error fetching trends"], snap["sources"]
+    tags = snapshots.latest_hashtags(country)
+    return render_template("trendy.html", country=country, trends=trends, sources=sources,
+                           taken_at=snap and snap.get("taken_at"),
+                           hashtags=tags["hashtags"] if tags else [],
+                           ai_tip=(tags and tags["tip"]) or json.loads(RECOMMENDATIONS_FALLBACK)["tip"])
+
+@app.route("/trendy/history")
+@login_required
+def trendy_history():
+    """Trend snapshots of the last ``hours`` for trend-over-time charts"""
+    country = request.args.get("country", "India")
+    hours = safe_float(request.args.get("hours"), 24)
+    history = snapshots.trend_history(country, since=time.time() - hours * 3600)
+    return jsonify({"country": country, "snapshots": history})
 
 @app.route("/recommendations", methods=["GET", "POST"])
 @login_required
 def recommendations():
     ai_data = None
     if request.method == "POST" and GENAI_AVAILABLE:
+        campaign = request.form.get('campaign')
         try:
-            model = genai.GenerativeModel(DEFAULT_GEMINI_MODEL)
-            resp = model.generate_content(f"Marketing ideas for '{request.form.get('campaign')}'. Return JSON keys: memes, reels, hashtags.")
-            match = re.search(r"\{.*\}", resp.text, re.DOTALL)
+            hit = lookup_prompt("recommendations", campaign)
+            resp = None if hit else ai.generate(recommendations_prompt(campaign), fallback=RECOMMENDATIONS_FALLBACK)
+            text = hit["response"] if hit else resp.text
+            match = re.search(r"\{.*\}", text, re.DOTALL)
             if match: ai_data = json.loads(match.group())
+            if ai_data and resp and not resp.is_fallback:
+                prompt_cache.store("recommendations", campaign, text)
         except Exception as e: ai_data = {"error": str(e)}
     return render_template("recommendations.html", campaign=request.form.get("campaign", ""), data=ai_data)
 
+@app.route("/recommendations/stream", methods=["POST"])
+@login_required
+def recommendations_stream():
+    """SSE version of recommendations: each idea is sent as soon as its JSON is complete"""
+    if not GENAI_AVAILABLE: return jsonify({"error": "AI is offline"}), 503
+    campaign = request.form.get('campaign')
+    hit = lookup_prompt("recommendations", campaign)
+
+    def events():
+        parser = JsonObjectStream()
+        pieces = [hit["response"]] if hit else ai.stream(recommendations_prompt(campaign), fallback=RECOMMENDATIONS_FALLBACK)
+        try:
+            for delta in pieces:
+                for kind, key, value in parser.feed(delta):
+                    yield sse(kind, {"key": key, "value": value})
+            data = parser.result()
+            if data is None: yield sse("error", {"error": "The AI did not return valid JSON"})
+            else:
+                if not hit and parser.text != RECOMMENDATIONS_FALLBACK:
+                    prompt_cache.store("recommendations", campaign, parser.text)
+                yield sse("done", {"data": data, "cached": hit["match"] if hit else None})
+        except Exception as e:
+            yield sse("error", {"error": str(e)})
+    return sse_response(events())
+
 # =========================================================
 #  🎥 VIDEO EDITOR ROUTES & LOGIC
 # =========================================================
@@ -515,8 +840,34 @@ def video_editor():
 @app.route('/uploads/<filename>')
 @login_required
 def uploaded_file(filename):
-    """Serve uploaded files to the HTML player"""
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    """Serve uploaded files to the HTML player (byte ranges, ETags, immutable caching)"""
+    return serve_media(request, app.config['UPLOAD_FOLDER'], filename,
+                       offload=app.config['MEDIA_OFFLOAD'], offload_prefix=app.config['MEDIA_OFFLOAD_PREFIX'])
+
+@app.route('/previews/<filename>')
+@login_required
+def preview_file(filename):
+    """Low-resolution preview renders"""
+    return serve_media(request, proxies.preview_folder(app.config['UPLOAD_FOLDER']), filename,
+                       offload=app.config['MEDIA_OFFLOAD'],
+                       offload_prefix=app.config['MEDIA_OFFLOAD_PREFIX'].rstrip("/") + "/" + proxies.PREVIEW_DIR)
+
+@app.route('/proxies/<filename>')
+@login_required
+def proxy_file(filename):
+    """Editing proxies and thumbnail strips"""
+    return serve_media(request, proxies.proxy_folder(app.config['UPLOAD_FOLDER']), filename,
+                       offload=app.config['MEDIA_OFFLOAD'],
+                       offload_prefix=app.config['MEDIA_OFFLOAD_PREFIX'].rstrip("/") + "/" + proxies.PROXY_DIR)
+
+def queue_proxy(filename):
+    """Build the editing proxy in the background (previews build it on demand if this didn't run)"""
+    if media_kind(filename) != "video" or session_user_id() is None:
+        return
+    try:
+        job_queue.enqueue(session_user_id(), "proxy", {"video": filename}, enforce_limits=False)
+    except sqlite3.Error as e:
+        print(f"⚠️ Could not queue proxy for {filename}: {e}")
 
 @app.route("/upload_file", methods=["POST"])
 @login_required
@@ -537,202 +888,221 @@ def upload_file():
         filename = generate_unique_filename(file.filename)
         save_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
         file.save(save_path)
+        media_index.index_file(filename)
+        queue_proxy(filename)
         flash(f"✅ Uploaded: {filename}", "success")
     except Exception as e:
         flash(f"⚠️ Upload failed: {e}", "error")
     
     return redirect(url_for("video_editor"))
 
+# --- Resumable chunked uploads (used by the editor's Import Media button) ---
+@app.errorhandler(UploadError)
+def handle_upload_error(e):
+    return jsonify({"error": str(e)}), e.status
+
+@app.route("/upload_sessions", methods=["POST"])
+@login_required
+def start_upload():
+    data = request.get_json(silent=True) or {}
+    original = data.get("filename", "")
+    if not (allowed_file(original, app.config['ALLOWED_VIDEO_EXTENSIONS'])
+            or allowed_file(original, app.config['ALLOWED_AUDIO_EXTENSIONS'])):
+        return jsonify({"error": "Unsupported file type."}), 400
+    session_info = upload_sessions.initiate(
+        session_user_id(), generate_unique_filename(original), int(data.get("size") or 0), data.get("checksum"))
+    return jsonify(session_info), 201
+
+@app.route("/upload_sessions/<upload_id>", methods=["GET"])
+@login_required
+def upload_status(upload_id):
+    return jsonify(upload_sessions.status(session_user_id(), upload_id))
+
+@app.route("/upload_sessions/<upload_id>/chunks/<int:index>", methods=["PUT"])
+@login_required
+def upload_chunk(upload_id, index):
+    return jsonify(upload_sessions.write_chunk(
+        session_user_id(), upload_id, index, request.stream, request.headers.get("X-Chunk-Sha256")))
+
+@app.route("/upload_sessions/<upload_id>/complete", methods=["POST"])
+@login_required
+def complete_upload(upload_id):
+    data = request.get_json(silent=True) or {}
+    filename = upload_sessions.complete(session_user_id(), upload_id, data.get("checksum"))
+    media_index.index_file(filename)
+    queue_proxy(filename)
+    flash(f"✅ Uploaded: {filename}", "success")
+    return jsonify({"filename": filename})
+
+@app.route("/upload_sessions/<upload_id>", methods=["DELETE"])
+@login_required
+def abort_upload(upload_id):
+    upload_sessions.abort(session_user_id(), upload_id)
+    return jsonify({"status": "aborted"})
+
 # =========================================================
-#  🎥 VIDEO PROCESSING LOGIC (The Engine)
+#  🎥 RENDER JOBS (MoviePy work runs in utils/video_engine.py)
 # =========================================================
 
-def trim_video_logic():
-    video_filename = request.form.get('video')
-    start = safe_float(request.form.get('start'), 0)
-    end = safe_float(request.form.get('end'), 0)
+def wants_json():
+    return request.accept_mimetypes.best_match(["application/json", "text/html"]) == "application/json"
+
+@app.before_request
+def ensure_job_dispatcher():
+    # Cheap after the first call; picks up jobs left queued by a restarted worker
+    job_queue.start()
+
+@app.before_request
+def ensure_scheduler():
+    if app.config['SCHEDULER_ENABLED']: scheduler.start()
+
+def queue_render(action, params):
+    """Enqueue a render, or answer straight from the render cache when an identical one exists"""
+    # Only digests already on record are used here; hashing a big upload is the worker's job
+    hit = video_engine.cached_result(render_cache, action, params, app.config["UPLOAD_FOLDER"],
+                                     compute=False, record_miss=False)
+    user_id = session_user_id()
+    if user_id is None:
+        raise ValueError("Your account no longer exists. Please log in again.")
+    if hit:
+        return job_queue.record_completed(user_id, action, params, hit), hit
+    return job_queue.enqueue(user_id, action, params), None
 
-    if not video_filename: 
-        flash('No video selected', 'error')
-        return redirect(url_for('video_editor'))
-    
-    path = os.path.join(app.config['UPLOAD_FOLDER'], video_filename)
-    if not os.path.exists(path): 
-        flash('Video file not found', 'error')
-        return redirect(url_for('video_editor'))
+# --- Central Processing Route ---
+@app.route("/process_video", methods=["POST"])
+@login_required
+def process_video():
+    """Validate the form, enqueue a render job and return immediately"""
+    action = request.form.get("action")
 
-    try:
-        with VideoFileClip(path) as clip:
-            if end > clip.duration: end = clip.duration
-            if start >= end: 
-                flash('Invalid start/end times', 'error')
-                return redirect(url_for('video_editor'))
-            
-            trimmed = clip.subclip(start, end)
-            output_filename = generate_unique_filename(video_filename, prefix='trimmed')
-            output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
-            
-            trimmed.write_videofile(
-                output_path, 
-                codec="libx264", 
-                audio_codec="aac", 
-                temp_audiofile="temp-audio.m4a", 
-                remove_temp=True,
-                logger=None
-            )
-            flash(f"✅ Trimmed successfully: {output_filename}", "success")
-    except Exception as e:
-        flash(f"⚠️ Trim error: {e}", "error")
-    
-    return redirect(url_for('video_editor'))
+    if action not in video_engine.ACTIONS:
+        if wants_json(): return jsonify({"error": "Unknown action"}), 400
+        flash("⚠️ Unknown action", "error")
+        return redirect(url_for("video_editor"))
 
-def add_text_logic():
-    video_filename = request.form.get('video')
-    text = request.form.get('text')
-    
-    if not video_filename or not text: 
-        flash("Missing video or text", "error")
-        return redirect(url_for('video_editor'))
-    
-    path = os.path.join(app.config["UPLOAD_FOLDER"], video_filename)
-    
     try:
-        with VideoFileClip(path) as clip:
-            # Note: TextClip requires ImageMagick installed on server/PC
-            txt_clip = TextClip(text, fontsize=50, color='white', font='Arial-Bold', stroke_color='black', stroke_width=2)
-            txt_clip = txt_clip.set_position(('center', 'bottom')).set_duration(clip.duration)
-            
-            final = CompositeVideoClip([clip, txt_clip])
-            output_filename = generate_unique_filename(video_filename, prefix='text')
-            output_path = os.path.join(app.config["UPLOAD_FOLDER"], output_filename)
-            
-            final.write_videofile(output_path, codec="libx264", audio_codec="aac", logger=None)
-            flash(f"✅ Text added: {output_filename}", "success")
-    except Exception as e:
-        flash(f"⚠️ Text Error (Ensure ImageMagick is installed): {e}", "error")
-    
-    return redirect(url_for('video_editor'))
+        params = video_engine.params_from_form(action, request.form, app.config["UPLOAD_FOLDER"], media=media_index)
+        job_id, cached = queue_render(action, params)
+    except ValueError as e:
+        if wants_json(): return jsonify({"error": str(e)}), 400
+        flash(str(e), "error")
+        return redirect(url_for("video_editor"))
+    except QueueFullError as e:
+        if wants_json(): return jsonify({"error": str(e)}), 429
+        flash(f"⚠️ {e}", "error")
+        return redirect(url_for("video_editor"))
 
-def add_audio_logic():
-    video_name = request.form.get('video')
-    audio_name = request.form.get('audio')
-    
-    if not video_name or not audio_name: 
-        flash("Missing video or audio", "error")
-        return redirect(url_for('video_editor'))
-    
-    vid_path = os.path.join(app.config["UPLOAD_FOLDER"], video_name)
-    aud_path = os.path.join(app.config["UPLOAD_FOLDER"], audio_name)
-    
-    if not os.path.exists(vid_path) or not os.path.exists(aud_path):
-        flash("File not found", "error")
-        return redirect(url_for('video_editor'))
-    
-    try:
-        with VideoFileClip(vid_path) as video, AudioFileClip(aud_path) as audio:
-            # Logic: Loop audio if shorter, trim if longer
-            if audio.duration < video.duration:
-                # Calculate loops needed
-                loops_needed = int(video.duration / audio.duration) + 1
-                final_audio = concatenate_audioclips([audio] * loops_needed).subclip(0, video.duration)
-            else:
-                final_audio = audio.subclip(0, video.duration)
-                
-            final = video.set_audio(final_audio)
-            output_filename = generate_unique_filename(video_name, prefix='audio')
-            output_path = os.path.join(app.config["UPLOAD_FOLDER"], output_filename)
-            
-            final.write_videofile(
-                output_path, 
-                codec="libx264", 
-                audio_codec="aac", 
-                temp_audiofile="temp-audio.m4a", 
-                remove_temp=True,
-                logger=None
-            )
-            flash(f"✅ Audio merged: {output_filename}", "success")
-    except Exception as e:
-        flash(f"⚠️ Audio Error: {e}", "error")
-    
-    return redirect(url_for('video_editor'))
+    if wants_json():
+        return jsonify({"job_id": job_id, "status_url": url_for("job_status", job_id=job_id),
+                        "cached": bool(cached)}), 202
+    if cached:
+        flash(cached["message"], "success")
+    else:
+        flash(f"⏳ Render queued (job {job_id[:8]}). It will appear in your assets when done.", "info")
+    return redirect(url_for("video_editor"))
 
-def merge_logic():
-    video_names = request.form.getlist("videos")
-    
-    if not video_names or len(video_names) < 2:
-        flash("Select at least 2 videos to merge (Hold Ctrl/Cmd to select multiple)", "error")
-        return redirect(url_for('video_editor'))
-    
+@app.route("/edl", methods=["POST"])
+@login_required
+def submit_edl():
+    """JSON API: render a whole edit-decision list (see utils/edl.py) as one job"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Expected a JSON body"}), 400
+    # Accept either {"edl": {...}, "preview": true} or the bare EDL
+    form = {"edl": data.get("edl", data), "preview": str(data.get("preview", ""))}
     try:
-        video_clips = []
-        for name in video_names:
-            path = os.path.join(app.config["UPLOAD_FOLDER"], name)
-            if os.path.exists(path):
-                video_clips.append(VideoFileClip(path))
-        
-        if len(video_clips) < 2:
-            flash("Not enough valid videos found", "error")
-            return redirect(url_for('video_editor'))
+        params = video_engine.params_from_form("edl", form, app.config["UPLOAD_FOLDER"], media=media_index)
+        job_id, cached = queue_render("edl", params)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except QueueFullError as e:
+        return jsonify({"error": str(e)}), 429
+    return jsonify({"job_id": job_id, "status_url": url_for("job_status", job_id=job_id),
+                    "cached": bool(cached), "edl": params["edl"]}), 202
+
+@app.route("/render_cache/stats")
+@login_required
+def render_cache_stats():
+    if render_cache is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **render_cache.stats()})
 
-        final = concatenate_videoclips(video_clips, method="compose")
-        output_filename = f"merged_{uuid.uuid4().hex[:8]}.mp4"
-        output_path = os.path.join(app.config["UPLOAD_FOLDER"], output_filename)
-        
-        final.write_videofile(output_path, codec="libx264", audio_codec="aac", logger=None)
-        
-        # Close clips
-        for c in video_clips: c.close()
-        
-        flash(f"✅ Videos merged: {output_filename}", "success")
-    except Exception as e:
-        flash(f"⚠️ Merge Error: {e}", "error")
-    
-    return redirect(url_for('video_editor'))
+@app.route("/ai/stats")
+@login_required
+def ai_stats():
+    """Per provider/model call counts, errors, latency and tokens, circuit breaker states and prompt cache hit rate"""
+    return jsonify({**ai.stats(), "prompt_cache": prompt_cache.stats()})
 
-def export_logic():
-    """Simple export/convert function"""
-    video_filename = request.form.get('video')
-    
-    if not video_filename:
-        flash('No video selected', 'error')
-        return redirect(url_for('video_editor'))
-        
-    path = os.path.join(app.config['UPLOAD_FOLDER'], video_filename)
-    try:
-        with VideoFileClip(path) as clip:
-            output_filename = generate_unique_filename(video_filename, prefix='export')
-            output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
-            
-            # Re-encoding
-            clip.write_videofile(output_path, codec="libx264", audio_codec="aac", logger=None)
-            flash(f"✅ Exported successfully: {output_filename}", "success")
-    except Exception as e:
-        flash(f"Export failed: {e}", "error")
-    
-    return redirect(url_for('video_editor'))
+@app.route("/scheduler/status")
+@login_required
+def scheduler_status():
+    return jsonify({"enabled": app.config['SCHEDULER_ENABLED'], "tasks": scheduler.status()})
+
+@app.route("/metrics")
+def prometheus_metrics():
+    """Prometheus scrape endpoint: route latency, SQLite, external calls and render stages for the whole host"""
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return Response("Unauthorized\n", status=401, mimetype="text/plain")
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/jobs")
+@login_required
+def list_jobs():
+    return jsonify({"jobs": job_queue.list_for_user(session_user_id())})
 
-# --- Central Processing Route ---
-@app.route("/process_video", methods=["POST"])
+@app.route("/jobs/<job_id>")
 @login_required
-def process_video():
-    action = request.form.get("action")
-    
-    if action == "trim": return trim_video_logic()
-    elif action == "add_text": return add_text_logic()
-    elif action == "add_audio": return add_audio_logic()
-    elif action == "merge": return merge_logic()
-    elif action == "export": return export_logic()
-    else:
-        flash("⚠️ Unknown action", "error")
-        return redirect(url_for("video_editor"))
+def job_status(job_id):
+    job = job_queue.get(job_id, user_id=session_user_id())
+    if job is None: return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+@app.route("/jobs/<job_id>/result")
+@login_required
+def job_result(job_id):
+    job = job_queue.get(job_id, user_id=session_user_id())
+    if job is None: return jsonify({"error": "Job not found"}), 404
+    if job["status"] != "done":
+        return jsonify({"status": job["status"], "error": job["error"]}), 409
+    output = job["result"]["output"]
+    if not output:
+        return jsonify(job["result"])
+    endpoint = "preview_file" if job["result"].get("preview") else "uploaded_file"
+    return jsonify({**job["result"], "url": url_for(endpoint, filename=output)})
+
+@app.route("/jobs/<job_id>/cancel", methods=["POST"])
+@login_required
+def cancel_job(job_id):
+    if job_queue.cancel(job_id, session_user_id()):
+        return jsonify({"status": "cancelled"})
+    return jsonify({"error": "Job is not queued"}), 409
+
+@app.route("/startup")
+@login_required
+def startup_stats():
+    """App import time and each lazily loaded subsystem's load time (null until first used)"""
+    return jsonify(startup_report())
+
+# ==========================================
+#               STARTUP
+# ==========================================
+
+startup_ms = mark_ready(_import_started) * 1000
+print(f"🚀 App imported in {startup_ms:.0f} ms")
+if startup_ms > app.config['STARTUP_BUDGET_MS']:
+    print(f"⚠️ Startup is over its {app.config['STARTUP_BUDGET_MS']} ms budget")
+if app.config['PRELOAD_SUBSYSTEMS']:
+    names = app.config['PRELOAD_SUBSYSTEMS']
+    loaded = preload("all" if names == "all" else [n.strip() for n in names.split(",")])
+    print("🔥 Preloaded " + ", ".join(f"{n} ({s * 1000:.0f} ms)" for n, s in loaded.items() if s is not None))
 
 # ==========================================
 #               EXECUTION
 # ==========================================
 
 if __name__ == "__main__":
-    create_user_table()
-    init_db()
+    job_queue.init_db()
     print(f"📂 Database: {os.path.abspath(DATABASE_FILE)}")
     print(f"📂 Uploads:  {app.config['UPLOAD_FOLDER']}")
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -2,11 +2,12 @@
 from flask import Flask, request, jsonify, send_from_directory, abort
 from flask_cors import CORS
 from moviepy.editor import (
-    VideoFileClip, AudioFileClip, TextClip, CompositeVideoClip,
-    concatenate_videoclips, vfx
+    VideoFileClip, AudioFileClip, concatenate_videoclips, vfx
 )
 from werkzeug.utils import secure_filename
-import os, uuid
+from PIL import ImageColor
+from functools import wraps
+import os, sys, uuid
 
 app = Flask(__name__)
 CORS(app, origins=["http://127.0.0.1:5000", "http://localhost:5000"])  # limit origins in production
@@ -15,6 +16,48 @@ ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 VIDEO_DIR = os.path.join(ROOT_DIR, "videos")
 os.makedirs(VIDEO_DIR, exist_ok=True)
 
+# Share the ffmpeg helpers in utils/ with the main app
+sys.path.insert(0, ROOT_DIR)
+from utils import ffmpeg_tools, stream_ops, text_render
+from utils.render_cache import RenderCache
+
+# Identical requests (same input content + same form fields) reuse the earlier output
+CACHE_MAX_BYTES = int(os.getenv("RENDER_CACHE_MAX_BYTES", 5 * 1024 * 1024 * 1024))
+CACHE_SETTINGS = {"version": 2, "video_codec": "libx264", "audio_codec": "aac"}
+render_cache = None
+if CACHE_MAX_BYTES:
+    os.makedirs(os.path.join(VIDEO_DIR, ".render_cache"), exist_ok=True)
+    render_cache = RenderCache(os.path.join(VIDEO_DIR, ".render_cache", "index.db"), VIDEO_DIR, CACHE_MAX_BYTES)
+
+def _form_params():
+    params = {}
+    for key in request.form:
+        values = request.form.getlist(key)
+        normalized = []
+        for v in values:
+            try: normalized.append(round(float(v), 3))
+            except ValueError: normalized.append(secure_filename(v) if key.startswith("filename") or key == "audiofile" else v)
+        params[key] = normalized if key == "filenames" or len(normalized) > 1 else normalized[0]
+    return params
+
+def cached_render(action):
+    """Answer from the render cache when possible; cache successful new outputs."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = render_cache.key(action, _form_params(), settings=CACHE_SETTINGS) if render_cache else None
+            hit = render_cache.lookup(key) if key else None
+            if hit:
+                return jsonify(hit)
+            resp = view(*args, **kwargs)
+            if key and not isinstance(resp, tuple) and resp.status_code == 200:
+                data = resp.get_json(silent=True) or {}
+                if data.get("output"):
+                    render_cache.store(key, action, data, os.path.join(VIDEO_DIR, data["output"]))
+            return resp
+        return wrapper
+    return decorator
+
 def safe_path(filename):
     return os.path.join(VIDEO_DIR, secure_filename(filename))
 
@@ -34,13 +77,32 @@ def upload_video():
     return jsonify({"message": "Uploaded successfully", "filename": filename}), 200
 
 @app.route("/trim", methods=["POST"])
+@cached_render("trim")
 def trim_video():
     filename = request.form.get("filename")
     if not filename:
         return jsonify({"error": "filename required"}), 400
     start = float(request.form.get("start", 0))
     end = float(request.form.get("end", 0))
+    mode = request.form.get("mode", "auto")  # auto | copy | reencode
     in_path = safe_path(filename)
+
+    # Stream-copy / smart-cut when the keyframes allow it
+    if mode != "reencode":
+        try:
+            info = ffmpeg_tools.probe(in_path)
+            plan = stream_ops.plan_trim(in_path, start, end, mode, info=info)
+            if plan["mode"] != "reencode":
+                ext = ".mp4" if plan["mode"] == "smart" else os.path.splitext(in_path)[1]
+                out = new_output("trim", ext)
+                stream_ops.trim(in_path, out, plan, info=info)
+                return jsonify({"output": os.path.basename(out), "mode": plan["mode"],
+                                "start": plan["start"], "end": plan["end"]})
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            print("⚠️ Stream trim failed, re-encoding instead:", e)
+
     clip = VideoFileClip(in_path)
     try:
         sub = clip.subclip(start, end)
@@ -49,13 +111,23 @@ def trim_video():
         sub.close()
     finally:
         clip.close()
-    return jsonify({"output": os.path.basename(out)})
+    return jsonify({"output": os.path.basename(out), "mode": "reencode", "start": start, "end": end})
 
 @app.route("/merge", methods=["POST"])
+@cached_render("merge")
 def merge_videos():
     files = request.form.getlist("filenames")
     if not files:
         return jsonify({"error": "filenames required"}), 400
+    # Concat demuxer first: only clips that differ from the rest get re-encoded
+    try:
+        out = new_output("merge")
+        plan = stream_ops.concat([safe_path(f) for f in files], out)
+        return jsonify({"output": os.path.basename(out), "mode": plan["mode"],
+                        "normalized": len(plan["normalize"])})
+    except Exception as e:
+        print("⚠️ Stream merge failed, compositing with MoviePy instead:", e)
+
     clips = []
     try:
         for f in files:
@@ -69,22 +141,23 @@ def merge_videos():
         for c in clips:
             try: c.close()
             except: pass
-    return jsonify({"output": os.path.basename(out)})
+    return jsonify({"output": os.path.basename(out), "mode": "reencode", "normalized": len(files)})
 
 @app.route("/add_text", methods=["POST"])
+@cached_render("add_text")
 def add_text():
     filename = request.form.get("filename")
     text = request.form.get("text", "")
     fontsize = int(request.form.get("fontsize", 40))
     color = request.form.get("color", "white")
+    try:
+        ImageColor.getrgb(color)
+    except ValueError:
+        return jsonify({"error": f"unknown color {color!r}"}), 400
     in_path = safe_path(filename)
     clip = VideoFileClip(in_path)
     try:
-        try:
-            txt = TextClip(text, fontsize=fontsize, color=color, font="DejaVu-Sans").set_duration(clip.duration)
-        except Exception:
-            txt = TextClip(text, fontsize=fontsize, color=color).set_duration(clip.duration)
-        final = CompositeVideoClip([clip, txt.set_pos(("center", "bottom"))])
+        final = clip.fl(text_render.Captioner([{"text": text, "fontsize": fontsize, "color": color}], clip.size))
         out = new_output("text")
         final.write_videofile(out, codec="libx264", audio_codec="aac", logger=None)
         final.close()
@@ -93,6 +166,7 @@ def add_text():
     return jsonify({"output": os.path.basename(out)})
 
 @app.route("/add_audio", methods=["POST"])
+@cached_render("add_audio")
 def add_audio():
     filename = request.form.get("filename")
     audiofile = request.form.get("audiofile")
@@ -113,6 +187,7 @@ def add_audio():
     return jsonify({"output": os.path.basename(out)})
 
 @app.route("/change_speed", methods=["POST"])
+@cached_render("change_speed")
 def change_speed():
     filename = request.form.get("filename")
     factor = float(request.form.get("factor", 1.0))
@@ -128,6 +203,7 @@ def change_speed():
     return jsonify({"output": os.path.basename(out)})
 
 @app.route("/thumbnail", methods=["POST"])
+@cached_render("thumbnail")
 def thumbnail():
     filename = request.form.get("filename")
     t = float(request.form.get("time", 1))
@@ -140,6 +216,7 @@ def thumbnail():
     return jsonify({"output": os.path.basename(out)})
 
 @app.route("/crop_resize", methods=["POST"])
+@cached_render("crop_resize")
 def crop_resize():
     filename = request.form.get("filename")
     x1 = int(request.form.get("x1", 0)); y1 = int(request.form.get("y1", 0))
@@ -155,6 +232,10 @@ def crop_resize():
         clip.close()
     return jsonify({"output": os.path.basename(out)})
 
+@app.route("/cache_stats", methods=["GET"])
+def cache_stats():
+    return jsonify(render_cache.stats() if render_cache else {"enabled": False})
+
 @app.route("/download/<filename>", methods=["GET"])
 def download(filename):
     safe = secure_filename(filename)
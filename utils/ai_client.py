@@ -0,0 +1,463 @@
+# utils/ai_client.py
+"""
+One client for every AI call in the app.
+
+``AIClient`` tries its providers in order (Gemini, then OpenRouter) and,
+when all of them fail, returns the caller's canned ``fallback`` text if one
+was given. Each provider gets:
+
+* connection reuse: one pooled keep-alive ``requests.Session`` for HTTP
+  providers, and one cached ``GenerativeModel`` per model for Gemini;
+* a token bucket (requests per minute), plus an optional daily token budget;
+* retries with exponential backoff and full jitter for retryable failures
+  (rate limits, 5xx, timeouts);
+* a circuit breaker. After ``failure_threshold`` consecutive retryable
+  failures the provider is skipped for ``reset_after`` seconds, then one
+  trial call decides whether it is back. Other errors (a safety block, a bad
+  request) don't count: the provider did answer.
+
+Every call's latency and token usage are recorded per provider and model
+(``stats()``), and the latency also goes to the
+``external_call_duration_seconds`` histogram (utils/metrics.py).
+
+``default_client()`` builds the per-process client from the environment;
+app.py and utils/ai_connectors.py share it.
+"""
+import json
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils import metrics
+
+
+class AIError(Exception):
+    """No provider could answer (and there was no fallback)."""
+
+
+class RetryableError(AIError):
+    """A failure worth retrying: rate limited, timed out or a 5xx."""
+
+
+class Completion:
+    def __init__(self, text, provider, model, latency=0.0, input_tokens=0, output_tokens=0):
+        self.text = text
+        self.provider = provider
+        self.model = model
+        self.latency = latency
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+
+    @property
+    def is_fallback(self):
+        return self.provider == "fallback"
+
+
+# ==========================================
+#           RATE LIMITING / CIRCUIT BREAKING
+# ==========================================
+
+class TokenBucket:
+    def __init__(self, per_minute, burst=None):
+        self.rate = per_minute / 60.0
+        self.capacity = burst or max(1, per_minute // 6)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=0.0):
+        """Take one token, waiting up to ``timeout`` seconds for it. Returns False if none came."""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_after=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.reset_after else "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial:
+                self._trial = True  # let exactly one call find out whether the provider is back
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures, self.opened_at, self._trial = 0, None, False
+
+    def release(self):
+        """End a call without a verdict (e.g. a safety block): frees the half-open trial, counts nothing."""
+        with self._lock:
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+            if self.failures >= self.failure_threshold or self.opened_at is not None:
+                self.opened_at = time.monotonic()
+
+
+# ==========================================
+#           PROVIDERS
+# ==========================================
+
+class Provider:
+    name = "provider"
+
+    def __init__(self, model, per_minute=60, daily_tokens=None, timeout=30):
+        self.model = model
+        self.timeout = timeout
+        self.bucket = TokenBucket(per_minute)
+        self.breaker = CircuitBreaker()
+        self.daily_tokens = daily_tokens
+        self._day = None
+        self._tokens_today = 0
+        self._lock = threading.Lock()
+
+    @property
+    def configured(self):
+        return True
+
+    def within_budget(self):
+        if not self.daily_tokens:
+            return True
+        with self._lock:
+            if self._day != time.strftime("%Y-%m-%d"):
+                self._day, self._tokens_today = time.strftime("%Y-%m-%d"), 0
+            return self._tokens_today < self.daily_tokens
+
+    def spend(self, tokens):
+        with self._lock:
+            self._tokens_today += tokens
+
+    def generate(self, prompt, model=None, system=None, max_tokens=None, temperature=None):
+        """Return a Completion; raise RetryableError for transient failures, anything else to give up."""
+        raise NotImplementedError
+
+    def stream(self, prompt, model=None, system=None, max_tokens=None, temperature=None):
+        """Yield the answer in pieces; same errors as generate()."""
+        yield self.generate(prompt, model, system, max_tokens, temperature).text
+
+
+class GeminiProvider(Provider):
+    name = "gemini"
+    RETRYABLE_CODES = {429, 500, 502, 503, 504}
+
+    def __init__(self, api_key, model, **kwargs):
+        super().__init__(model, **kwargs)
+        self.api_key = api_key
+        self._genai = None
+        self._models = {}  # (model, system) -> GenerativeModel
+
+    @property
+    def configured(self):
+        return bool(self.api_key)
+
+    def _model(self, model, system):
+        if self._genai is None:
+            import google.generativeai as genai  # heavy (gRPC); only loaded when Gemini is used
+            genai.configure(api_key=self.api_key)
+            self._genai = genai
+        key = (model, system)
+        if key not in self._models:
+            self._models[key] = self._genai.GenerativeModel(model, system_instruction=system)
+        return self._models[key]
+
+    def _call(self, prompt, model, system, max_tokens, temperature, stream):
+        config = {k: v for k, v in (("max_output_tokens", max_tokens), ("temperature", temperature)) if v is not None}
+        try:
+            return self._model(model, system).generate_content(
+                prompt, generation_config=config or None, stream=stream,
+                request_options={"timeout": self.timeout})
+        except Exception as e:
+            raise self._classify(e) from e
+
+    def _classify(self, e):
+        if getattr(e, "code", None) in self.RETRYABLE_CODES or type(e).__name__ in (
+                "ResourceExhausted", "ServiceUnavailable", "DeadlineExceeded", "InternalServerError"):
+            return RetryableError(f"Gemini: {e}")
+        return AIError(f"Gemini: {e}")
+
+    def generate(self, prompt, model=None, system=None, max_tokens=None, temperature=None):
+        model = model or self.model
+        resp = self._call(prompt, model, system, max_tokens, temperature, stream=False)
+        try:
+            text = resp.text
+        except ValueError as e:  # blocked by safety filters: no text at all
+            raise AIError(f"Gemini returned no text: {e}") from e
+        usage = getattr(resp, "usage_metadata", None)
+        return Completion(text, self.name, model,
+                          input_tokens=getattr(usage, "prompt_token_count", 0) or 0,
+                          output_tokens=getattr(usage, "candidates_token_count", 0) or 0)
+
+    def stream(self, prompt, model=None, system=None, max_tokens=None, temperature=None):
+        chunks = self._call(prompt, model or self.model, system, max_tokens, temperature, stream=True)
+        try:
+            for chunk in chunks:
+                try: text = chunk.text
+                except ValueError: continue  # e.g. a chunk carrying only safety ratings
+                if text: yield text
+        except AIError:
+            raise
+        except Exception as e:
+            raise self._classify(e) from e
+
+
+class OpenRouterProvider(Provider):
+    name = "openrouter"
+
+    def __init__(self, api_key, model, base_url="https://openrouter.ai/api/v1", pool_size=10, **kwargs):
+        super().__init__(model, **kwargs)
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        # Keep-alive pool; retries are ours (with backoff and failover), not urllib3's
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0))
+        self.session.mount("http://", HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0))
+        self.session.headers.update({"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"})
+
+    @property
+    def configured(self):
+        return bool(self.api_key)
+
+    def _post(self, prompt, model, system, max_tokens, temperature, stream):
+        messages = ([{"role": "system", "content": system}] if system else []) + [{"role": "user", "content": prompt}]
+        payload = {"model": model, "messages": messages, "stream": stream}
+        if max_tokens is not None: payload["max_tokens"] = max_tokens
+        if temperature is not None: payload["temperature"] = temperature
+        try:
+            r = self.session.post(f"{self.base_url}/chat/completions", json=payload,
+                                  timeout=self.timeout, stream=stream)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise RetryableError(f"OpenRouter: {e}") from e
+        if r.status_code == 429 or r.status_code >= 500:
+            raise RetryableError(f"OpenRouter HTTP {r.status_code}")
+        if r.status_code >= 400:
+            raise AIError(f"OpenRouter HTTP {r.status_code}: {r.text[:200]}")
+        return r
+
+    def generate(self, prompt, model=None, system=None, max_tokens=None, temperature=None):
+        model = model or self.model
+        data = self._post(prompt, model, system, max_tokens, temperature, stream=False).json()
+        if data.get("error"):
+            raise AIError(f"OpenRouter: {data['error'].get('message', 'Unknown error')}")
+        if not data.get("choices"):
+            raise RetryableError("OpenRouter returned no choices")
+        usage = data.get("usage") or {}
+        return Completion(data["choices"][0]["message"]["content"].strip(), self.name, model,
+                          input_tokens=usage.get("prompt_tokens", 0), output_tokens=usage.get("completion_tokens", 0))
+
+    def stream(self, prompt, model=None, system=None, max_tokens=None, temperature=None):
+        r = self._post(prompt, model or self.model, system, max_tokens, temperature, stream=True)
+        with r:
+            for line in r.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data: "):
+                    continue  # blank separators and ": OPENROUTER PROCESSING" keep-alives
+                if line == "data: [DONE]":
+                    break
+                try:
+                    delta = json.loads(line[6:])["choices"][0]["delta"].get("content")
+                except (ValueError, KeyError, IndexError):
+                    continue
+                if delta:
+                    yield delta
+
+
+# ==========================================
+#           CLIENT
+# ==========================================
+
+class AIClient:
+    def __init__(self, providers, retries=2, backoff=0.5, max_backoff=8.0, rate_wait=2.0):
+        self.providers = [p for p in providers if p.configured]
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.rate_wait = rate_wait
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    @property
+    def available(self):
+        return bool(self.providers)
+
+    def _usable(self, provider):
+        if not provider.within_budget():
+            return False
+        # Breaker first: an open circuit shouldn't spend a token or wait for one
+        if not provider.breaker.allow():
+            return False
+        if not provider.bucket.acquire(self.rate_wait):
+            provider.breaker.release()
+            self._record(provider.name, provider.model, error="rate_limited")
+            return False
+        return True
+
+    def _sleep(self, attempt):
+        time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+
+    def generate(self, prompt, fallback=None, **options):
+        """Completion from the first provider that answers, else ``fallback`` (or AIError)."""
+        errors = []
+        for provider in self.providers:
+            for attempt in range(self.retries + 1):
+                if not self._usable(provider):
+                    break
+                started = time.monotonic()
+                try:
+                    result = provider.generate(prompt, **options)
+                except RetryableError as e:
+                    provider.breaker.failure()
+                    self._record(provider.name, options.get("model") or provider.model, time.monotonic() - started, error="retryable")
+                    errors.append(str(e))
+                    if attempt < self.retries:
+                        self._sleep(attempt)
+                    continue
+                except Exception as e:
+                    # The provider answered (e.g. a safety block); that says nothing about its health
+                    provider.breaker.release()
+                    self._record(provider.name, options.get("model") or provider.model, time.monotonic() - started, error="failed")
+                    errors.append(str(e))
+                    break
+                result.latency = time.monotonic() - started
+                provider.breaker.success()
+                provider.spend(result.input_tokens + result.output_tokens)
+                self._record(provider.name, result.model, result.latency, result.input_tokens, result.output_tokens)
+                return result
+        return self._fallback(fallback, errors)
+
+    def stream(self, prompt, fallback=None, **options):
+        """Yield the answer in pieces. Failover happens only before the first piece is sent."""
+        errors = []
+        for provider in self.providers:
+            for attempt in range(self.retries + 1):
+                if not self._usable(provider):
+                    break
+                started = time.monotonic()
+                sent = 0
+                try:
+                    for piece in provider.stream(prompt, **options):
+                        sent += len(piece)
+                        yield piece
+                except GeneratorExit:
+                    # The client went away mid-answer. Pieces arriving means the provider is fine
+                    if sent:
+                        provider.breaker.success()
+                        provider.spend(sent // 4)
+                    else:
+                        provider.breaker.release()
+                    raise
+                except Exception as e:
+                    retryable = isinstance(e, RetryableError)
+                    if retryable:
+                        provider.breaker.failure()
+                    else:
+                        provider.breaker.release()
+                    self._record(provider.name, options.get("model") or provider.model, time.monotonic() - started, error="retryable" if retryable else "failed")
+                    if sent:
+                        raise  # the user has already seen part of this answer
+                    errors.append(str(e))
+                    if retryable and attempt < self.retries:
+                        self._sleep(attempt)
+                        continue
+                    break
+                provider.breaker.success()
+                # Streams don't report usage consistently; ~4 characters per token is close enough for budgets
+                provider.spend(sent // 4)
+                self._record(provider.name, options.get("model") or provider.model,
+                             time.monotonic() - started, output_tokens=sent // 4)
+                return
+        yield self._fallback(fallback, errors).text
+
+    def _fallback(self, fallback, errors):
+        if fallback is None:
+            raise AIError("; ".join(errors) or "No AI provider is configured")
+        print("⚠️ All AI providers failed, using canned fallback:", "; ".join(errors))
+        self._record("fallback", "canned")
+        return Completion(fallback, "fallback", "canned")
+
+    # ==========================================
+    #           METRICS
+    # ==========================================
+
+    def _record(self, provider, model, latency=0.0, input_tokens=0, output_tokens=0, error=None):
+        if provider == "fallback":
+            metrics.inc("ai_fallbacks_total")
+        elif error != "rate_limited":  # refused locally, no call was made
+            metrics.observe("external_call_duration_seconds", latency, service=provider, outcome=error or "ok")
+        with self._lock:
+            s = self._stats.setdefault(f"{provider}:{model}", {
+                "calls": 0, "errors": {}, "latency_total": 0.0, "latency_max": 0.0,
+                "input_tokens": 0, "output_tokens": 0})
+            if error:
+                s["errors"][error] = s["errors"].get(error, 0) + 1
+            else:
+                s["calls"] += 1
+                s["input_tokens"] += input_tokens
+                s["output_tokens"] += output_tokens
+            s["latency_total"] += latency
+            s["latency_max"] = max(s["latency_max"], latency)
+
+    def stats(self):
+        with self._lock:
+            out = {}
+            for key, s in self._stats.items():
+                attempts = s["calls"] + sum(s["errors"].values())
+                out[key] = dict(s, errors=dict(s["errors"]),
+                                latency_avg=round(s["latency_total"] / attempts, 3) if attempts else None)
+        breakers = {p.name: p.breaker.state for p in self.providers}
+        return {"calls": out, "circuits": breakers}
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_client():
+    """The process-wide client, configured from the environment on first use."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            timeout = float(os.getenv("AI_TIMEOUT", 30))
+            _default = AIClient([
+                GeminiProvider(os.getenv("GEMINI_API_KEY"), os.getenv("GEMINI_MODEL", "gemini-2.5-flash-lite"),
+                               per_minute=int(os.getenv("GEMINI_RPM", 60)), timeout=timeout,
+                               daily_tokens=int(os.getenv("GEMINI_DAILY_TOKENS", 0)) or None),
+                OpenRouterProvider(os.getenv("OPENROUTER_API_KEY"),
+                                   os.getenv("OPENROUTER_MODEL", "deepseek/deepseek-r1:free"),
+                                   base_url=os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1"),
+                                   per_minute=int(os.getenv("OPENROUTER_RPM", 20)), timeout=timeout,
+                                   daily_tokens=int(os.getenv("OPENROUTER_DAILY_TOKENS", 0)) or None),
+            ], retries=int(os.getenv("AI_RETRIES", 2)))
+        return _default
@@ -0,0 +1,161 @@
+# utils/ai_stream.py
+"""
+Helpers for streaming AI output to the browser.
+
+``sse`` formats one Server-Sent Events message. The pages read these with
+fetch() rather than EventSource, because EventSource cannot POST a form.
+
+``JsonObjectStream`` parses a JSON object while it is still being generated.
+Each element of a top-level array is reported as soon as it is complete,
+as is each other top-level value, so the recommendations page can list the
+first meme idea while the model is still writing the hashtags. Any prose
+the model writes before the opening ``{`` or after the closing ``}`` (the
+usual "Here is your JSON:" or a ```json fence) is ignored, like the old
+regex did.
+"""
+import json
+
+
+def sse(event, data):
+    """One SSE message; ``data`` is sent as JSON."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class JsonObjectStream:
+    def __init__(self):
+        self.text = ""
+        self.pos = 0
+        self.start = None        # index of the top-level "{"
+        self.end = None          # index just past the matching "}"
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.key = None
+        self.expect_key = True
+        self.value_start = None  # start of the current top-level value
+        self.item_start = None   # start of the current element of a top-level array
+        self.in_array = False
+
+    def feed(self, chunk):
+        """Add generated text; returns the events it completed.
+
+        Events are ``("item", key, value)`` for one element of the array under
+        ``key`` and ``("value", key, value)`` for a finished top-level value
+        (arrays included, once they close).
+        """
+        self.text += chunk
+        events = []
+        while self.pos < len(self.text) and self.end is None:
+            self._step(self.text[self.pos], events)
+            self.pos += 1
+        return events
+
+    @property
+    def done(self):
+        return self.end is not None
+
+    def result(self):
+        """The whole object once it has closed, else None."""
+        if self.end is None:
+            return None
+        try:
+            return json.loads(self.text[self.start:self.end])
+        except ValueError:
+            return None
+
+    # ==========================================
+    #           SCANNER
+    # ==========================================
+
+    def _step(self, ch, events):
+        i = self.pos
+        if self.start is None:
+            if ch == "{":
+                self.start, self.depth = i, 1
+            return
+
+        if self.in_string:
+            if self.escape:
+                self.escape = False
+            elif ch == "\\":
+                self.escape = True
+            elif ch == '"':
+                self.in_string = False
+                self._after_value(i + 1, events, closed_string=True)
+            return
+
+        if ch in " \t\r\n":
+            self._end_primitive(i, events)
+            return
+        if ch == '"':
+            self._begin_value(i)
+            self.in_string = True
+        elif ch in "{[":
+            self._begin_value(i)
+            self.depth += 1
+            if self.depth == 2 and ch == "[":
+                self.in_array = True
+        elif ch in "}]":
+            self._end_primitive(i, events)
+            self.depth -= 1
+            if self.depth == 0:
+                self.end = i + 1
+            else:
+                self._after_value(i + 1, events)
+        elif ch == ":":
+            self.expect_key = False
+        elif ch == ",":
+            self._end_primitive(i, events)
+            if self.depth == 1:
+                self.expect_key = True
+        else:
+            self._begin_value(i)  # number, true, false or null
+
+    def _begin_value(self, i):
+        if self.depth == 1 and not self.expect_key and self.value_start is None:
+            self.value_start = i
+        elif self.depth == 2 and self.in_array and self.item_start is None:
+            self.item_start = i
+
+    def _end_primitive(self, i, events):
+        # A bare number/true/false/null has no closing character of its own
+        if self.depth == 2 and self.in_array and self.item_start is not None \
+                and self.text[self.item_start] not in '"{[':
+            self._after_value(i, events)
+        elif self.depth == 1 and self.value_start is not None and self.text[self.value_start] not in '"{[':
+            self._after_value(i, events)
+
+    def _after_value(self, end, events, closed_string=False):
+        if self.depth == 1:
+            if self.expect_key and closed_string and self.value_start is None:
+                self.key = self._load(self._string_start(end), end)
+                return
+            if self.value_start is not None:
+                value = self._load(self.value_start, end)
+                if value is not None or self.text[self.value_start:end] == "null":
+                    events.append(("value", self.key, value))
+                self.value_start, self.in_array = None, False
+        elif self.depth == 2 and self.in_array and self.item_start is not None:
+            value = self._load(self.item_start, end)
+            if value is not None:
+                events.append(("item", self.key, value))
+            self.item_start = None
+
+    def _string_start(self, end):
+        # Walk back from the closing quote to the unescaped opening one
+        i = end - 2
+        while i >= 0:
+            if self.text[i] == '"':
+                backslashes = 0
+                while i - 1 - backslashes >= 0 and self.text[i - 1 - backslashes] == "\\":
+                    backslashes += 1
+                if backslashes % 2 == 0:
+                    return i
+            i -= 1
+        return 0
+
+    def _load(self, start, end):
+        try:
+            return json.loads(self.text[start:end])
+        except ValueError:
+            return None
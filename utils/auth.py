@@ -1,40 +1,26 @@
 import sqlite3
 from werkzeug.security import generate_password_hash, check_password_hash
 
+from utils import db
+
 DB_PATH = "hypeup.db"
 
 def create_user_table():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT NOT NULL,
-                    email TEXT UNIQUE NOT NULL,
-                    password TEXT NOT NULL
-                )''')
-    conn.commit()
-    conn.close()
+    # Same schema as app.py; also renames the old ``password`` column this module used to create
+    db.migrate(DB_PATH)
 
 def register_user(username, email, password):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
     try:
         hashed_pw = generate_password_hash(password)
-        c.execute("INSERT INTO users (username, email, password) VALUES (?, ?, ?)",
-                  (username, email, hashed_pw))
-        conn.commit()
+        with db.connect(DB_PATH) as conn:
+            conn.execute("INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)",
+                         (username, email, hashed_pw))
         return True
     except sqlite3.IntegrityError:
         return False
-    finally:
-        conn.close()
 
 def validate_user(email, password):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT password FROM users WHERE email=?", (email,))
-    row = c.fetchone()
-    conn.close()
+    row = db.connect(DB_PATH).execute("SELECT password_hash FROM users WHERE email=?", (email,)).fetchone()
     if row and check_password_hash(row[0], password):
         return True
     return False
@@ -0,0 +1,270 @@
+# utils/chunked_upload.py
+"""
+Resumable chunked uploads.
+
+Protocol (see the routes in app.py):
+  1. initiate  - client sends filename + size, gets an upload id and chunk size
+  2. PUT chunk - raw bytes of chunk N, optional ``X-Chunk-Sha256`` header
+  3. status    - which chunks are still missing (used to resume)
+  4. complete  - server re-hashes the file from disk, checks the whole-file
+                 checksum and moves it into the uploads folder
+
+Chunks are streamed straight into a preallocated ``.part`` file at their
+offset, so a body is never buffered whole in memory or in a temp file. The
+whole-file checksum is the SHA-256 of the concatenated per-chunk SHA-256
+digests, which a browser can compute one slice at a time.
+
+Because initiate reserves the whole file on disk up front, each user may hold
+at most ``max_sessions_per_user`` open sessions, and all sessions together at
+most ``max_reserved_bytes``. Going over either is a 429, and a disk that
+can't hold the file is a 507.
+"""
+import errno
+import hashlib
+import os
+import shutil
+import time
+import uuid
+
+from utils import db
+
+READ_BLOCK = 1024 * 1024
+
+
+class UploadError(Exception):
+    """Client-visible upload failure; ``status`` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _connect(db_path):
+    return db.connect(db_path)
+
+
+def init_upload_tables(db_path):
+    with _connect(db_path) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute('''CREATE TABLE IF NOT EXISTS upload_sessions (
+                            id TEXT PRIMARY KEY,
+                            user_id INTEGER REFERENCES users (id) ON DELETE SET NULL,
+                            filename TEXT NOT NULL,
+                            size INTEGER NOT NULL,
+                            chunk_size INTEGER NOT NULL,
+                            total_chunks INTEGER NOT NULL,
+                            checksum TEXT,
+                            created_at REAL NOT NULL,
+                            updated_at REAL NOT NULL)''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS upload_chunks (
+                            upload_id TEXT NOT NULL,
+                            idx INTEGER NOT NULL,
+                            sha256 TEXT NOT NULL,
+                            PRIMARY KEY (upload_id, idx))''')
+        db.user_email_to_id(conn, "upload_sessions")
+        conn.commit()
+
+
+def missing_ranges(received, total):
+    """Collapse the chunk indexes not in ``received`` into [first, last] ranges."""
+    ranges, start = [], None
+    for i in range(total):
+        if i not in received:
+            if start is None: start = i
+        elif start is not None:
+            ranges.append([start, i - 1]); start = None
+    if start is not None:
+        ranges.append([start, total - 1])
+    return ranges
+
+
+class UploadSessions:
+    def __init__(self, db_path, upload_folder, chunk_size=8 * 1024 * 1024, max_size=2 * 1024 ** 3,
+                 expire_after=24 * 3600, max_sessions_per_user=3, max_reserved_bytes=0):
+        self.db_path = db_path
+        self.upload_folder = upload_folder
+        self.partial_folder = os.path.join(upload_folder, ".partial")
+        self.chunk_size = chunk_size
+        self.max_size = max_size
+        self.expire_after = expire_after
+        self.max_sessions_per_user = max_sessions_per_user
+        self.max_reserved_bytes = max_reserved_bytes  # 0 = no limit
+        self._ready = False
+
+    def _conn(self):
+        if not self._ready:
+            init_upload_tables(self.db_path)
+            os.makedirs(self.partial_folder, exist_ok=True)
+            self._ready = True
+        return _connect(self.db_path)
+
+    def _part_path(self, upload_id):
+        return os.path.join(self.partial_folder, f"{upload_id}.part")
+
+    def _session(self, conn, upload_id, user_id):
+        row = conn.execute("SELECT * FROM upload_sessions WHERE id = ?", (upload_id,)).fetchone()
+        if row is None or user_id is None or row["user_id"] != user_id:
+            raise UploadError("Upload not found", 404)
+        return row
+
+    # ==========================================
+    #           PROTOCOL STEPS
+    # ==========================================
+
+    def initiate(self, user_id, filename, size, checksum=None):
+        """Create a session and preallocate the part file. ``filename`` must already be unique."""
+        if user_id is None:
+            raise UploadError("Your account no longer exists. Please log in again.", 401)
+        if size <= 0:
+            raise UploadError("File is empty")
+        if size > self.max_size:
+            raise UploadError(f"File too large (max {self.max_size // (1024 * 1024)} MB)", 413)
+        self.expire_stale()
+
+        upload_id = uuid.uuid4().hex
+        total = (size + self.chunk_size - 1) // self.chunk_size
+        now = time.time()
+        with self._conn() as conn:
+            # Check and reserve in one write transaction, so parallel initiates can't both slip under a limit
+            conn.execute("BEGIN IMMEDIATE")
+            mine = conn.execute("SELECT COUNT(*) FROM upload_sessions WHERE user_id = ?", (user_id,)).fetchone()[0]
+            if self.max_sessions_per_user and mine >= self.max_sessions_per_user:
+                raise UploadError(f"You already have {mine} uploads in progress. Finish or cancel one first.", 429)
+            if self.max_reserved_bytes:
+                reserved = conn.execute("SELECT COALESCE(SUM(size), 0) FROM upload_sessions").fetchone()[0]
+                if reserved + size > self.max_reserved_bytes:
+                    raise UploadError("Too many uploads in progress, please try again later.", 429)
+            conn.execute('''INSERT INTO upload_sessions (id, user_id, filename, size, chunk_size, total_chunks,
+                            checksum, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                         (upload_id, user_id, filename, size, self.chunk_size, total, checksum, now, now))
+            conn.commit()
+
+        try:
+            if shutil.disk_usage(self.partial_folder).free < size:
+                raise OSError("not enough free space")
+            with open(self._part_path(upload_id), "wb") as f:
+                try:
+                    os.posix_fallocate(f.fileno(), 0, size)
+                except (AttributeError, OSError) as e:
+                    if getattr(e, "errno", None) in (errno.ENOSPC, errno.EDQUOT):
+                        raise
+                    f.truncate(size)  # no fallocate here (platform or filesystem)
+        except OSError:
+            self._drop(upload_id)
+            raise UploadError("Not enough disk space for this upload", 507)
+        return {"upload_id": upload_id, "filename": filename, "chunk_size": self.chunk_size, "total_chunks": total}
+
+    def write_chunk(self, user_id, upload_id, index, stream, expected_sha256=None):
+        """Stream chunk ``index`` from ``stream`` into place, verifying its length and checksum."""
+        with self._conn() as conn:
+            session = self._session(conn, upload_id, user_id)
+        if not 0 <= index < session["total_chunks"]:
+            raise UploadError("Chunk index out of range")
+
+        offset = index * session["chunk_size"]
+        expected_len = min(session["chunk_size"], session["size"] - offset)
+        digest = hashlib.sha256()
+        written = 0
+        fd = os.open(self._part_path(upload_id), os.O_WRONLY)
+        try:
+            while True:
+                block = stream.read(min(READ_BLOCK, expected_len - written + 1))
+                if not block:
+                    break
+                if written + len(block) > expected_len:
+                    raise UploadError(f"Chunk {index} is larger than {expected_len} bytes")
+                digest.update(block)
+                os.pwrite(fd, block, offset + written)
+                written += len(block)
+        finally:
+            os.close(fd)
+
+        if written != expected_len:
+            raise UploadError(f"Chunk {index} is incomplete ({written}/{expected_len} bytes)")
+        sha = digest.hexdigest()
+        if expected_sha256 and expected_sha256.lower() != sha:
+            raise UploadError(f"Checksum mismatch for chunk {index}", 422)
+
+        with self._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO upload_chunks (upload_id, idx, sha256) VALUES (?, ?, ?)",
+                         (upload_id, index, sha))
+            conn.execute("UPDATE upload_sessions SET updated_at = ? WHERE id = ?", (time.time(), upload_id))
+            conn.commit()
+        return {"index": index, "sha256": sha}
+
+    def status(self, user_id, upload_id):
+        with self._conn() as conn:
+            session = self._session(conn, upload_id, user_id)
+            received = {r[0] for r in conn.execute("SELECT idx FROM upload_chunks WHERE upload_id = ?", (upload_id,))}
+        return {
+            "upload_id": upload_id,
+            "filename": session["filename"],
+            "size": session["size"],
+            "chunk_size": session["chunk_size"],
+            "total_chunks": session["total_chunks"],
+            "received": len(received),
+            "missing": missing_ranges(received, session["total_chunks"]),
+        }
+
+    def complete(self, user_id, upload_id, checksum=None):
+        """Verify the assembled file and move it into the uploads folder. Returns the filename.
+
+        ``checksum`` overrides the one given at initiate (clients usually only
+        know it once every chunk has been hashed).
+        """
+        with self._conn() as conn:
+            session = self._session(conn, upload_id, user_id)
+            chunks = conn.execute("SELECT idx, sha256 FROM upload_chunks WHERE upload_id = ? ORDER BY idx",
+                                  (upload_id,)).fetchall()
+        if len(chunks) != session["total_chunks"]:
+            raise UploadError("Upload is missing chunks", 409)
+
+        # Re-read from disk so a chunk that was acknowledged but not persisted is caught here
+        composite = hashlib.sha256()
+        part = self._part_path(upload_id)
+        with open(part, "rb") as f:
+            for idx, recorded in chunks:
+                h = hashlib.sha256()
+                remaining = min(session["chunk_size"], session["size"] - idx * session["chunk_size"])
+                while remaining:
+                    block = f.read(min(READ_BLOCK, remaining))
+                    if not block: break
+                    h.update(block)
+                    remaining -= len(block)
+                if h.hexdigest() != recorded:
+                    raise UploadError(f"Chunk {idx} is corrupt on disk, please re-send it", 409)
+                composite.update(h.digest())
+        expected = checksum or session["checksum"]
+        if expected and expected.lower() != composite.hexdigest():
+            raise UploadError("Whole-file checksum mismatch", 422)
+
+        os.replace(part, os.path.join(self.upload_folder, session["filename"]))
+        self._drop(upload_id)
+        return session["filename"]
+
+    def abort(self, user_id, upload_id):
+        with self._conn() as conn:
+            self._session(conn, upload_id, user_id)
+        self._drop(upload_id)
+
+    # ==========================================
+    #           CLEANUP
+    # ==========================================
+
+    def _drop(self, upload_id):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM upload_chunks WHERE upload_id = ?", (upload_id,))
+            conn.execute("DELETE FROM upload_sessions WHERE id = ?", (upload_id,))
+            conn.commit()
+        try:
+            os.remove(self._part_path(upload_id))
+        except FileNotFoundError:
+            pass
+
+    def expire_stale(self):
+        """Drop sessions that have not received a chunk for ``expire_after`` seconds."""
+        cutoff = time.time() - self.expire_after
+        with self._conn() as conn:
+            stale = [r[0] for r in conn.execute("SELECT id FROM upload_sessions WHERE updated_at < ?", (cutoff,))]
+        for upload_id in stale:
+            self._drop(upload_id)
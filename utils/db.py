@@ -0,0 +1,205 @@
+# utils/db.py
+"""
+Shared SQLite access.
+
+``connect`` hands out one connection per (process, thread, database file) and
+keeps it open, so a request no longer pays for opening the file, reading the
+schema and re-preparing its statements; sqlite3 caches prepared statements
+per connection, which only pays off once connections live longer than one
+query. Connections are opened in WAL mode, so readers never block the writer
+(and vice versa), with a busy timeout so a writer that does hit a lock waits
+for it instead of failing with "database is locked".
+
+Use the connection as a context manager, exactly like a fresh one: the block
+commits on success and rolls back on error. Never ``close()`` it.
+
+Every statement is timed into the ``sqlite_query_duration_seconds``
+histogram (utils/metrics.py), labelled by operation and table.
+
+``migrate`` brings the app's own tables (users, goals) up to date. Each step
+runs once, tracked by ``PRAGMA user_version``. Everything a user owns is keyed
+by ``users.id``, never by the email, which the user can change.
+"""
+import functools
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from utils import metrics
+
+BUSY_TIMEOUT = 10  # seconds
+CACHED_STATEMENTS = 256
+
+_local = threading.local()
+
+
+@functools.lru_cache(maxsize=1024)
+def _statement_labels(sql):
+    """("SELECT", "goals")-style labels for a statement; the app's SQL is a fixed set of strings."""
+    words = sql.split(None, 1)
+    table = re.search(r"\b(?:FROM|INTO|UPDATE|TABLE(?: IF NOT EXISTS)?|ON)\s+(\w+)", sql, re.IGNORECASE)
+    return (words[0].upper() if words else ""), (table.group(1) if table else "")
+
+
+class _TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            op, table = _statement_labels(sql)
+            metrics.observe("sqlite_query_duration_seconds", time.perf_counter() - started, op=op, table=table)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            op, table = _statement_labels(sql)
+            metrics.observe("sqlite_query_duration_seconds", time.perf_counter() - started, op=op, table=table)
+
+
+class _TimedConnection(sqlite3.Connection):
+    """Connection whose statements (via conn.execute or its cursors) are timed into utils.metrics."""
+
+    def cursor(self, factory=_TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def _open(db_path):
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT, cached_statements=CACHED_STATEMENTS,
+                           factory=_TimedConnection)
+    conn.row_factory = sqlite3.Row
+    # WAL is persistent in the file, but asking again is cheap and covers fresh databases
+    conn.execute("PRAGMA journal_mode=WAL")
+    # With WAL, NORMAL only risks the last commits on power loss, never corruption
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT * 1000}")
+    # Off by default in SQLite; needed for goals to go with their user (ON DELETE CASCADE)
+    conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+
+def connect(db_path):
+    """The calling thread's connection to ``db_path``, opened on first use."""
+    # A forked child inherits the parent's thread-locals; SQLite handles must not cross fork
+    if getattr(_local, "pid", None) != os.getpid():
+        _local.pid = os.getpid()
+        _local.conns = {}
+    key = os.path.abspath(db_path)
+    conn = _local.conns.get(key)
+    if conn is None:
+        conn = _local.conns[key] = _open(db_path)
+    return conn
+
+
+def close_all():
+    """Close this thread's connections (e.g. before a worker exits)."""
+    for conn in getattr(_local, "conns", {}).values():
+        conn.close()
+    _local.conns = {}
+
+
+# ==========================================
+#           MIGRATIONS
+# ==========================================
+
+def _columns(conn, table):
+    return {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _indexed(conn, table, column):
+    """True if some single-column index (including a UNIQUE constraint's) starts with ``column``."""
+    for index in conn.execute(f"PRAGMA index_list({table})").fetchall():
+        cols = [r["name"] for r in conn.execute(f"PRAGMA index_info('{index['name']}')")]
+        if cols[:1] == [column]:
+            return True
+    return False
+
+
+def _base_tables(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS users (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        username TEXT NOT NULL, email TEXT UNIQUE NOT NULL,
+                        password_hash TEXT NOT NULL)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS goals (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        task TEXT NOT NULL, duration TEXT NOT NULL,
+                        completed BOOLEAN NOT NULL CHECK (completed IN (0, 1)))''')
+
+
+def _users_password_hash(conn):
+    # utils/auth.py used to create users with a ``password`` column holding the hash
+    columns = _columns(conn, "users")
+    if "password" in columns and "password_hash" not in columns:
+        conn.execute("ALTER TABLE users RENAME COLUMN password TO password_hash")
+
+
+def _users_indexes(conn):
+    # email is normally covered by its UNIQUE constraint's automatic index
+    if not _indexed(conn, "users", "email"):
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email ON users (email)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users (username)")
+
+
+def _goals_user_id(conn):
+    # Goals used to be shared by everyone, so there is no telling who wrote them. On a single-user
+    # install they go to that account; otherwise they stay unowned (hidden) rather than handing every
+    # account's goals to whoever signed up first.
+    if "user_id" not in _columns(conn, "goals"):
+        conn.execute("ALTER TABLE goals ADD COLUMN user_id INTEGER REFERENCES users (id) ON DELETE CASCADE")
+    if conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 1:
+        conn.execute("UPDATE goals SET user_id = (SELECT id FROM users) WHERE user_id IS NULL")
+    # Serves both "this user's goals, newest first" (keyset pages) and the per-user counts
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_goals_user ON goals (user_id, id DESC)")
+
+
+def user_email_to_id(conn, table):
+    """Re-key ``table`` from a ``user`` column holding the owner's email to ``user_id`` (users.id).
+
+    For the job and export tables, which their modules create themselves. Idempotent; run it inside the
+    caller's write transaction. Indexes on ``user`` are dropped with it, so recreate yours afterwards.
+    Rows whose email matches no account keep a NULL owner and are hidden, like unowned goals.
+    """
+    columns = _columns(conn, table)
+    if "user" not in columns:
+        return
+    if "user_id" not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN user_id INTEGER REFERENCES users (id) ON DELETE SET NULL")
+    conn.execute(f"UPDATE {table} SET user_id = (SELECT id FROM users WHERE users.email = {table}.user) "
+                 "WHERE user_id IS NULL")
+    for index in conn.execute(f"PRAGMA index_list({table})").fetchall():
+        if index["origin"] == "c" and "user" in [r["name"] for r in conn.execute(f"PRAGMA index_info('{index['name']}')")]:
+            conn.execute(f"DROP INDEX {index['name']}")
+    conn.execute(f"ALTER TABLE {table} DROP COLUMN user")
+
+
+MIGRATIONS = [
+    _base_tables,
+    _users_password_hash,
+    _users_indexes,
+    _goals_user_id,
+]
+
+
+def migrate(db_path):
+    """Apply pending MIGRATIONS to ``db_path``. Safe to call from every worker at startup."""
+    conn = connect(db_path)
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= len(MIGRATIONS):
+        return 0
+    with conn:
+        # Take the write lock first so concurrent workers apply each step exactly once
+        conn.execute("BEGIN IMMEDIATE")
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for step in MIGRATIONS[version:]:
+            step(conn)
+        conn.execute(f"PRAGMA user_version={len(MIGRATIONS)}")
+    return len(MIGRATIONS) - version
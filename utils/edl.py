@@ -0,0 +1,325 @@
+# utils/edl.py
+"""
+Edit-decision lists (EDLs): a whole timeline rendered in one ffmpeg pass.
+
+An EDL is plain JSON::
+
+    {
+      "output":   {"width": 1280, "height": 720, "fps": 30},          # optional
+      "clips":    [{"source": "a.mp4", "start": 2, "end": 7.5,
+                    "speed": 1.0, "volume": 1.0, "mute": false,
+                    "crop": {"x1": 0, "y1": 0, "x2": 640, "y2": 360}}],
+      "overlays": [{"type": "text", "text": "Hello", "start": 0, "end": 3,
+                    "position": "bottom", "fontsize": 50, "color": "white",
+                    "shadow": false, "box": null}],
+      "audio":    [{"source": "song.mp3", "start": 0, "offset": 12,
+                    "duration": null, "volume": 0.6, "loop": true}]
+    }
+
+Clips play back to back; overlay and audio times are on the output timeline.
+``validate`` normalizes the JSON (and is where user-facing errors come from);
+``render`` compiles it into a single filter graph, so a trim + caption +
+soundtrack edit is decoded and encoded exactly once.
+"""
+import json
+import os
+import tempfile
+
+from PIL import ImageColor
+
+from utils import ffmpeg_tools, scratch, text_render
+from utils.media_index import media_kind
+
+MAX_CLIPS = 50
+MAX_OVERLAYS = 50
+MAX_AUDIO_TRACKS = 8
+MAX_SIDE = 3840
+SPEED_RANGE = (0.25, 4.0)
+VOLUME_RANGE = (0.0, 4.0)
+TEXT_POSITIONS = text_render.POSITIONS
+SAMPLE_RATE = 48000
+
+
+def _num(value, name, default=None, low=None, high=None):
+    if value is None or value == "":
+        if default is None:
+            raise ValueError(f"Missing {name}")
+        return default
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a number")
+    if (low is not None and number < low) or (high is not None and number > high):
+        raise ValueError(f"{name} must be between {low} and {high}")
+    return number
+
+
+def _even(n):
+    return max(int(n) // 2 * 2, 2)
+
+
+# ==========================================
+#           VALIDATION
+# ==========================================
+
+def validate_caption(o, label, timeline):
+    """Normalize one text overlay / timed caption; ``label`` (e.g. "Overlay 2") prefixes its errors."""
+    if not isinstance(o, dict) or o.get("type", "text") != "text":
+        raise ValueError(f"{label}: only text overlays are supported")
+    text = str(o.get("text") or "").strip()
+    if not text or len(text) > 500:
+        raise ValueError(f"{label}: text must be 1-500 characters")
+    start = _num(o.get("start"), f"{label.lower()} start", 0, 0)
+    end = min(_num(o.get("end"), f"{label.lower()} end", timeline, 0), timeline)
+    if start >= end:
+        raise ValueError(f"{label}: invalid start/end times")
+    position = o.get("position") or "bottom"
+    if position not in TEXT_POSITIONS:
+        raise ValueError(f"{label}: position must be one of {', '.join(TEXT_POSITIONS)}")
+    colors = {}
+    for key, default, name in (("color", "white", "color"), ("box", None, "box color")):
+        color = str(o.get(key) or default or "")[:32] or None
+        if color:
+            try:
+                ImageColor.getrgb(color)
+            except ValueError:
+                raise ValueError(f"{label}: unknown {name} {color!r}")
+        colors[key] = color
+    return {"type": "text", "text": text, "start": start, "end": end, "position": position,
+            "fontsize": int(_num(o.get("fontsize"), f"{label.lower()} fontsize", 50, 8, 400)),
+            "color": colors["color"], "shadow": bool(o.get("shadow")), "box": colors["box"]}
+
+
+def parse(raw):
+    """Accept a JSON string or an already-decoded dict."""
+    if isinstance(raw, (str, bytes)):
+        try:
+            raw = json.loads(raw)
+        except ValueError:
+            raise ValueError("Edit list is not valid JSON")
+    if not isinstance(raw, dict):
+        raise ValueError("Edit list must be a JSON object")
+    return raw
+
+
+def validate(raw, upload_folder, media=None):
+    """Check an EDL against the uploads folder and return it normalized.
+
+    Clip ends default to (and are clamped to) the source duration, and the
+    output size/fps default to the first clip's. Raises ValueError with a
+    user-facing message.
+    """
+    edl = parse(raw)
+    infos = {}
+
+    def info_for(item, kinds):
+        if not isinstance(item, dict):
+            raise ValueError("Every clip, overlay and audio track must be a JSON object")
+        name = item.get("source")
+        if not isinstance(name, str) or not name or media_kind(name) not in kinds:
+            raise ValueError(f"Unsupported source: {name!r}")
+        if os.path.basename(name) != name or not os.path.isfile(os.path.join(upload_folder, name)):
+            raise ValueError(f"File not found: {name}")
+        if name not in infos:
+            infos[name] = media.probe_info(name) if media else ffmpeg_tools.probe(os.path.join(upload_folder, name))
+        return infos[name]
+
+    clips_in = edl.get("clips") or []
+    if not isinstance(clips_in, list) or not clips_in:
+        raise ValueError("Add at least one clip to the timeline")
+    if len(clips_in) > MAX_CLIPS:
+        raise ValueError(f"Too many clips (max {MAX_CLIPS})")
+
+    clips = []
+    for n, c in enumerate(clips_in, 1):
+        info = info_for(c, ("video",))
+        if not info["video_codec"]:
+            raise ValueError(f"Clip {n}: {c['source']} has no video")
+        duration = info["duration"] or 0
+        start = _num(c.get("start"), f"clip {n} start", 0, 0)
+        end = _num(c.get("end"), f"clip {n} end", duration, 0)
+        end = min(end, duration) if duration else end
+        if start >= end:
+            raise ValueError(f"Clip {n}: invalid start/end times")
+        clip = {
+            "source": c["source"], "start": start, "end": end,
+            "speed": _num(c.get("speed"), f"clip {n} speed", 1.0, *SPEED_RANGE),
+            "volume": _num(c.get("volume"), f"clip {n} volume", 1.0, *VOLUME_RANGE),
+            "mute": bool(c.get("mute")) or not info["audio_codec"],
+            "crop": None,
+        }
+        crop = c.get("crop")
+        if crop:
+            if not isinstance(crop, dict):
+                raise ValueError(f"Clip {n}: crop must be an object with x1, y1, x2, y2")
+            x1, y1 = int(_num(crop.get("x1"), "crop x1", 0, 0)), int(_num(crop.get("y1"), "crop y1", 0, 0))
+            x2 = int(_num(crop.get("x2"), "crop x2", info["width"], 0, info["width"]))
+            y2 = int(_num(crop.get("y2"), "crop y2", info["height"], 0, info["height"]))
+            if x2 - x1 < 2 or y2 - y1 < 2:
+                raise ValueError(f"Clip {n}: crop area is empty")
+            clip["crop"] = {"x1": x1, "y1": y1, "x2": x2, "y2": y2}
+        clips.append(clip)
+
+    timeline = sum((c["end"] - c["start"]) / c["speed"] for c in clips)
+
+    first, first_info = clips[0], infos[clips[0]["source"]]
+    out = edl.get("output") or {}
+    if not isinstance(out, dict):
+        raise ValueError("Output must be an object with width, height and fps")
+    default_w = (first["crop"]["x2"] - first["crop"]["x1"]) if first["crop"] else first_info["width"]
+    default_h = (first["crop"]["y2"] - first["crop"]["y1"]) if first["crop"] else first_info["height"]
+    output = {
+        "width": _even(_num(out.get("width"), "output width", default_w, 16, MAX_SIDE)),
+        "height": _even(_num(out.get("height"), "output height", default_h, 16, MAX_SIDE)),
+        "fps": _num(out.get("fps"), "output fps", first_info["fps"] or 30, 1, 120),
+    }
+
+    overlays_in = edl.get("overlays") or []
+    if not isinstance(overlays_in, list):
+        raise ValueError("Overlays must be a list")
+    if len(overlays_in) > MAX_OVERLAYS:
+        raise ValueError(f"Too many overlays (max {MAX_OVERLAYS})")
+    overlays = [validate_caption(o, f"Overlay {n}", timeline) for n, o in enumerate(overlays_in, 1)]
+
+    tracks_in = edl.get("audio") or []
+    if not isinstance(tracks_in, list):
+        raise ValueError("Audio tracks must be a list")
+    if len(tracks_in) > MAX_AUDIO_TRACKS:
+        raise ValueError(f"Too many audio tracks (max {MAX_AUDIO_TRACKS})")
+    tracks = []
+    for n, a in enumerate(tracks_in, 1):
+        info = info_for(a, ("audio", "video"))
+        if not info["audio_codec"]:
+            raise ValueError(f"Audio track {n}: {a.get('source')} has no audio")
+        start = _num(a.get("start"), f"audio {n} start", 0, 0, timeline)
+        offset = _num(a.get("offset"), f"audio {n} offset", 0, 0)
+        loop = bool(a.get("loop"))
+        available = timeline - start if loop else max((info["duration"] or 0) - offset, 0)
+        duration = min(_num(a.get("duration"), f"audio {n} duration", available, 0), available, timeline - start)
+        if duration <= 0:
+            raise ValueError(f"Audio track {n} is empty")
+        tracks.append({"source": a["source"], "start": start, "offset": offset, "duration": duration,
+                       "volume": _num(a.get("volume"), f"audio {n} volume", 1.0, *VOLUME_RANGE), "loop": loop})
+
+    return {"output": output, "clips": clips, "overlays": overlays, "audio": tracks}
+
+
+def duration(edl):
+    return sum((c["end"] - c["start"]) / c["speed"] for c in edl["clips"])
+
+
+# ==========================================
+#           TEXT OVERLAYS
+# ==========================================
+
+def _text_png(overlay, max_width, path, scale=1.0):
+    """Rasterize a caption (white fill, black stroke by default) to a tight RGBA PNG."""
+    text_render.render_caption(overlay, max_width, scale).image().save(path)
+
+
+_OVERLAY_Y = {"top": "main_h*0.05", "center": "(main_h-overlay_h)/2", "bottom": "main_h-overlay_h-main_h*0.05"}
+
+
+# ==========================================
+#           FILTER GRAPH
+# ==========================================
+
+def _atempo(speed):
+    # atempo only takes 0.5-2.0 per instance, so chain them for larger changes
+    steps = []
+    while speed > 2.0:
+        steps.append("atempo=2.0"); speed /= 2.0
+    while speed < 0.5:
+        steps.append("atempo=0.5"); speed /= 0.5
+    if abs(speed - 1.0) > 1e-6:
+        steps.append(f"atempo={speed:.6f}")
+    return steps
+
+
+def build_command(edl, paths, output_path, tmp_dir, preview=False, crop_scale=None):
+    """Compile a validated EDL into ffmpeg arguments (inputs + filter_complex + encoder).
+
+    ``paths`` maps each source name to the file actually read (the proxy when
+    previewing); ``crop_scale`` maps a source to read-height / original-height
+    so crops written against the original land in the same place on a proxy.
+    Overlay images are written to ``tmp_dir``.
+    """
+    out = edl["output"]
+    W, H, fps = out["width"], out["height"], out["fps"]
+    if preview and H > 360:
+        W, H = _even(W * 360 / H), 360
+    audio_fmt = f"aformat=sample_fmts=fltp:sample_rates={SAMPLE_RATE}:channel_layouts=stereo"
+
+    args, graph, concat_in = [], [], []
+    n_inputs = 0
+    for i, clip in enumerate(edl["clips"]):
+        length = clip["end"] - clip["start"]
+        played = length / clip["speed"]
+        args += ["-ss", f"{clip['start']:.6f}", "-t", f"{length:.6f}", "-i", paths[clip["source"]]]
+        src = n_inputs
+        n_inputs += 1
+
+        vf = [f"setpts=(PTS-STARTPTS)/{clip['speed']:.6f}"]
+        if clip["crop"]:
+            c = clip["crop"]
+            k = (crop_scale or {}).get(clip["source"], 1.0)
+            vf.append(f"crop={_even((c['x2'] - c['x1']) * k)}:{_even((c['y2'] - c['y1']) * k)}:"
+                      f"{int(c['x1'] * k)}:{int(c['y1'] * k)}")
+        vf += [f"scale={W}:{H}:force_original_aspect_ratio=decrease",
+               f"pad={W}:{H}:(ow-iw)/2:(oh-ih)/2", "setsar=1", f"fps={fps}", "format=yuv420p"]
+        graph.append(f"[{src}:v:0]{','.join(vf)}[v{i}]")
+
+        if clip["mute"]:
+            graph.append(f"anullsrc=r={SAMPLE_RATE}:cl=stereo,atrim=duration={played:.6f}[a{i}]")
+        else:
+            af = ["asetpts=PTS-STARTPTS", *_atempo(clip["speed"])]
+            if clip["volume"] != 1.0:
+                af.append(f"volume={clip['volume']:.3f}")
+            # Pad/cut to the video length so concat segments stay in sync
+            af += [audio_fmt, "apad", f"atrim=duration={played:.6f}"]
+            graph.append(f"[{src}:a:0]{','.join(af)}[a{i}]")
+        concat_in.append(f"[v{i}][a{i}]")
+
+    graph.append(f"{''.join(concat_in)}concat=n={len(edl['clips'])}:v=1:a=1[vcat][acat]")
+    video_label = "vcat"
+
+    for j, overlay in enumerate(edl["overlays"]):
+        png = os.path.join(tmp_dir, f"overlay{j:03d}.png")
+        _text_png(overlay, W * 0.9, png, scale=H / edl["output"]["height"])
+        args += ["-i", png]
+        graph.append(f"[{video_label}][{n_inputs}:v]overlay=x=(main_w-overlay_w)/2:y={_OVERLAY_Y[overlay['position']]}:"
+                     f"enable='between(t,{overlay['start']:.3f},{overlay['end']:.3f})'[vo{j}]")
+        video_label = f"vo{j}"
+        n_inputs += 1
+
+    mix = ["[acat]"]
+    for k, track in enumerate(edl["audio"]):
+        if track["loop"]:
+            args += ["-stream_loop", "-1"]
+        args += ["-ss", f"{track['offset']:.6f}", "-i", paths[track["source"]]]
+        delay = int(track["start"] * 1000)
+        af = [f"atrim=duration={track['duration']:.6f}", "asetpts=PTS-STARTPTS", audio_fmt]
+        if track["volume"] != 1.0:
+            af.append(f"volume={track['volume']:.3f}")
+        if delay:
+            af.append(f"adelay={delay}:all=1")
+        graph.append(f"[{n_inputs}:a:0]{','.join(af)}[at{k}]")
+        mix.append(f"[at{k}]")
+        n_inputs += 1
+    if len(mix) > 1:
+        graph.append(f"{''.join(mix)}amix=inputs={len(mix)}:duration=first:normalize=0[aout]")
+        audio_label = "aout"
+    else:
+        audio_label = "acat"
+
+    encode = ["-c:v", "libx264", "-preset", "ultrafast" if preview else "medium", "-crf", "28" if preview else "20",
+              "-c:a", "aac", "-b:a", "96k" if preview else "192k"]
+    return [*args, "-filter_complex", ";".join(graph), "-map", f"[{video_label}]", "-map", f"[{audio_label}]",
+            *encode, "-movflags", "+faststart", output_path]
+
+
+def render(edl, paths, output_path, progress=None, preview=False, crop_scale=None):
+    """Render a validated EDL to ``output_path`` in a single ffmpeg invocation."""
+    with tempfile.TemporaryDirectory(prefix="edl_", dir=scratch.current()) as tmp:
+        args = build_command(edl, paths, output_path, tmp, preview=preview, crop_scale=crop_scale)
+        ffmpeg_tools.run_ffmpeg_progress(args, duration(edl), progress)
@@ -0,0 +1,306 @@
+# utils/exports.py
+"""
+Streaming export of a user's account data.
+
+Everything is written incrementally. Rows come straight off SQLite cursors,
+and media files are copied in ``CHUNK_SIZE`` pieces, so an export holds one
+row or one chunk in memory at a time, however big the account is.
+
+Formats:
+
+* ``json``: one document (user, statistics, goals, render_jobs, media).
+* ``ndjson``: one ``{"type": ..., ...}`` record per line.
+* ``zip``: ``data.json`` plus every media file the user's renders used or
+  produced, under ``media/``. Zip members are written with data descriptors,
+  so the archive streams to a non-seekable response too.
+
+``ExportJobs`` runs the same export in the background into ``folder`` for
+accounts too big to download in one request. Each job is a row in
+``data_exports``, and the finished file is served from a download link until
+``ttl`` runs out.
+"""
+import json
+import os
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from utils import db
+
+CHUNK_SIZE = 1024 * 1024
+FORMATS = {
+    "json": ("application/json", "json"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "zip": ("application/zip", "zip"),
+}
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+# Render params/results that name files in the uploads folder
+_MEDIA_KEYS = ("video", "videos", "audio", "source", "output")
+
+
+def _connect(db_path):
+    return db.connect(db_path)
+
+
+def _has_table(conn, name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone() is not None
+
+
+# ==========================================
+#           RECORDS
+# ==========================================
+
+def _user(conn, user_id):
+    row = conn.execute("SELECT id, username, email FROM users WHERE id = ?", (user_id,)).fetchone()
+    if row is None:
+        raise LookupError(f"No user {user_id}")
+    return row
+
+
+def _statistics(conn, user_id):
+    stats = dict(conn.execute('''SELECT COUNT(*) AS total_goals, COALESCE(SUM(completed), 0) AS completed_goals
+                                 FROM goals WHERE user_id = ?''', (user_id,)).fetchone())
+    if _has_table(conn, "render_jobs"):
+        stats["render_jobs"] = conn.execute("SELECT COUNT(*) FROM render_jobs WHERE user_id = ?", (user_id,)).fetchone()[0]
+    return stats
+
+
+def _goals(conn, user_id):
+    for row in conn.execute("SELECT task, duration, completed FROM goals WHERE user_id = ? ORDER BY id", (user_id,)):
+        yield {"task": row["task"], "duration": row["duration"], "completed": bool(row["completed"])}
+
+
+def _render_jobs(conn, user_id):
+    if not _has_table(conn, "render_jobs"):
+        return
+    for row in conn.execute('''SELECT id, action, params, status, result, error, created_at, finished_at
+                               FROM render_jobs WHERE user_id = ? ORDER BY created_at''', (user_id,)):
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        yield job
+
+
+def _media_names(value):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key in _MEDIA_KEYS and isinstance(item, str):
+                yield item
+            elif key in _MEDIA_KEYS and isinstance(item, list):
+                yield from (name for name in item if isinstance(name, str))
+            else:
+                yield from _media_names(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _media_names(item)
+
+
+def _media(conn, user_id, upload_folder):
+    """``(filename, path, size)`` of each existing upload the user's renders read or wrote."""
+    seen = set()
+    for job in _render_jobs(conn, user_id):
+        for name in _media_names([job["params"], job["result"]]):
+            name = os.path.basename(name)
+            path = os.path.join(upload_folder, name)
+            if name in seen or not os.path.isfile(path):
+                continue
+            seen.add(name)
+            yield name, path, os.path.getsize(path)
+
+
+# ==========================================
+#           WRITERS
+# ==========================================
+
+def iter_json(db_path, upload_folder, user_id):
+    """The export as one JSON document, yielded in small text pieces."""
+    conn = _connect(db_path)
+    user = _user(conn, user_id)
+    yield '{\n  "exported_at": %s,\n' % json.dumps(datetime.now().isoformat())
+    yield '  "user": %s,\n' % json.dumps({"username": user["username"], "email": user["email"]})
+    yield '  "statistics": %s' % json.dumps(_statistics(conn, user_id))
+    for key, records in (("goals", _goals(conn, user_id)),
+                         ("render_jobs", _render_jobs(conn, user_id)),
+                         ("media", ({"filename": n, "size": s} for n, _, s in _media(conn, user_id, upload_folder)))):
+        yield ',\n  "%s": [' % key
+        for i, record in enumerate(records):
+            yield ("," if i else "") + "\n    " + json.dumps(record)
+        yield "\n  ]"
+    yield "\n}\n"
+
+
+def iter_ndjson(db_path, upload_folder, user_id):
+    conn = _connect(db_path)
+    user = _user(conn, user_id)
+    yield json.dumps({"type": "user", "username": user["username"], "email": user["email"],
+                      "exported_at": datetime.now().isoformat()}) + "\n"
+    yield json.dumps({"type": "statistics", **_statistics(conn, user_id)}) + "\n"
+    for goal in _goals(conn, user_id):
+        yield json.dumps({"type": "goal", **goal}) + "\n"
+    for job in _render_jobs(conn, user_id):
+        yield json.dumps({"type": "render_job", **job}) + "\n"
+    for name, _, size in _media(conn, user_id, upload_folder):
+        yield json.dumps({"type": "media", "filename": name, "size": size}) + "\n"
+
+
+class _Sink:
+    """Write-only, unseekable file object that collects what zipfile writes until it is drained."""
+
+    def __init__(self):
+        self._parts = []
+        self._written = 0
+        self.pending = 0
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._written += len(data)
+        self.pending += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._written
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data, self._parts, self.pending = b"".join(self._parts), [], 0
+        return data
+
+
+def _member(name, compress_type):
+    info = zipfile.ZipInfo(name, time.localtime()[:6])
+    info.compress_type = compress_type
+    return info
+
+
+def iter_zip(db_path, upload_folder, user_id):
+    """A zip of data.json and the user's media files, yielded as bytes."""
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", allowZip64=True) as archive:
+        with archive.open(_member("data.json", zipfile.ZIP_DEFLATED), "w", force_zip64=True) as member:
+            for piece in iter_json(db_path, upload_folder, user_id):
+                member.write(piece.encode())
+                if sink.pending >= CHUNK_SIZE:
+                    yield sink.drain()
+        # Videos and audio are compressed already; storing them saves the CPU for nothing lost
+        for name, path, _ in _media(_connect(db_path), user_id, upload_folder):
+            with open(path, "rb") as src, \
+                    archive.open(_member(f"media/{name}", zipfile.ZIP_STORED), "w", force_zip64=True) as member:
+                while chunk := src.read(CHUNK_SIZE):
+                    member.write(chunk)
+                    yield sink.drain()
+    yield sink.drain()
+
+
+WRITERS = {"json": iter_json, "ndjson": iter_ndjson, "zip": iter_zip}
+
+
+def stream(fmt, db_path, upload_folder, user_id):
+    """Chunks of the export in ``fmt`` (bytes for zip, text otherwise)."""
+    if fmt not in WRITERS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    return WRITERS[fmt](db_path, upload_folder, user_id)
+
+
+# ==========================================
+#           BACKGROUND EXPORTS
+# ==========================================
+
+def init_exports_table(db_path):
+    with _connect(db_path) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute('''CREATE TABLE IF NOT EXISTS data_exports (
+                            id TEXT PRIMARY KEY,
+                            user_id INTEGER REFERENCES users (id) ON DELETE SET NULL,
+                            format TEXT NOT NULL,
+                            status TEXT NOT NULL,
+                            filename TEXT,
+                            size INTEGER,
+                            error TEXT,
+                            created_at REAL NOT NULL,
+                            finished_at REAL)''')
+        db.user_email_to_id(conn, "data_exports")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_data_exports_user ON data_exports (user_id, created_at)")
+        conn.commit()
+
+
+class ExportJobs:
+    def __init__(self, db_path, upload_folder, folder, ttl=24 * 3600, max_workers=1):
+        self.db_path = db_path
+        self.upload_folder = upload_folder
+        self.folder = folder
+        self.ttl = ttl
+        self.max_workers = max_workers
+        self._pool = None
+        self._pid = None
+        self._ready = False
+
+    def _conn(self):
+        if not self._ready:
+            init_exports_table(self.db_path)
+            os.makedirs(self.folder, exist_ok=True)
+            self._ready = True
+        return _connect(self.db_path)
+
+    def _executor(self):
+        # A forked worker can't use its parent's threads
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="data-export")
+        return self._pool
+
+    def start(self, user_id, fmt):
+        """Queue an export of ``user_id``'s data; returns its id."""
+        if fmt not in WRITERS:
+            raise ValueError(f"Unknown export format: {fmt}")
+        export_id = uuid.uuid4().hex
+        with self._conn() as conn:
+            conn.execute("INSERT INTO data_exports (id, user_id, format, status, created_at) VALUES (?, ?, ?, ?, ?)",
+                         (export_id, user_id, fmt, QUEUED, time.time()))
+        self._executor().submit(self._run, export_id, user_id, fmt)
+        return export_id
+
+    def _run(self, export_id, user_id, fmt):
+        filename = f"{export_id}.{FORMATS[fmt][1]}"
+        partial = os.path.join(self.folder, filename + ".part")
+        with self._conn() as conn:
+            conn.execute("UPDATE data_exports SET status = ? WHERE id = ?", (RUNNING, export_id))
+        try:
+            with open(partial, "wb") as out:
+                for piece in stream(fmt, self.db_path, self.upload_folder, user_id):
+                    out.write(piece if isinstance(piece, bytes) else piece.encode())
+            os.replace(partial, os.path.join(self.folder, filename))
+            status, error, size = DONE, None, os.path.getsize(os.path.join(self.folder, filename))
+        except Exception as e:
+            print(f"⚠️ Data export {export_id} failed: {e}")
+            if os.path.exists(partial): os.remove(partial)
+            status, error, size, filename = FAILED, str(e), None, None
+        with self._conn() as conn:
+            conn.execute("UPDATE data_exports SET status = ?, filename = ?, size = ?, error = ?, finished_at = ? WHERE id = ?",
+                         (status, filename, size, error, time.time(), export_id))
+
+    def get(self, export_id, user_id):
+        row = self._conn().execute("SELECT * FROM data_exports WHERE id = ? AND user_id = ?",
+                                   (export_id, user_id)).fetchone()
+        return dict(row) if row else None
+
+    def list_for_user(self, user_id, limit=5):
+        rows = self._conn().execute("SELECT * FROM data_exports WHERE user_id = ? ORDER BY created_at DESC LIMIT ?",
+                                    (user_id, limit)).fetchall()
+        return [dict(r) for r in rows]
+
+    def prune(self):
+        """Delete exports older than ``ttl`` (files and rows). Exports a dead process left running fail here too."""
+        cutoff = time.time() - self.ttl
+        with self._conn() as conn:
+            rows = conn.execute("SELECT id, filename FROM data_exports WHERE created_at < ?", (cutoff,)).fetchall()
+            for row in rows:
+                for name in (row["filename"], f"{row['id']}.part"):
+                    path = os.path.join(self.folder, name or "")
+                    if name and os.path.isfile(path): os.remove(path)
+            conn.execute("DELETE FROM data_exports WHERE created_at < ?", (cutoff,))
+        return len(rows)
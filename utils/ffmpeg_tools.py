@@ -0,0 +1,185 @@
+# utils/ffmpeg_tools.py
+"""
+Thin wrappers around the ffmpeg/ffprobe binaries.
+
+ffprobe is used when it is installed (Dockerfile installs the ffmpeg package).
+Otherwise we fall back to parsing ``ffmpeg -i`` output, so the helpers also
+work with the binary bundled by imageio-ffmpeg.
+"""
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+
+
+# 🔹 Binaries
+def ffmpeg_binary():
+    env = os.getenv("FFMPEG_BINARY")
+    if env:
+        return env
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return shutil.which("ffmpeg") or "ffmpeg"
+
+
+def ffprobe_binary():
+    return os.getenv("FFPROBE_BINARY") or shutil.which("ffprobe")
+
+
+def run_ffmpeg(args, timeout=None):
+    """Run ffmpeg with ``args``; raises RuntimeError with the tail of stderr on failure."""
+    cmd = [ffmpeg_binary(), "-hide_banner", "-nostdin", "-loglevel", "error", "-y", *args]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+    if proc.returncode != 0:
+        tail = proc.stderr.decode("utf-8", "replace").strip().splitlines()[-3:]
+        raise RuntimeError(f"ffmpeg failed: {' | '.join(tail) or proc.returncode}")
+    return proc
+
+
+def run_ffmpeg_progress(args, duration, progress=None, timeout=None):
+    """Like run_ffmpeg, reporting ``progress(fraction)`` of ``duration`` seconds of output."""
+    if progress is None or not duration:
+        return run_ffmpeg(args, timeout=timeout)
+    cmd = [ffmpeg_binary(), "-hide_banner", "-nostdin", "-loglevel", "error", "-y",
+           "-progress", "pipe:1", "-nostats", *args]
+    # stderr goes to a temp file so a chatty encoder can never fill the pipe and stall us
+    with tempfile.TemporaryFile() as err:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=err)
+        started = time.monotonic()
+        try:
+            for line in proc.stdout:
+                key, _, value = line.decode("ascii", "replace").strip().partition("=")
+                if key == "out_time_us" and value.isdigit():
+                    progress(min(int(value) / 1e6 / duration, 1.0))
+                if timeout and time.monotonic() - started > timeout:
+                    proc.kill()
+                    raise RuntimeError("ffmpeg timed out")
+            proc.wait()
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+        if proc.returncode != 0:
+            err.seek(0)
+            tail = err.read().decode("utf-8", "replace").strip().splitlines()[-3:]
+            raise RuntimeError(f"ffmpeg failed: {' | '.join(tail) or proc.returncode}")
+    return proc
+
+
+# ==========================================
+#           PROBING
+# ==========================================
+
+def _parse_rate(value):
+    try:
+        if "/" in str(value):
+            num, den = str(value).split("/")
+            return float(num) / float(den) if float(den) else 0.0
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _probe_ffprobe(path, binary):
+    proc = subprocess.run(
+        [binary, "-v", "error", "-print_format", "json", "-show_format", "-show_streams", path],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=30)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffprobe failed: {proc.stderr.decode('utf-8', 'replace').strip()}")
+    data = json.loads(proc.stdout or b"{}")
+    fmt = data.get("format", {})
+    video = next((s for s in data.get("streams", []) if s.get("codec_type") == "video"
+                  and not s.get("disposition", {}).get("attached_pic")), None)
+    audio = next((s for s in data.get("streams", []) if s.get("codec_type") == "audio"), None)
+
+    info = _empty_info()
+    info["duration"] = float(fmt.get("duration") or 0)
+    info["bitrate"] = int(fmt.get("bit_rate") or 0)
+    info["format"] = fmt.get("format_name")
+    if video:
+        info.update(video_codec=video.get("codec_name"), profile=video.get("profile"),
+                    level=video.get("level") if (video.get("level") or 0) > 0 else None,
+                    pix_fmt=video.get("pix_fmt"), width=video.get("width"), height=video.get("height"),
+                    fps=round(_parse_rate(video.get("avg_frame_rate") or video.get("r_frame_rate")), 3))
+    if audio:
+        info.update(audio_codec=audio.get("codec_name"), audio_channels=audio.get("channels"),
+                    audio_sample_rate=int(audio.get("sample_rate") or 0))
+    return info
+
+
+_DURATION_RE = re.compile(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?).*?bitrate: (\d+) kb/s")
+_VIDEO_RE = re.compile(r"Stream #\S+.*?: Video: (\w+)(?: \(([^)]*)\))?.*?, (\w+)(?:\([^)]*\))?, (\d{2,5})x(\d{2,5})")
+_FPS_RE = re.compile(r"([\d.]+) (?:fps|tbr)")
+_AUDIO_RE = re.compile(r"Stream #\S+.*?: Audio: (\w+).*?, (\d+) Hz, ([\w.()]+)")
+
+
+def _probe_ffmpeg(path):
+    proc = subprocess.run([ffmpeg_binary(), "-hide_banner", "-nostdin", "-i", path],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=30)
+    text = proc.stderr.decode("utf-8", "replace")
+    if "Invalid data found" in text or "No such file" in text:
+        raise RuntimeError(f"ffmpeg could not read {os.path.basename(path)}")
+
+    info = _empty_info()
+    m = _DURATION_RE.search(text)
+    if m:
+        h, mnt, sec, kbps = m.groups()
+        info["duration"] = int(h) * 3600 + int(mnt) * 60 + float(sec)
+        info["bitrate"] = int(kbps) * 1000
+    for line in text.splitlines():
+        if info["video_codec"] is None and " Video: " in line and "attached pic" not in line:
+            v = _VIDEO_RE.search(line)
+            if v:
+                info.update(video_codec=v.group(1), profile=v.group(2), pix_fmt=v.group(3),
+                            width=int(v.group(4)), height=int(v.group(5)))
+                fps = _FPS_RE.search(line)
+                info["fps"] = float(fps.group(1)) if fps else 0.0
+        elif info["audio_codec"] is None and " Audio: " in line:
+            a = _AUDIO_RE.search(line)
+            if a:
+                channels = {"mono": 1, "stereo": 2, "5.1": 6, "5.1(side)": 6}.get(a.group(3))
+                info.update(audio_codec=a.group(1), audio_sample_rate=int(a.group(2)), audio_channels=channels)
+    return info
+
+
+def _empty_info():
+    return {
+        "duration": 0.0, "bitrate": 0, "format": None,
+        "video_codec": None, "profile": None, "level": None, "pix_fmt": None, "width": None, "height": None, "fps": 0.0,
+        "audio_codec": None, "audio_channels": None, "audio_sample_rate": None,
+    }
+
+
+def probe(path):
+    """Return duration, resolution, fps, codecs and bitrate for a media file."""
+    binary = ffprobe_binary()
+    return _probe_ffprobe(path, binary) if binary else _probe_ffmpeg(path)
+
+
+def keyframes(path):
+    """Return the presentation times (seconds) of the video keyframes, sorted."""
+    binary = ffprobe_binary()
+    if binary:
+        # Reading packet flags avoids decoding anything
+        proc = subprocess.run(
+            [binary, "-v", "error", "-select_streams", "v:0", "-show_entries", "packet=pts_time,flags",
+             "-of", "csv=print_section=0", path],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=120)
+        times = []
+        for line in proc.stdout.decode().splitlines():
+            parts = line.split(",")
+            if len(parts) >= 2 and "K" in parts[1] and parts[0] not in ("", "N/A"):
+                times.append(float(parts[0]))
+        return sorted(times)
+
+    # Fallback: decode keyframes only and let showinfo print their timestamps
+    proc = subprocess.run(
+        [ffmpeg_binary(), "-hide_banner", "-nostdin", "-nostats", "-skip_frame", "nokey", "-i", path,
+         "-map", "0:v:0", "-vf", "showinfo", "-f", "null", "-"],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=300)
+    times = re.findall(r"pts_time:\s*(-?[\d.]+)", proc.stderr.decode("utf-8", "replace"))
+    return sorted(float(t) for t in times)
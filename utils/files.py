@@ -0,0 +1,42 @@
+# utils/files.py
+import os
+import time
+import uuid
+from werkzeug.utils import secure_filename
+
+VIDEO_EXTENSIONS = {'mp4', 'avi', 'mov', 'mkv', 'webm', 'flv'}
+AUDIO_EXTENSIONS = {'mp3', 'wav', 'ogg', 'm4a', 'aac', 'flac'}
+
+
+def allowed_file(filename, allowed_extensions):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions
+
+
+def generate_unique_filename(original_filename, prefix=''):
+    name, ext = os.path.splitext(original_filename)
+    clean_name = secure_filename(name)
+    unique_id = uuid.uuid4().hex[:8]
+    if prefix:
+        return f"{prefix}_{clean_name}_{unique_id}{ext}"
+    return f"{clean_name}_{unique_id}{ext}"
+
+
+def safe_float(value, default=0.0):
+    try: return float(value)
+    except: return default
+
+
+def prune_folder(folder, max_age):
+    """Delete files in ``folder`` not modified for ``max_age`` seconds; returns how many."""
+    if not os.path.isdir(folder):
+        return 0
+    cutoff, removed = time.time() - max_age, 0
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        try:
+            if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            continue
+    return removed
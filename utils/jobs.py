@@ -0,0 +1,320 @@
+# utils/jobs.py
+"""
+Render job queue.
+
+Jobs are rows in the ``render_jobs`` SQLite table, so they survive a web
+worker restart. Each web process runs a small dispatcher thread that claims
+queued jobs (with per-user fairness and a global concurrency cap shared by
+every process on the database) and hands them to a bounded process pool.
+Claimed jobs hold a lease that the dispatcher renews; if the process dies the
+lease runs out and another dispatcher requeues the job.
+
+Each job renders inside its own scratch directory (utils/scratch.py), which
+is removed when the job ends or, if the worker crashed, by the dispatcher.
+"""
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import nullcontext
+
+from utils import db
+from utils.media_index import MediaIndex
+from utils.render_cache import RenderCache
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+# Workers are started from the dispatcher thread, and forking a threaded web
+# process can deadlock the child on a lock some other thread held. Spawn instead.
+_MP_CONTEXT = multiprocessing.get_context("spawn")
+
+
+class QueueFullError(Exception):
+    """Raised by ``enqueue`` when the global or per-user queue limit is reached."""
+
+
+def _connect(db_path):
+    return db.connect(db_path)
+
+
+def init_jobs_table(db_path):
+    with _connect(db_path) as conn:
+        conn.execute("BEGIN IMMEDIATE")  # every web process runs this at startup
+        conn.execute('''CREATE TABLE IF NOT EXISTS render_jobs (
+                            id TEXT PRIMARY KEY,
+                            user_id INTEGER REFERENCES users (id) ON DELETE SET NULL,
+                            action TEXT NOT NULL,
+                            params TEXT NOT NULL,
+                            status TEXT NOT NULL,
+                            progress REAL NOT NULL DEFAULT 0,
+                            result TEXT,
+                            error TEXT,
+                            owner TEXT,
+                            lease_until REAL,
+                            attempts INTEGER NOT NULL DEFAULT 0,
+                            created_at REAL NOT NULL,
+                            started_at REAL,
+                            finished_at REAL)''')
+        db.user_email_to_id(conn, "render_jobs")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_render_jobs_status ON render_jobs (status, user_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_render_jobs_user ON render_jobs (user_id, created_at)")
+        conn.commit()
+
+
+# 🔹 Runs inside the worker process
+def _execute(db_path, upload_folder, job_id, action, params, cache_max_bytes=None, scratch=None):
+    last = {"value": 0.0, "at": 0.0}
+
+    def progress(fraction):
+        # Throttle writes: at most one per second or per 2% step
+        now = time.time()
+        if fraction - last["value"] < 0.02 and now - last["at"] < 1.0:
+            return
+        last.update(value=fraction, at=now)
+        if scratch:
+            scratch.check()  # raising here aborts the render
+        try:
+            with _connect(db_path) as conn:
+                conn.execute("UPDATE render_jobs SET progress = ? WHERE id = ? AND status = ?",
+                             (round(fraction, 3), job_id, RUNNING))
+                conn.commit()
+        except sqlite3.Error:
+            pass
+
+    try:
+        from utils import video_engine  # MoviePy and friends are only needed in the worker processes
+        cache = RenderCache(db_path, upload_folder, cache_max_bytes) if cache_max_bytes else None
+        with scratch.job(job_id) if scratch else nullcontext():
+            result = video_engine.run(action, params, upload_folder, progress=progress,
+                                      media=MediaIndex(db_path, upload_folder), cache=cache)
+        status, error = DONE, None
+    except Exception as e:
+        result, status, error = None, FAILED, str(e)
+
+    with _connect(db_path) as conn:
+        conn.execute('''UPDATE render_jobs SET status = ?, result = ?, error = ?, progress = ?,
+                        finished_at = ?, owner = NULL, lease_until = NULL
+                        WHERE id = ? AND status = ?''',
+                     (status, json.dumps(result) if result else None, error,
+                      1.0 if status == DONE else last["value"], time.time(), job_id, RUNNING))
+        conn.commit()
+    return status
+
+
+class JobQueue:
+    def __init__(self, db_path, upload_folder, max_workers=2, max_concurrent=None, max_queue=50,
+                 max_queued_per_user=5, max_running_per_user=1, lease_seconds=60, max_attempts=2,
+                 poll_interval=1.0, cache_max_bytes=None, scratch=None):
+        self.db_path = db_path
+        self.upload_folder = upload_folder
+        self.max_workers = max_workers
+        self.max_concurrent = max_concurrent or max_workers
+        self.max_queue = max_queue
+        self.max_queued_per_user = max_queued_per_user
+        self.max_running_per_user = max_running_per_user
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.cache_max_bytes = cache_max_bytes
+        self.scratch = scratch
+
+        self._pid = None
+        self._owner = None
+        self._pool = None
+        self._active = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    # ==========================================
+    #           PUBLIC API (web side)
+    # ==========================================
+
+    def init_db(self):
+        init_jobs_table(self.db_path)
+
+    def enqueue(self, user_id, action, params, enforce_limits=True):
+        """Queue a job for ``user_id``. ``enforce_limits=False`` is for housekeeping jobs the user didn't ask for."""
+        job_id = uuid.uuid4().hex
+        with _connect(self.db_path) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if enforce_limits:
+                queued = conn.execute("SELECT COUNT(*) FROM render_jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+                if queued >= self.max_queue:
+                    raise QueueFullError("Render queue is full, please try again in a minute.")
+                mine = conn.execute("SELECT COUNT(*) FROM render_jobs WHERE status IN (?, ?) AND user_id = ?",
+                                    (QUEUED, RUNNING, user_id)).fetchone()[0]
+                if mine >= self.max_queued_per_user:
+                    raise QueueFullError(f"You already have {mine} renders pending. Wait for one to finish.")
+            conn.execute('''INSERT INTO render_jobs (id, user_id, action, params, status, created_at)
+                            VALUES (?, ?, ?, ?, ?, ?)''',
+                         (job_id, user_id, action, json.dumps(params), QUEUED, time.time()))
+            conn.commit()
+        self.start()
+        self._wake.set()
+        return job_id
+
+    def record_completed(self, user_id, action, params, result):
+        """Store a job that needed no rendering (e.g. a render-cache hit) so clients can poll it as usual."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with _connect(self.db_path) as conn:
+            conn.execute('''INSERT INTO render_jobs (id, user_id, action, params, status, progress, result,
+                            created_at, started_at, finished_at) VALUES (?, ?, ?, ?, ?, 1.0, ?, ?, ?, ?)''',
+                         (job_id, user_id, action, json.dumps(params), DONE, json.dumps(result), now, now, now))
+            conn.commit()
+        return job_id
+
+    def get(self, job_id, user_id=None):
+        with _connect(self.db_path) as conn:
+            row = conn.execute("SELECT * FROM render_jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None or (user_id is not None and row["user_id"] != user_id):
+                return None
+            job = self._to_dict(row)
+            if job["status"] == QUEUED:
+                job["queue_position"] = conn.execute(
+                    "SELECT COUNT(*) FROM render_jobs WHERE status = ? AND created_at < ?",
+                    (QUEUED, row["created_at"])).fetchone()[0]
+        return job
+
+    def list_for_user(self, user_id, limit=20):
+        with _connect(self.db_path) as conn:
+            rows = conn.execute("SELECT * FROM render_jobs WHERE user_id = ? ORDER BY created_at DESC LIMIT ?",
+                                (user_id, limit)).fetchall()
+        return [self._to_dict(r) for r in rows]
+
+    def cancel(self, job_id, user_id):
+        """Cancel a job that has not started yet. Returns True if it was cancelled."""
+        with _connect(self.db_path) as conn:
+            cur = conn.execute("UPDATE render_jobs SET status = ?, finished_at = ? WHERE id = ? AND user_id = ? AND status = ?",
+                               (CANCELLED, time.time(), job_id, user_id, QUEUED))
+            conn.commit()
+        return cur.rowcount > 0
+
+    @staticmethod
+    def _to_dict(row):
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        for key in ("owner", "lease_until", "attempts"):
+            job.pop(key, None)
+        return job
+
+    # ==========================================
+    #           DISPATCHER (per process)
+    # ==========================================
+
+    def start(self):
+        """Start the dispatcher in this process (idempotent, fork-aware)."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            init_jobs_table(self.db_path)
+            self._pid = os.getpid()
+            self._owner = f"{socket.gethostname()}:{self._pid}:{uuid.uuid4().hex[:6]}"
+            self._active = {}
+            self._pool = self._new_pool()
+            if self.scratch:
+                self.scratch.sweep()
+            threading.Thread(target=self._dispatch_loop, name="render-dispatcher", daemon=True).start()
+            print(f"🎬 Render dispatcher started ({self.max_workers} workers, owner {self._owner})")
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.max_workers, mp_context=_MP_CONTEXT)
+
+    def _dispatch_loop(self):
+        while True:
+            try:
+                self._renew_leases()
+                self._requeue_stale()
+                while len(self._active) < self.max_workers:
+                    job = self._claim_next()
+                    if job is None:
+                        break
+                    self._submit(job)
+            except sqlite3.Error as e:
+                print("⚠️ Render dispatcher DB error:", e)
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def _claim_next(self):
+        now = time.time()
+        with _connect(self.db_path) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            running = conn.execute("SELECT COUNT(*) FROM render_jobs WHERE status = ?", (RUNNING,)).fetchone()[0]
+            if running >= self.max_concurrent:
+                conn.rollback()
+                return None
+            # Fairness: users with the fewest running jobs go first, then FIFO
+            row = conn.execute('''
+                SELECT j.*, (SELECT COUNT(*) FROM render_jobs r
+                             WHERE r.status = ? AND r.user_id = j.user_id) AS user_running
+                FROM render_jobs j
+                WHERE j.status = ? AND user_running < ?
+                ORDER BY user_running, j.created_at
+                LIMIT 1''', (RUNNING, QUEUED, self.max_running_per_user)).fetchone()
+            if row is None:
+                conn.rollback()
+                return None
+            conn.execute('''UPDATE render_jobs SET status = ?, owner = ?, lease_until = ?, started_at = ?,
+                            attempts = attempts + 1, progress = 0 WHERE id = ?''',
+                         (RUNNING, self._owner, now + self.lease_seconds, now, row["id"]))
+            conn.commit()
+        return row
+
+    def _submit(self, job):
+        future = self._pool.submit(_execute, self.db_path, self.upload_folder,
+                                   job["id"], job["action"], json.loads(job["params"]), self.cache_max_bytes,
+                                   self.scratch)
+        with self._lock:
+            self._active[job["id"]] = future
+        future.add_done_callback(lambda f, job_id=job["id"]: self._on_done(job_id, f))
+
+    def _on_done(self, job_id, future):
+        with self._lock:
+            self._active.pop(job_id, None)
+        error = future.exception()
+        if error is not None:
+            # The worker process itself died (e.g. OOM kill), so it could not record the failure
+            with _connect(self.db_path) as conn:
+                conn.execute('''UPDATE render_jobs SET status = ?, error = ?, finished_at = ?, owner = NULL
+                                WHERE id = ? AND status = ?''',
+                             (FAILED, f"Worker crashed: {error}", time.time(), job_id, RUNNING))
+                conn.commit()
+            if self.scratch:
+                self.scratch.discard(job_id)
+            if isinstance(error, BrokenProcessPool):
+                with self._lock:
+                    if getattr(self._pool, "_broken", False):
+                        self._pool = self._new_pool()
+        self._wake.set()
+
+    def _renew_leases(self):
+        with self._lock:
+            active = list(self._active)
+        if not active:
+            return
+        with _connect(self.db_path) as conn:
+            conn.executemany("UPDATE render_jobs SET lease_until = ? WHERE id = ? AND owner = ?",
+                             [(time.time() + self.lease_seconds, job_id, self._owner) for job_id in active])
+            conn.commit()
+
+    def _requeue_stale(self):
+        """Recover jobs whose owning process stopped renewing its lease."""
+        now = time.time()
+        with _connect(self.db_path) as conn:
+            conn.execute('''UPDATE render_jobs SET status = ?, error = ?, finished_at = ?, owner = NULL
+                            WHERE status = ? AND lease_until < ? AND attempts >= ?''',
+                         (FAILED, "Render worker was lost", now, RUNNING, now, self.max_attempts))
+            cur = conn.execute('''UPDATE render_jobs SET status = ?, owner = NULL, lease_until = NULL, progress = 0
+                                  WHERE status = ? AND lease_until < ?''', (QUEUED, RUNNING, now))
+            conn.commit()
+        if cur.rowcount:
+            print(f"♻️ Requeued {cur.rowcount} render job(s) from a lost worker")
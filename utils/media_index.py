@@ -0,0 +1,195 @@
+# utils/media_index.py
+"""
+Probe cache for the uploads folder.
+
+One row per file, valid while the file's size and mtime are unchanged. Files
+are probed once (at upload or when a render writes them) and every later
+lookup - the editor listing, form validation, trim/merge planning - reads the
+row instead of opening the file with MoviePy or spawning ffmpeg.
+
+The row also records the file's editing proxy and thumbnail strip (see
+utils/proxies.py), so dropping a row drops those files with it.
+"""
+import json
+import os
+import time
+
+from utils import db, ffmpeg_tools, proxies
+from utils.files import allowed_file, VIDEO_EXTENSIONS, AUDIO_EXTENSIONS
+
+PROBED_FIELDS = ("duration", "width", "height", "fps", "video_codec", "profile", "pix_fmt",
+                 "audio_codec", "audio_channels", "audio_sample_rate", "bitrate")
+
+
+def _connect(db_path):
+    return db.connect(db_path)
+
+
+def init_media_table(db_path):
+    with _connect(db_path) as conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS media_files (
+                            filename TEXT PRIMARY KEY,
+                            kind TEXT NOT NULL,
+                            size INTEGER NOT NULL,
+                            mtime REAL NOT NULL,
+                            probed INTEGER NOT NULL DEFAULT 0,
+                            duration REAL, width INTEGER, height INTEGER, fps REAL,
+                            video_codec TEXT, profile TEXT, pix_fmt TEXT,
+                            audio_codec TEXT, audio_channels INTEGER, audio_sample_rate INTEGER,
+                            bitrate INTEGER,
+                            keyframes TEXT,
+                            indexed_at REAL,
+                            proxy TEXT,
+                            strip TEXT)''')
+        # Tables created before proxies existed
+        columns = {r[1] for r in conn.execute("PRAGMA table_info(media_files)")}
+        for column in ("proxy", "strip"):
+            if column not in columns:
+                conn.execute(f"ALTER TABLE media_files ADD COLUMN {column} TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_media_files_kind ON media_files (kind, filename)")
+        conn.commit()
+
+
+def media_kind(filename):
+    if allowed_file(filename, VIDEO_EXTENSIONS): return "video"
+    if allowed_file(filename, AUDIO_EXTENSIONS): return "audio"
+    return None
+
+
+class MediaIndex:
+    def __init__(self, db_path, upload_folder):
+        self.db_path = db_path
+        self.upload_folder = upload_folder
+        self._ready = False
+
+    def _conn(self):
+        if not self._ready:
+            init_media_table(self.db_path)
+            self._ready = True
+        return _connect(self.db_path)
+
+    def _path(self, filename):
+        return os.path.join(self.upload_folder, filename)
+
+    @staticmethod
+    def _to_dict(row):
+        entry = dict(row)
+        entry["keyframes"] = json.loads(entry["keyframes"]) if entry["keyframes"] else None
+        return entry
+
+    # ==========================================
+    #           WRITES
+    # ==========================================
+
+    def index_file(self, filename, with_keyframes=True):
+        """Probe ``filename`` and store its metadata. Returns the entry (or None if unreadable)."""
+        path = self._path(filename)
+        kind = media_kind(filename)
+        if kind is None or not os.path.isfile(path):
+            return None
+        st = os.stat(path)
+        try:
+            info = ffmpeg_tools.probe(path)
+            kfs = ffmpeg_tools.keyframes(path) if with_keyframes and kind == "video" and info["video_codec"] else None
+            probed = 1
+        except Exception as e:
+            print(f"⚠️ Could not probe {filename}: {e}")
+            info, kfs, probed = {}, None, 0
+
+        with self._conn() as conn:
+            # Keep the proxy columns only while the proxy is still newer than the file
+            previous = conn.execute("SELECT proxy, strip FROM media_files WHERE filename = ?", (filename,)).fetchone()
+            if previous is None or not proxies.is_fresh(self.upload_folder, filename):
+                previous = (None, None)
+            conn.execute(f'''INSERT OR REPLACE INTO media_files
+                             (filename, kind, size, mtime, probed, {", ".join(PROBED_FIELDS)}, keyframes, indexed_at,
+                              proxy, strip)
+                             VALUES (?, ?, ?, ?, ?, {", ".join("?" for _ in PROBED_FIELDS)}, ?, ?, ?, ?)''',
+                         (filename, kind, st.st_size, st.st_mtime, probed,
+                          *[info.get(f) for f in PROBED_FIELDS],
+                          json.dumps(kfs) if kfs is not None else None, time.time(), *previous))
+            conn.commit()
+            row = conn.execute("SELECT * FROM media_files WHERE filename = ?", (filename,)).fetchone()
+        return self._to_dict(row)
+
+    def set_proxy(self, filename, proxy, strip):
+        with self._conn() as conn:
+            conn.execute("UPDATE media_files SET proxy = ?, strip = ? WHERE filename = ?", (proxy, strip, filename))
+            conn.commit()
+
+    def forget(self, filename):
+        """Drop ``filename`` from the index together with its proxy files."""
+        with self._conn() as conn:
+            conn.execute("DELETE FROM media_files WHERE filename = ?", (filename,))
+            conn.commit()
+        proxies.remove(self.upload_folder, filename)
+
+    # ==========================================
+    #           READS
+    # ==========================================
+
+    def get(self, filename):
+        """Metadata for ``filename``, re-probing only if the file changed since it was indexed."""
+        path = self._path(filename)
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.forget(filename)
+            return None
+        with self._conn() as conn:
+            row = conn.execute("SELECT * FROM media_files WHERE filename = ?", (filename,)).fetchone()
+        if row and row["probed"] and row["size"] == st.st_size and row["mtime"] == st.st_mtime:
+            return self._to_dict(row)
+        return self.index_file(filename)
+
+    def probe_info(self, filename):
+        """Like ffmpeg_tools.probe() but served from the index."""
+        entry = self.get(filename)
+        if entry is None or not entry["probed"]:
+            raise RuntimeError(f"Could not read media info for {filename}")
+        return {k: entry[k] for k in PROBED_FIELDS}
+
+    def keyframes(self, filename):
+        entry = self.get(filename)
+        if entry and entry["kind"] == "video" and entry["keyframes"] is None and entry["probed"]:
+            entry = self.index_file(filename, with_keyframes=True)
+        return entry["keyframes"] if entry else None
+
+    def proxy_path(self, filename):
+        """Path of an up-to-date proxy for ``filename``, or None."""
+        entry = self.get(filename)
+        if entry and entry.get("proxy") and proxies.is_fresh(self.upload_folder, filename):
+            return proxies.proxy_path(self.upload_folder, filename)
+        return None
+
+    def list_files(self, kind):
+        """All indexed files of ``kind`` ("video"/"audio"), sorted by name.
+
+        Only a directory read (no stat, no probe) is needed to notice files
+        that were added or removed behind the index's back; new ones are listed
+        straight away and probed lazily on first ``get``.
+        """
+        if not os.path.isdir(self.upload_folder):
+            return []
+        on_disk = {name for name in os.listdir(self.upload_folder) if media_kind(name) == kind}
+        with self._conn() as conn:
+            rows = conn.execute("SELECT * FROM media_files WHERE kind = ? ORDER BY filename", (kind,)).fetchall()
+            known = {row["filename"] for row in rows}
+            gone = known - on_disk
+            if gone:
+                conn.executemany("DELETE FROM media_files WHERE filename = ?", [(n,) for n in gone])
+                for name in gone:
+                    proxies.remove(self.upload_folder, name)
+            added = on_disk - known
+            if added:
+                conn.executemany("INSERT OR IGNORE INTO media_files (filename, kind, size, mtime) VALUES (?, ?, -1, -1)",
+                                 [(n, kind) for n in added])
+            conn.commit()
+
+        entries = [self._to_dict(r) for r in rows if r["filename"] not in gone]
+        entries += [{"filename": n, "kind": kind, "probed": 0, "duration": None, "keyframes": None,
+                     "proxy": None, "strip": None}
+                    for n in added]
+        for entry in entries:
+            entry.pop("keyframes", None)  # listings don't need them
+        return sorted(entries, key=lambda e: e["filename"])
@@ -0,0 +1,195 @@
+# utils/media_server.py
+"""
+Byte-range aware file serving for the editor's media previews.
+
+Handles conditional requests (ETag / Last-Modified / If-Range), single and
+multipart/byteranges responses, and long-lived caching for files whose names
+carry the random suffix from ``generate_unique_filename`` (they never change).
+Under gunicorn the body is handed to ``wsgi.file_wrapper`` so the kernel
+sends it with sendfile(); a fronting nginx/Apache can take over completely
+with X-Accel-Redirect / X-Sendfile.
+"""
+import mimetypes
+import os
+import re
+import uuid
+
+from flask import abort
+from werkzeug.http import http_date, parse_date, quote_etag, unquote_etag
+from werkzeug.security import safe_join
+from werkzeug.wrappers import Response
+
+MAX_RANGES = 16
+READ_BLOCK = 256 * 1024
+IMMUTABLE_NAME = re.compile(r"_[0-9a-f]{8}\.\w+$")
+LONG_CACHE = "private, max-age=31536000, immutable"
+REVALIDATE = "private, no-cache"
+
+
+def _etag(st):
+    return f"{st.st_size:x}-{int(st.st_mtime * 1_000_000):x}"
+
+
+def _not_modified(request, etag, mtime):
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match:
+        return any(unquote_etag(tag.strip())[0] == etag or tag.strip() == "*" for tag in if_none_match.split(","))
+    since = parse_date(request.headers.get("If-Modified-Since"))
+    return since is not None and int(mtime) <= since.timestamp()
+
+
+def _if_range_matches(request, etag, mtime):
+    if_range = request.headers.get("If-Range")
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        tag, weak = unquote_etag(if_range)
+        return not weak and tag == etag
+    since = parse_date(if_range)
+    return since is not None and int(mtime) <= since.timestamp()
+
+
+def _parse_range_spec(header):
+    """``bytes=0-99,200-,-50`` -> [(0, 100), (200, None), (-50, None)]; None if malformed.
+
+    Werkzeug's parser rejects overlapping or unordered ranges outright; we
+    accept them and merge below, as RFC 9110 allows.
+    """
+    units, _, spec = header.partition("=")
+    if units.strip().lower() != "bytes" or not spec.strip():
+        return None
+    ranges = []
+    for item in spec.split(","):
+        first, dash, last = item.strip().partition("-")
+        if not dash:
+            return None
+        try:
+            if first == "":
+                ranges.append((-int(last), None))
+            else:
+                start = int(first)
+                stop = int(last) + 1 if last else None
+                if start < 0 or (stop is not None and stop <= start):
+                    return None
+                ranges.append((start, stop))
+        except ValueError:
+            return None
+    return ranges
+
+
+def satisfiable_ranges(header, size):
+    """Parse a Range header into sorted, merged (start, stop) byte ranges.
+
+    Returns None when the header should be ignored (malformed or abusive)
+    and [] when no range is satisfiable (-> 416).
+    """
+    parsed = _parse_range_spec(header)
+    if parsed is None or len(parsed) > MAX_RANGES:
+        return None
+    ranges = []
+    for start, stop in parsed:
+        if start < 0:  # suffix range: last N bytes
+            start, stop = max(size + start, 0), size
+        stop = size if stop is None else min(stop, size)
+        if start < stop:
+            ranges.append([start, stop])
+    ranges.sort()
+    merged = []
+    for start, stop in ranges:
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], stop)
+        else:
+            merged.append([start, stop])
+    return [tuple(r) for r in merged]
+
+
+def _read_range(path, start, stop):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            block = f.read(min(READ_BLOCK, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+
+
+def _file_body(request, path, start, length):
+    # gunicorn's file_wrapper uses sendfile() and honours the file offset + Content-Length;
+    # other servers' wrappers read to EOF, so give them a bounded iterator instead
+    if request.environ.get("SERVER_SOFTWARE", "").startswith("gunicorn") and "wsgi.file_wrapper" in request.environ:
+        f = open(path, "rb")
+        f.seek(start)
+        return request.environ["wsgi.file_wrapper"](f, READ_BLOCK)
+    return _read_range(path, start, start + length)
+
+
+def serve_media(request, directory, filename, offload=None, offload_prefix="/protected-uploads/"):
+    """Serve ``filename`` from ``directory`` honouring Range and conditional headers.
+
+    ``offload`` is None, "x-accel" (nginx) or "x-sendfile" (Apache/lighttpd).
+    """
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    st = os.stat(path)
+    size, etag = st.st_size, _etag(st)
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    headers = {
+        "ETag": quote_etag(etag),
+        "Last-Modified": http_date(st.st_mtime),
+        "Cache-Control": LONG_CACHE if IMMUTABLE_NAME.search(filename) else REVALIDATE,
+        "Accept-Ranges": "bytes",
+    }
+
+    if _not_modified(request, etag, st.st_mtime):
+        return Response(status=304, headers=headers)
+
+    if offload == "x-accel":
+        headers["X-Accel-Redirect"] = offload_prefix.rstrip("/") + "/" + filename
+        return Response(status=200, headers=headers, mimetype=mimetype)
+    if offload == "x-sendfile":
+        headers["X-Sendfile"] = path
+        return Response(status=200, headers=headers, mimetype=mimetype)
+
+    ranges = None
+    if request.headers.get("Range") and _if_range_matches(request, etag, st.st_mtime):
+        ranges = satisfiable_ranges(request.headers["Range"], size)
+
+    if ranges is None:
+        headers["Content-Length"] = str(size)
+        return Response(_file_body(request, path, 0, size), status=200, headers=headers,
+                        mimetype=mimetype, direct_passthrough=True)
+
+    if not ranges:
+        headers["Content-Range"] = f"bytes */{size}"
+        return Response(status=416, headers=headers)
+
+    if len(ranges) == 1:
+        start, stop = ranges[0]
+        headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+        headers["Content-Length"] = str(stop - start)
+        return Response(_file_body(request, path, start, stop - start), status=206, headers=headers,
+                        mimetype=mimetype, direct_passthrough=True)
+
+    # Several ranges: multipart/byteranges with an exact Content-Length
+    boundary = uuid.uuid4().hex
+    part_headers = [
+        (f"--{boundary}\r\nContent-Type: {mimetype}\r\n"
+         f"Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n").encode()
+        for start, stop in ranges
+    ]
+    closing = f"\r\n--{boundary}--\r\n".encode()
+
+    def body():
+        for i, (start, stop) in enumerate(ranges):
+            yield (b"\r\n" if i else b"") + part_headers[i]
+            yield from _read_range(path, start, stop)
+        yield closing
+
+    length = sum(len(h) for h in part_headers) + 2 * (len(ranges) - 1) + sum(stop - start for start, stop in ranges) + len(closing)
+    headers["Content-Length"] = str(length)
+    return Response(body(), status=206, headers=headers,
+                    content_type=f"multipart/byteranges; boundary={boundary}", direct_passthrough=True)
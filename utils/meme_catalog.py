@@ -0,0 +1,208 @@
+# utils/meme_catalog.py
+"""
+Imgflip meme template catalog.
+
+The catalog is fetched from Imgflip at most once per ``ttl`` and kept in two
+places: in memory (a dict keyed by template id, so the editor's lookup is one
+dict access) and in ``<folder>/catalog.json``, so a restarted or freshly
+forked worker starts warm and all workers share one fetch. A stale catalog is
+still served while a background thread refreshes it; only a worker with
+nothing at all, neither in memory nor on disk, waits for Imgflip.
+
+Template images are mirrored into ``<folder>/images`` in the background.
+Once an image is mirrored its ``url`` points at our own origin (the original
+stays in ``source_url``), which also keeps the editor's canvas untainted.
+
+The built-in LOCAL_MEMES are part of the same index: they are what the
+template list shows when Imgflip has never been reachable, and their ids
+always resolve in the editor.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+import requests
+
+from utils import metrics
+
+IMGFLIP_URL = "https://api.imgflip.com/get_memes"
+DEFAULT_TTL = 6 * 3600
+MIRROR_TIMEOUT = 10
+RETRY_AFTER = 60
+
+LOCAL_MEMES = [
+    {"id": "drake", "name": "Drake Hotline Bling", "url": "/static/memes/drake.jpg"},
+    {"id": "boyfriend", "name": "Distracted Boyfriend", "url": "/static/memes/distracted_boyfriend.jpg"},
+    {"id": "success", "name": "Success Kid", "url": "/static/memes/success_kid.jpg"},
+    {"id": "two_buttons", "name": "Two Buttons", "url": "/static/memes/two_buttons.jpg"},
+    {"id": "gru_plan", "name": "Gru’s Plan", "url": "/static/memes/gru_plan.jpg"},
+    {"id": "shaq", "name": "Sleeping Shaq", "url": "/static/memes/sleeping_shaq.jpg"},
+    {"id": "change_mind", "name": "Change My Mind", "url": "/static/memes/change_my_mind.jpg"},
+]
+
+
+def mirror_name(meme):
+    """Local filename for a template image; the hash suffix changes whenever Imgflip's URL does."""
+    url = meme.get("source_url") or meme["url"]
+    ext = os.path.splitext(url.split("?")[0])[1].lower() or ".jpg"
+    return f"{meme['id']}_{hashlib.sha256(url.encode()).hexdigest()[:8]}{ext}"
+
+
+class MemeCatalog:
+    def __init__(self, folder, ttl=DEFAULT_TTL, url_prefix="/memes/", api_url=IMGFLIP_URL, timeout=5,
+                 static_folder=None):
+        self.folder = folder
+        self.static_folder = static_folder
+        self.image_folder = os.path.join(folder, "images")
+        self.catalog_path = os.path.join(folder, "catalog.json")
+        self.ttl = ttl
+        self.url_prefix = url_prefix
+        self.api_url = api_url
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._remote = []       # Imgflip templates in Imgflip's (popularity) order
+        self._by_id = {m["id"]: dict(m, source="local") for m in LOCAL_MEMES}
+        self._fetched_at = 0.0
+
+    # ==========================================
+    #           READING
+    # ==========================================
+
+    def templates(self, limit=20):
+        """The most popular templates, or the local ones if Imgflip was never reachable."""
+        self._ensure_loaded()
+        memes = self._remote or [self._by_id[m["id"]] for m in LOCAL_MEMES]
+        return [self._public(m) for m in memes[:limit]]
+
+    def get(self, template_id):
+        """The template with ``template_id`` (Imgflip or local), or None."""
+        self._ensure_loaded()
+        meme = self._by_id.get(str(template_id))
+        return self._public(meme) if meme else None
+
+    def image_path(self, template_id):
+        """Local file of the template's image, mirroring it now if needed; None if unavailable."""
+        self._ensure_loaded()
+        meme = self._by_id.get(str(template_id))
+        if meme is None:
+            return None
+        if meme.get("source") == "imgflip":
+            path = os.path.join(self.image_folder, mirror_name(meme))
+            return path if os.path.isfile(path) or self._mirror(meme) else None
+        if self.static_folder and meme["url"].startswith("/static/"):
+            path = os.path.join(self.static_folder, meme["url"][len("/static/"):])
+            return path if os.path.isfile(path) else None
+        return None
+
+    def _public(self, meme):
+        if meme.get("source") == "imgflip" and os.path.isfile(os.path.join(self.image_folder, mirror_name(meme))):
+            return dict(meme, url=self.url_prefix + mirror_name(meme))
+        return meme
+
+    # ==========================================
+    #           LOADING / REFRESH
+    # ==========================================
+
+    def _ensure_loaded(self):
+        if self._fetched_at and time.time() - self._fetched_at < self.ttl:
+            return
+        if not self._fetched_at and self._load_disk() and time.time() - self._fetched_at < self.ttl:
+            return
+        if self._fetched_at:
+            self._refresh_async()  # serve what we have, fresher data next time
+        else:
+            self.refresh()         # cold start: nothing to serve yet
+
+    def _load_disk(self):
+        try:
+            with open(self.catalog_path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        self._install(data.get("memes") or [], data.get("fetched_at") or 0.0)
+        return True
+
+    def _install(self, memes, fetched_at):
+        by_id = {m["id"]: dict(m, source="local") for m in LOCAL_MEMES}
+        remote = []
+        for meme in memes:
+            meme = dict(meme, id=str(meme["id"]), source="imgflip")
+            meme.setdefault("source_url", meme["url"])
+            by_id[meme["id"]] = meme
+            remote.append(meme)
+        # Swap whole objects so concurrent readers never see a half-built index
+        self._by_id, self._remote, self._fetched_at = by_id, remote, fetched_at
+
+    def _refresh_async(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self.refresh, name="meme-catalog-refresh", daemon=True).start()
+
+    def refresh(self):
+        """Re-read the catalog, from disk if another worker already fetched it, else from Imgflip."""
+        try:
+            try:
+                if time.time() - os.path.getmtime(self.catalog_path) < self.ttl and self._load_disk():
+                    return True
+            except OSError:
+                pass
+            try:
+                with metrics.timed("external_call_duration_seconds", service="imgflip", outcome="ok"):
+                    data = requests.get(self.api_url, timeout=self.timeout).json()
+                memes = data["data"]["memes"] if data.get("success") else None
+            except (requests.RequestException, ValueError, KeyError) as e:
+                memes = None
+                print("⚠️ Could not fetch memes:", e)
+            if not memes:
+                # Keep serving what we have (at worst LOCAL_MEMES) and retry in a minute, not on every request
+                self._fetched_at = time.time() - self.ttl + RETRY_AFTER
+                return False
+            fetched_at = time.time()
+            self._write_disk(memes, fetched_at)
+            self._install(memes, fetched_at)
+        finally:
+            with self._lock:
+                self._refreshing = False
+        threading.Thread(target=self.mirror_images, name="meme-mirror", daemon=True).start()
+        return True
+
+    def _write_disk(self, memes, fetched_at):
+        os.makedirs(self.folder, exist_ok=True)
+        tmp = f"{self.catalog_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"fetched_at": fetched_at, "memes": memes}, f)
+        os.replace(tmp, self.catalog_path)
+
+    # ==========================================
+    #           IMAGE MIRROR
+    # ==========================================
+
+    def mirror_images(self):
+        """Download every template image we don't have yet. Returns how many were fetched."""
+        fetched = 0
+        for meme in list(self._remote):
+            if not os.path.isfile(os.path.join(self.image_folder, mirror_name(meme))) and self._mirror(meme):
+                fetched += 1
+        return fetched
+
+    def _mirror(self, meme):
+        os.makedirs(self.image_folder, exist_ok=True)
+        path = os.path.join(self.image_folder, mirror_name(meme))
+        try:
+            with metrics.timed("external_call_duration_seconds", service="imgflip_images", outcome="ok"):
+                r = requests.get(meme["source_url"], timeout=MIRROR_TIMEOUT)
+            r.raise_for_status()
+        except requests.RequestException as e:
+            print(f"⚠️ Could not mirror meme {meme['id']}: {e}")
+            return False
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"  # the mirror thread and a request may fetch the same one
+        with open(tmp, "wb") as f:
+            f.write(r.content)
+        os.replace(tmp, path)
+        return True
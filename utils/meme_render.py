@@ -0,0 +1,188 @@
+# utils/meme_render.py
+"""
+Server-side meme rendering: a catalog template with classic top/bottom text.
+
+The meme editor's html2canvas export depends on the browser and is slow on
+phones. This renders the same kind of meme with Pillow (utils/text_render.py),
+so it also works from scripts and from AI-generated captions:
+
+* Decoded templates are cached per process (``_template``), keyed by path
+  and mtime, and fonts and word masks come from text_render's caches.
+* Each caption is uppercased and auto-fitted: the largest font size at which
+  it wraps into the top or bottom ``BOX_HEIGHT`` of the image.
+* Outputs are named after a hash of everything that determines them
+  (renderer version, template image, texts, format). The same request maps
+  to the same URL, so the file can be cached forever by browsers and CDNs,
+  and a repeat request is answered from disk without rendering.
+* ``MemeRenderer.render`` renders a batch of variants of one template. Two
+  or more uncached variants are spread over a pool of spawned processes.
+"""
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image
+
+from utils import metrics, text_render
+from utils.files import prune_folder
+
+VERSION = 1  # bump whenever the same inputs would render differently
+FORMATS = {"png": "image/png", "webp": "image/webp"}
+MEME_FONTS = ("Impact.ttf", "impact.ttf", "Anton-Regular.ttf", *text_render.FONT_CANDIDATES)
+MAX_SIDE = 1200
+MAX_TEXT = 200
+BOX_HEIGHT = 0.25   # each caption fits in this fraction of the image height
+TEXT_WIDTH = 0.94   # ... and this fraction of its width
+EDGE = 0.02         # gap between a caption and the image edge
+MIN_FONT = 10
+
+
+@lru_cache(maxsize=16)
+def _template(path, mtime):
+    with Image.open(path) as im:
+        im = im.convert("RGB")
+        im.thumbnail((MAX_SIDE, MAX_SIDE))
+        array = np.array(im)
+    array.flags.writeable = False
+    return array
+
+
+def _stroke(size):
+    return max(int(round(size / 18)), 1)
+
+
+def fit(text, width, height):
+    """Largest font size (binary search) at which ``text`` wraps into ``width`` x ``height`` pixels."""
+    low, high = MIN_FONT, max(int(height), MIN_FONT)
+    while low < high:
+        size = (low + high + 1) // 2
+        w, h = text_render.measure(text, size, stroke_width=_stroke(size), max_width=int(width), fonts=MEME_FONTS)
+        if w <= width and h <= height:
+            low = size
+        else:
+            high = size - 1
+    return low
+
+
+def render_image(path, top, bottom, fmt="webp"):
+    """The meme as encoded ``fmt`` bytes."""
+    frame = np.array(_template(path, os.path.getmtime(path)))
+    h, w = frame.shape[:2]
+    for text, position in ((top, "top"), (bottom, "bottom")):
+        if not text:
+            continue
+        size = fit(text, w * TEXT_WIDTH, h * BOX_HEIGHT)
+        caption = text_render.render(text, fontsize=size, stroke_width=_stroke(size),
+                                     max_width=int(w * TEXT_WIDTH), fonts=MEME_FONTS)
+        x, y = text_render.place(caption, w, h, position, margin=EDGE)
+        caption.blend(frame, x, y)
+    out = io.BytesIO()
+    if fmt == "webp":
+        Image.fromarray(frame).save(out, "WEBP", quality=85, method=4)
+    else:
+        Image.fromarray(frame).save(out, "PNG")
+    return out.getvalue()
+
+
+def _render_to_file(path, top, bottom, fmt, target):
+    # Runs in the pool's worker processes too, so it only takes picklable arguments
+    started = time.perf_counter()
+    data = render_image(path, top, bottom, fmt)
+    tmp = f"{target}.{uuid.uuid4().hex}.tmp"  # unique per call: threads may render the same meme
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, target)
+    metrics.observe("meme_render_seconds", time.perf_counter() - started, format=fmt)
+    return len(data)
+
+
+def _clean(text):
+    text = " ".join(str(text or "").split()).upper()
+    if len(text) > MAX_TEXT:
+        raise ValueError(f"Meme text must be at most {MAX_TEXT} characters")
+    return text
+
+
+def variant(value):
+    """``(top, bottom)`` from ``{"top", "bottom"}`` or a "top / bottom" string (e.g. an AI caption)."""
+    if isinstance(value, dict):
+        top, bottom = value.get("top"), value.get("bottom")
+    elif isinstance(value, str):
+        top, _, bottom = value.partition("/")
+    else:
+        raise ValueError("Each variant must be an object with top/bottom text or a string")
+    top, bottom = _clean(top), _clean(bottom)
+    if not top and not bottom:
+        raise ValueError("Each variant needs top or bottom text")
+    return top, bottom
+
+
+class MemeRenderer:
+    def __init__(self, catalog, folder, workers=2, batch_max=20):
+        self.catalog = catalog
+        self.folder = folder
+        self.workers = workers
+        self.batch_max = batch_max
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        # A forked worker can't use its parent's pool; spawn keeps the pool's children free of our threads
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def key(self, path, top, bottom, fmt):
+        st = os.stat(path)
+        raw = json.dumps([VERSION, os.path.basename(path), st.st_size, int(st.st_mtime), top, bottom, fmt])
+        return hashlib.sha256(raw.encode()).hexdigest()[:32]
+
+    def render(self, template_id, variants, fmt="webp"):
+        """Render each variant of ``template_id``. Returns ``[{"filename", "top", "bottom", "cached"}]`` in order."""
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown image format: {fmt}")
+        if not isinstance(variants, list) or not variants:
+            raise ValueError("Give at least one caption variant")
+        if len(variants) > self.batch_max:
+            raise ValueError(f"Too many variants (max {self.batch_max})")
+        pairs = [variant(v) for v in variants]
+        path = self.catalog.image_path(template_id)
+        if path is None:
+            raise LookupError(f"Template {template_id} has no image available")
+
+        os.makedirs(self.folder, exist_ok=True)
+        results, todo = [], {}
+        for top, bottom in pairs:
+            filename = f"{self.key(path, top, bottom, fmt)}.{fmt}"
+            target = os.path.join(self.folder, filename)
+            cached = os.path.isfile(target)
+            if cached:
+                os.utime(target)  # keeps it clear of prune()
+            else:
+                todo[filename] = (path, top, bottom, fmt, target)
+            results.append({"filename": filename, "top": top, "bottom": bottom, "cached": cached})
+
+        jobs = list(todo.values())
+        if len(jobs) > 1 and self.workers > 1:
+            list(self._executor().map(_render_to_file, *zip(*jobs)))
+        else:
+            for job in jobs:
+                _render_to_file(*job)
+        metrics.inc("memes_rendered_total", len(jobs))
+        return results
+
+    def prune(self, max_age):
+        """Delete rendered memes nobody asked for in ``max_age`` seconds (a new request renders them again)."""
+        return prune_folder(self.folder, max_age)
@@ -0,0 +1,293 @@
+# utils/metrics.py
+"""
+Counters and latency histograms, exposed in the Prometheus text format.
+
+Call sites record with ``inc(name, **labels)``, ``observe(name, seconds,
+**labels)`` or ``with timed(name, **labels):``. Labels are keyword
+arguments, so keep their values low-cardinality: route templates, not URLs.
+
+The registry lives in each process. Gunicorn workers and the spawned render
+workers are separate processes, so with a metrics folder configured each
+process also writes its registry to ``<folder>/<pid>.json`` every few
+seconds. ``render()`` sums the files of all processes, which means any
+worker can answer a scrape with the totals for the whole host. The folder
+reaches the spawned render workers through the ``METRICS_DIR`` environment
+variable.
+
+``Profiler`` is the opt-in sampling profiler for requests. A sampled request
+runs under cProfile, and if it turns out slow its profile is written to
+disk. ``.prof`` files open in snakeviz or flameprof (flamegraph), and a
+``.txt`` summary sits next to each one.
+"""
+import atexit
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+FLUSH_INTERVAL = 5.0
+
+HELP = {
+    "http_request_duration_seconds": "Time from request start to response, by route",
+    "sqlite_query_duration_seconds": "Time to execute a statement (until its first row), by operation and table",
+    "external_call_duration_seconds": "Time spent in calls to AI providers and other external services",
+    "render_stage_duration_seconds": "Time spent in each stage of a render (open, audio, encode, mux)",
+    "app_import_seconds": "Time to import app.py (cold start), excluding preloaded subsystems",
+    "subsystem_load_seconds": "Time to import and build a lazily loaded subsystem on first use",
+    "meme_render_seconds": "Time to render and encode one server-side meme",
+    "memes_rendered_total": "Server-side memes rendered (requests answered from disk are not counted)",
+    "ai_fallbacks_total": "Requests answered with the canned fallback after every AI provider failed",
+    "profiles_written_total": "Slow sampled requests whose cProfile was written to disk",
+}
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Registry:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._counters = {}    # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [per-bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            h = self._histograms.get(key)
+            if h is None:
+                h = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    h[i] += 1
+                    break
+            h[-2] += seconds
+            h[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {"buckets": list(self.buckets),
+                    "counters": [[n, list(map(list, l)), v] for (n, l), v in self._counters.items()],
+                    "histograms": [[n, list(map(list, l)), list(h)] for (n, l), h in self._histograms.items()]}
+
+
+def _merge(snapshots):
+    counters, histograms, buckets = {}, {}, DEFAULT_BUCKETS
+    for snap in snapshots:
+        buckets = tuple(snap["buckets"])
+        for name, labels, value in snap["counters"]:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, h in snap["histograms"]:
+            key = (name, tuple(map(tuple, labels)))
+            total = histograms.setdefault(key, [0] * len(h))
+            for i, v in enumerate(h):
+                total[i] += v
+    return counters, histograms, buckets
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(pairs):
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}" if pairs else ""
+
+
+def to_text(snapshots):
+    """Prometheus exposition text for the summed ``snapshots``."""
+    counters, histograms, buckets = _merge(snapshots)
+    lines, seen = [], set()
+
+    def header(name, kind):
+        if name not in seen:
+            seen.add(name)
+            if name in HELP: lines.append(f"# HELP {name} {HELP[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), value in sorted(counters.items()):
+        header(name, "counter")
+        lines.append(f"{name}{_labels(labels)} {value}")
+    for (name, labels), h in sorted(histograms.items()):
+        header(name, "histogram")
+        cumulative = 0
+        for bound, count in zip(buckets, h):
+            cumulative += count
+            lines.append(f"{name}_bucket{_labels(labels + (('le', repr(float(bound))),))} {cumulative}")
+        lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {h[-1]}")
+        lines.append(f"{name}_sum{_labels(labels)} {round(h[-2], 6)}")
+        lines.append(f"{name}_count{_labels(labels)} {h[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+# ==========================================
+#           PROCESS REGISTRY
+# ==========================================
+
+registry = Registry()
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    # A forked worker (gunicorn --preload) would otherwise report its parent's numbers as its own too
+    global registry
+    registry = Registry()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def folder():
+    return os.getenv("METRICS_DIR") or None
+
+
+def configure(path):
+    """Share metrics through ``path``, including with render workers spawned later. Drops files of dead processes."""
+    os.makedirs(path, exist_ok=True)
+    os.environ["METRICS_DIR"] = path
+    for name in os.listdir(path):
+        pid = name.split(".")[0]
+        if pid.isdigit() and not _alive(int(pid)):
+            try: os.remove(os.path.join(path, name))
+            except OSError: pass
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def flush():
+    path = folder()
+    if not path:
+        return
+    target = os.path.join(path, f"{os.getpid()}.json")
+    with open(target + ".tmp", "w") as f:
+        json.dump(registry.snapshot(), f)
+    os.replace(target + ".tmp", target)
+
+
+def _ensure_flusher():
+    global _flusher_pid
+    if _flusher_pid == os.getpid() or not folder():
+        return
+    with _flusher_lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+
+        def loop():
+            while True:
+                time.sleep(FLUSH_INTERVAL)
+                try: flush()
+                except OSError as e: print("⚠️ Could not write metrics:", e)
+
+        threading.Thread(target=loop, name="metrics-flush", daemon=True).start()
+        atexit.register(flush)
+
+
+def inc(name, value=1, **labels):
+    registry.inc(name, value, **labels)
+    _ensure_flusher()
+
+
+def observe(name, seconds, **labels):
+    registry.observe(name, seconds, **labels)
+    _ensure_flusher()
+
+
+@contextmanager
+def timed(name, **labels):
+    """Observe the block's duration. An ``outcome`` label becomes "error" if the block raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        if "outcome" in labels: labels["outcome"] = "error"
+        raise
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+def render():
+    """The whole host's metrics (every process that wrote to the folder), or just this process's."""
+    path = folder()
+    if not path:
+        return to_text([registry.snapshot()])
+    snapshots = [registry.snapshot()]
+    own = f"{os.getpid()}.json"
+    for name in os.listdir(path):
+        if name.endswith(".json") and name != own:
+            try:
+                with open(os.path.join(path, name)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # being replaced right now; it is in the next scrape
+    return to_text(snapshots)
+
+
+# ==========================================
+#           SAMPLED PROFILING
+# ==========================================
+
+class Profiler:
+    def __init__(self, folder, sample_rate=0.0, slow_seconds=1.0, keep=200):
+        self.folder = folder
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.keep = keep
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0
+
+    def start(self, force=False):
+        """A running cProfile for this request if it is sampled (or ``force``d), else None."""
+        if not self.enabled or not (force or random.random() < self.sample_rate):
+            return None
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def finish(self, profile, label, seconds, force=False):
+        """Stop ``profile``; write it out if the request was slow. Returns the .prof path or None."""
+        profile.disable()
+        if seconds < self.slow_seconds and not force:
+            return None
+        os.makedirs(self.folder, exist_ok=True)
+        base = os.path.join(self.folder, f"{time.strftime('%Y%m%d-%H%M%S')}_{int(seconds * 1000)}ms_"
+                                         f"{re.sub(r'[^A-Za-z0-9]+', '_', label).strip('_')[:60]}_{os.getpid()}")
+        profile.dump_stats(base + ".prof")
+        summary = io.StringIO()
+        pstats.Stats(profile, stream=summary).sort_stats("cumulative").print_stats(40)
+        with open(base + ".txt", "w") as f:
+            f.write(f"{label} took {seconds:.3f}s\n\n{summary.getvalue()}")
+        inc("profiles_written_total")
+        self._prune()
+        return base + ".prof"
+
+    def _prune(self):
+        names = sorted(n for n in os.listdir(self.folder) if n.endswith(".prof"))
+        for name in names[:-self.keep]:
+            for ext in (".prof", ".txt"):
+                try: os.remove(os.path.join(self.folder, name[:-5] + ext))
+                except OSError: pass
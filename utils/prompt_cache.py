@@ -0,0 +1,195 @@
+# utils/prompt_cache.py
+"""
+Cache of AI answers keyed by the user's prompt.
+
+Prompts are normalized (case, punctuation, whitespace) before hashing, so
+"Viral post about our SALE!" and "viral post about our sale" share one
+paid call. Fuzzy matching is opt-in: with a ``near_threshold`` set, a miss
+on the exact key also checks the feature's most recently used prompts for a
+near-duplicate, measured as Jaccard similarity over character trigrams.
+Prompts with different numbers ("20% off" vs "50% off") never match, however
+similar the rest is. Keep the threshold high; at 0.85 "vegan burger" and
+"vegan burgers" already count as the same prompt.
+
+``scope`` holds the parts of a request that must match exactly for an
+answer to be reusable, such as the target platform of a post. Only the
+free text is compared fuzzily, so a LinkedIn post is never served for a
+Twitter request however similar the descriptions are.
+
+Entries expire per feature (``ttls``), and the cache is kept under
+``max_bytes`` of stored answers by evicting the least recently used rows.
+Hits (exact and near), misses and bypasses are counted in SQLite, like the
+render cache.
+"""
+import hashlib
+import re
+import time
+import unicodedata
+
+from utils import db
+
+DEFAULT_TTL = 24 * 3600
+NEAR_CANDIDATES = 300
+
+
+def _connect(db_path):
+    return db.connect(db_path)
+
+
+def init_prompt_cache_tables(db_path):
+    with _connect(db_path) as conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS prompt_cache (
+                            key TEXT PRIMARY KEY,
+                            feature TEXT NOT NULL,
+                            scope TEXT NOT NULL,
+                            prompt TEXT NOT NULL,
+                            response TEXT NOT NULL,
+                            size INTEGER NOT NULL,
+                            hits INTEGER NOT NULL DEFAULT 0,
+                            created_at REAL NOT NULL,
+                            last_used REAL NOT NULL)''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_prompt_cache_scope ON prompt_cache (feature, scope, last_used)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_prompt_cache_lru ON prompt_cache (last_used)")
+        conn.execute('''CREATE TABLE IF NOT EXISTS prompt_cache_stats (
+                            name TEXT PRIMARY KEY,
+                            value INTEGER NOT NULL DEFAULT 0)''')
+        conn.commit()
+
+
+def normalize(text):
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    text = re.sub(r"[^\w#@]+", " ", text)  # keep hashtags and handles, drop punctuation
+    return " ".join(text.split())
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def numbers(text):
+    return sorted(re.findall(r"\d+", text))
+
+
+def similarity(a, b):
+    """Jaccard similarity of the two (normalized) texts' character trigrams."""
+    ga, gb = trigrams(a), trigrams(b)
+    return len(ga & gb) / len(ga | gb) if ga or gb else 1.0
+
+
+class PromptCache:
+    def __init__(self, db_path, ttls=None, default_ttl=DEFAULT_TTL, max_bytes=50 * 1024 * 1024, near_threshold=0.0):
+        self.db_path = db_path
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+        self.max_bytes = max_bytes
+        self.near_threshold = near_threshold
+        self._ready = False
+
+    def _conn(self):
+        if not self._ready:
+            init_prompt_cache_tables(self.db_path)
+            self._ready = True
+        return _connect(self.db_path)
+
+    def _count(self, conn, name, n=1):
+        conn.execute('''INSERT INTO prompt_cache_stats (name, value) VALUES (?, ?)
+                        ON CONFLICT(name) DO UPDATE SET value = value + excluded.value''', (name, n))
+
+    @staticmethod
+    def key(feature, prompt, scope=""):
+        return hashlib.sha256(f"{feature}\0{scope}\0{normalize(prompt)}".encode()).hexdigest()
+
+    def ttl(self, feature):
+        return self.ttls.get(feature, self.default_ttl)
+
+    # ==========================================
+    #           LOOKUP / STORE
+    # ==========================================
+
+    def lookup(self, feature, prompt, scope=""):
+        """``{"response", "match", "similarity"}`` for a cached answer, or None on a miss."""
+        text = normalize(prompt)
+        cutoff = time.time() - self.ttl(feature)
+        with self._conn() as conn:
+            row = conn.execute("SELECT key, response FROM prompt_cache WHERE key = ? AND created_at > ?",
+                               (self.key(feature, prompt, scope), cutoff)).fetchone()
+            match, score = ("exact", 1.0) if row else (None, 0.0)
+            if row is None and self.near_threshold:
+                row, score = self._nearest(conn, feature, scope, text, cutoff)
+                match = "near" if row else None
+            if row is None:
+                self._count(conn, "misses")
+                return None
+            conn.execute("UPDATE prompt_cache SET hits = hits + 1, last_used = ? WHERE key = ?", (time.time(), row["key"]))
+            self._count(conn, f"{match}_hits")
+        return {"response": row["response"], "match": match, "similarity": round(score, 3)}
+
+    def _nearest(self, conn, feature, scope, text, cutoff):
+        best, best_score = None, self.near_threshold
+        grams, digits = trigrams(text), numbers(text)
+        rows = conn.execute('''SELECT key, prompt, response FROM prompt_cache
+                               WHERE feature = ? AND scope = ? AND created_at > ?
+                               ORDER BY last_used DESC LIMIT ?''',
+                            (feature, scope, cutoff, NEAR_CANDIDATES)).fetchall()
+        for row in rows:
+            # Jaccard can't beat the ratio of the two set sizes; skip the set maths when that is too low
+            other = trigrams(row["prompt"])
+            if min(len(grams), len(other)) / max(len(grams), len(other), 1) < best_score:
+                continue
+            score = len(grams & other) / len(grams | other)
+            if score >= best_score and numbers(row["prompt"]) == digits:
+                best, best_score = row, score
+        return best, best_score
+
+    def bypass(self):
+        """Count a user's "regenerate" request, which skips the lookup but still stores its answer."""
+        with self._conn() as conn:
+            self._count(conn, "bypasses")
+
+    def store(self, feature, prompt, response, scope=""):
+        if not response:
+            return
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute('''INSERT OR REPLACE INTO prompt_cache
+                            (key, feature, scope, prompt, response, size, hits, created_at, last_used)
+                            VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?)''',
+                         (self.key(feature, prompt, scope), feature, scope, normalize(prompt), response,
+                          len(response.encode()), now, now))
+            self._count(conn, "stores")
+        self.evict()
+
+    def evict(self):
+        """Drop expired rows, then least recently used ones until the cache fits in ``max_bytes``."""
+        now = time.time()
+        evicted = 0
+        with self._conn() as conn:
+            for feature in [r["feature"] for r in conn.execute("SELECT DISTINCT feature FROM prompt_cache")]:
+                evicted += conn.execute("DELETE FROM prompt_cache WHERE feature = ? AND created_at < ?",
+                                        (feature, now - self.ttl(feature))).rowcount
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM prompt_cache").fetchone()[0]
+            if total > self.max_bytes:
+                for row in conn.execute("SELECT key, size FROM prompt_cache ORDER BY last_used").fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    conn.execute("DELETE FROM prompt_cache WHERE key = ?", (row["key"],))
+                    total -= row["size"]
+                    evicted += 1
+            if evicted:
+                self._count(conn, "evictions", evicted)
+        return evicted
+
+    def stats(self):
+        with self._conn() as conn:
+            counters = {r["name"]: r["value"] for r in conn.execute("SELECT name, value FROM prompt_cache_stats")}
+            entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM prompt_cache").fetchone()
+        exact, near, misses = counters.get("exact_hits", 0), counters.get("near_hits", 0), counters.get("misses", 0)
+        lookups = exact + near + misses
+        return {
+            "entries": entries, "bytes": size, "max_bytes": self.max_bytes,
+            "exact_hits": exact, "near_hits": near, "misses": misses,
+            "bypasses": counters.get("bypasses", 0), "stores": counters.get("stores", 0),
+            "evictions": counters.get("evictions", 0),
+            "hit_rate": round((exact + near) / lookups, 3) if lookups else None,
+        }
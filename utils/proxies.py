@@ -0,0 +1,125 @@
+# utils/proxies.py
+"""
+Low-resolution editing proxies.
+
+Every uploaded video gets a small H.264 proxy (360p, low bitrate, a keyframe
+every second so preview trims are almost always plain stream copies) and a
+thumbnail strip for the asset list. Both live in hidden folders next to the
+original and are named after it, so finding - and deleting - them never needs
+more than the original's filename.
+
+Preview renders read the proxy instead of the original and are written to
+``.previews``; only a non-preview render (and always export) touches the
+full-resolution file.
+"""
+import os
+import time
+
+from utils import ffmpeg_tools
+from utils.files import generate_unique_filename
+
+PROXY_DIR = ".proxies"
+PREVIEW_DIR = ".previews"
+PROXY_HEIGHT = 360
+STRIP_TILES = 10
+STRIP_HEIGHT = 72
+PREVIEW_MAX_AGE = 24 * 3600
+
+
+def proxy_folder(upload_folder):
+    return os.path.join(upload_folder, PROXY_DIR)
+
+
+def preview_folder(upload_folder):
+    return os.path.join(upload_folder, PREVIEW_DIR)
+
+
+def proxy_name(filename):
+    return f"{filename}.proxy.mp4"
+
+
+def strip_name(filename):
+    return f"{filename}.strip.jpg"
+
+
+def proxy_path(upload_folder, filename):
+    return os.path.join(proxy_folder(upload_folder), proxy_name(filename))
+
+
+def is_fresh(upload_folder, filename):
+    """True if the proxy exists and is newer than the original."""
+    try:
+        return os.stat(proxy_path(upload_folder, filename)).st_mtime >= \
+            os.stat(os.path.join(upload_folder, filename)).st_mtime
+    except OSError:
+        return False
+
+
+# ==========================================
+#           GENERATION
+# ==========================================
+
+def generate(upload_folder, filename, info=None, progress=None):
+    """Write the proxy and thumbnail strip for ``filename``. Returns their names."""
+    src = os.path.join(upload_folder, filename)
+    info = info or ffmpeg_tools.probe(src)
+    if not info.get("video_codec"):
+        raise ValueError(f"{filename} has no video stream")
+    os.makedirs(proxy_folder(upload_folder), exist_ok=True)
+
+    # Never upscale; -2 keeps the width even for yuv420p
+    height = min(info.get("height") or PROXY_HEIGHT, PROXY_HEIGHT)
+    proxy = proxy_path(upload_folder, filename)
+    tmp = proxy + ".tmp.mp4"
+    audio_args = ["-map", "0:a:0?", "-c:a", "aac", "-b:a", "64k", "-ac", "2"]
+    ffmpeg_tools.run_ffmpeg([
+        "-i", src, "-map", "0:v:0", "-vf", f"scale=-2:{height},format=yuv420p",
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", "30", "-maxrate", "800k", "-bufsize", "1600k",
+        "-force_key_frames", "expr:gte(t,n_forced*1)", *audio_args,
+        "-movflags", "+faststart", tmp])
+    os.replace(tmp, proxy)
+    if progress: progress(0.8)
+
+    strip = os.path.join(proxy_folder(upload_folder), strip_name(filename))
+    duration = info.get("duration") or 1
+    # Sample the proxy, not the original: it is tiny and already the right size to scale from
+    ffmpeg_tools.run_ffmpeg([
+        "-i", proxy, "-vf", f"fps={STRIP_TILES / duration:.6f},scale=-2:{STRIP_HEIGHT},tile={STRIP_TILES}x1",
+        "-frames:v", "1", "-q:v", "5", strip])
+    if progress: progress(1.0)
+    return {"proxy": proxy_name(filename), "strip": strip_name(filename)}
+
+
+def preview_output(upload_folder, source_filename, prefix):
+    """Path (and name) for a preview render; old previews are swept on the way."""
+    folder = preview_folder(upload_folder)
+    os.makedirs(folder, exist_ok=True)
+    sweep_previews(upload_folder)
+    name = generate_unique_filename(source_filename, prefix=f"preview_{prefix}" if prefix else "preview")
+    return os.path.join(folder, name), name
+
+
+# ==========================================
+#           CLEANUP
+# ==========================================
+
+def remove(upload_folder, filename):
+    """Delete the proxy and thumbnail strip belonging to ``filename``."""
+    for name in (proxy_name(filename), strip_name(filename)):
+        try:
+            os.remove(os.path.join(proxy_folder(upload_folder), name))
+        except FileNotFoundError:
+            pass
+
+
+def sweep_previews(upload_folder, max_age=PREVIEW_MAX_AGE):
+    folder = preview_folder(upload_folder)
+    if not os.path.isdir(folder):
+        return
+    cutoff = time.time() - max_age
+    for entry in os.scandir(folder):
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            pass
@@ -0,0 +1,234 @@
+# utils/render_cache.py
+"""
+Content-addressed render cache.
+
+A render's key is the SHA-256 of its action, its parameters and the encoder
+settings, with every input filename replaced by the SHA-256 of the file's
+content. Renaming or re-uploading the same clip therefore still hits, while
+editing a file (new content) misses.
+
+Cached outputs are hard links in ``<output folder>/.render_cache``, so the
+cache costs no extra disk while the user still has the asset, and a hit for
+an asset that has since been deleted is restored by linking it back. The
+cache directory is kept under ``max_bytes`` by evicting the least recently
+used entries. Hits, misses and evictions are counted in SQLite so every
+worker process reports into the same numbers.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+
+from utils import db
+from utils.files import generate_unique_filename
+
+CACHE_DIR = ".render_cache"
+READ_BLOCK = 1024 * 1024
+
+
+def _connect(db_path):
+    return db.connect(db_path)
+
+
+def init_cache_tables(db_path):
+    with _connect(db_path) as conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS render_cache (
+                            key TEXT PRIMARY KEY,
+                            action TEXT NOT NULL,
+                            blob TEXT NOT NULL,
+                            output TEXT NOT NULL,
+                            result TEXT NOT NULL,
+                            size INTEGER NOT NULL,
+                            hits INTEGER NOT NULL DEFAULT 0,
+                            created_at REAL NOT NULL,
+                            last_used REAL NOT NULL)''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_render_cache_lru ON render_cache (last_used)")
+        conn.execute('''CREATE TABLE IF NOT EXISTS render_cache_stats (
+                            name TEXT PRIMARY KEY,
+                            value INTEGER NOT NULL DEFAULT 0)''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS file_digests (
+                            path TEXT PRIMARY KEY,
+                            size INTEGER NOT NULL,
+                            mtime REAL NOT NULL,
+                            sha256 TEXT NOT NULL)''')
+        conn.commit()
+
+
+class RenderCache:
+    def __init__(self, db_path, output_folder, max_bytes=5 * 1024 ** 3):
+        self.db_path = db_path
+        self.output_folder = output_folder
+        self.cache_folder = os.path.join(output_folder, CACHE_DIR)
+        self.max_bytes = max_bytes
+        self._ready = False
+
+    def _conn(self):
+        if not self._ready:
+            init_cache_tables(self.db_path)
+            os.makedirs(self.cache_folder, exist_ok=True)
+            self._ready = True
+        return _connect(self.db_path)
+
+    def _count(self, conn, name, n=1):
+        conn.execute('''INSERT INTO render_cache_stats (name, value) VALUES (?, ?)
+                        ON CONFLICT(name) DO UPDATE SET value = value + excluded.value''', (name, n))
+
+    # ==========================================
+    #           KEYS
+    # ==========================================
+
+    def digest(self, path, compute=True):
+        """SHA-256 of the file's content, remembered per (path, size, mtime).
+
+        With ``compute=False`` an unknown file returns None instead of being
+        read, so the web process never hashes a large upload inline.
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        with self._conn() as conn:
+            row = conn.execute("SELECT size, mtime, sha256 FROM file_digests WHERE path = ?", (path,)).fetchone()
+        if row and row["size"] == st.st_size and row["mtime"] == st.st_mtime:
+            return row["sha256"]
+        if not compute:
+            return None
+
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(READ_BLOCK), b""):
+                h.update(block)
+        with self._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO file_digests (path, size, mtime, sha256) VALUES (?, ?, ?, ?)",
+                         (path, st.st_size, st.st_mtime, h.hexdigest()))
+            conn.commit()
+        return h.hexdigest()
+
+    def key(self, action, params, settings=None, source_folder=None, compute=True):
+        """Cache key for ``action`` with ``params``, or None if an input digest isn't known yet.
+
+        Any string in ``params`` naming a file in ``source_folder`` is replaced
+        by that file's content hash; floats are rounded to the millisecond so
+        "1.5" and "1.50" from different forms agree.
+        """
+        folder = source_folder or self.output_folder
+        missing = []
+
+        def normalize(value):
+            if isinstance(value, dict):
+                return {k: normalize(v) for k, v in sorted(value.items())}
+            if isinstance(value, (list, tuple)):
+                return [normalize(v) for v in value]
+            if isinstance(value, float):
+                return round(value, 3)
+            if isinstance(value, str) and value and os.path.basename(value) == value:
+                path = os.path.join(folder, value)
+                if os.path.isfile(path):
+                    sha = self.digest(path, compute=compute)
+                    if sha is None:
+                        missing.append(value)
+                    return f"sha256:{sha}"
+            return value
+
+        payload = {"action": action, "params": normalize(params), "settings": settings or {}}
+        if missing:
+            return None
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+    # ==========================================
+    #           LOOKUP / STORE
+    # ==========================================
+
+    def lookup(self, key, folder=None, record_miss=True):
+        """Result dict for ``key`` with its output present in ``folder``, or None on a miss.
+
+        ``record_miss=False`` is for speculative checks (the web process peeking
+        before it queues a job) so the worker's own lookup isn't counted twice.
+        """
+        if key is None:
+            return None
+        folder = folder or self.output_folder
+        with self._conn() as conn:
+            row = conn.execute("SELECT * FROM render_cache WHERE key = ?", (key,)).fetchone()
+            blob = os.path.join(self.cache_folder, row["blob"]) if row else None
+            if row is None or not os.path.isfile(blob):
+                if row is not None:
+                    conn.execute("DELETE FROM render_cache WHERE key = ?", (key,))
+                if record_miss:
+                    self._count(conn, "misses")
+                conn.commit()
+                return None
+
+            output = row["output"]
+            target = os.path.join(folder, output)
+            if not (os.path.exists(target) and os.path.samefile(target, blob)):
+                # The asset was deleted (or replaced): put the cached copy back under a fresh name
+                output = generate_unique_filename(output)
+                os.makedirs(folder, exist_ok=True)
+                self._link(blob, os.path.join(folder, output))
+            conn.execute("UPDATE render_cache SET hits = hits + 1, last_used = ?, output = ? WHERE key = ?",
+                         (time.time(), output, key))
+            self._count(conn, "hits")
+            conn.commit()
+        result = json.loads(row["result"])
+        result.update(output=output, cached=True)
+        return result
+
+    def store(self, key, action, result, output_path):
+        """Remember ``output_path`` (the file behind ``result["output"]``) under ``key``."""
+        if key is None or not os.path.isfile(output_path):
+            return
+        blob = key[:32] + os.path.splitext(output_path)[1]
+        blob_path = os.path.join(self.cache_folder, blob)
+        with self._conn() as conn:
+            if os.path.exists(blob_path):
+                os.remove(blob_path)
+            self._link(output_path, blob_path)
+            now = time.time()
+            conn.execute('''INSERT OR REPLACE INTO render_cache
+                            (key, action, blob, output, result, size, hits, created_at, last_used)
+                            VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?)''',
+                         (key, action, blob, os.path.basename(output_path), json.dumps(result),
+                          os.path.getsize(output_path), now, now))
+            self._count(conn, "stores")
+            conn.commit()
+        self.evict()
+
+    @staticmethod
+    def _link(src, dst):
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)  # e.g. a filesystem without hard links
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits in ``max_bytes``."""
+        with self._conn() as conn:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM render_cache").fetchone()[0]
+            if total <= self.max_bytes:
+                return 0
+            evicted = 0
+            for row in conn.execute("SELECT key, blob, size FROM render_cache ORDER BY last_used").fetchall():
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.cache_folder, row["blob"]))
+                except FileNotFoundError:
+                    pass
+                conn.execute("DELETE FROM render_cache WHERE key = ?", (row["key"],))
+                total -= row["size"]
+                evicted += 1
+            self._count(conn, "evictions", evicted)
+            conn.commit()
+        return evicted
+
+    def stats(self):
+        with self._conn() as conn:
+            counters = {r["name"]: r["value"] for r in conn.execute("SELECT name, value FROM render_cache_stats")}
+            entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM render_cache").fetchone()
+        hits, misses = counters.get("hits", 0), counters.get("misses", 0)
+        return {
+            "entries": entries, "bytes": size, "max_bytes": self.max_bytes,
+            "hits": hits, "misses": misses, "stores": counters.get("stores", 0),
+            "evictions": counters.get("evictions", 0),
+            "hit_rate": round(hits / (hits + misses), 3) if hits + misses else None,
+        }
@@ -0,0 +1,131 @@
+# utils/scheduler.py
+"""
+Periodic background tasks shared by all web processes.
+
+Every process runs the same small loop, but a task's schedule lives in
+SQLite: a process claims a due task with a lease (like render jobs, see
+utils/jobs.py), so each run happens once across all gunicorn workers. If the
+process dies mid-run, the lease expires and another process picks the task
+up on its next tick.
+
+Tasks are plain callables registered with ``every(name, seconds, fn)``.
+What a task returns is stored as its ``last_result`` (truncated), and an
+exception is stored as ``last_error``. Neither stops the schedule.
+"""
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+from utils import db
+
+
+def _connect(db_path):
+    return db.connect(db_path)
+
+
+def init_scheduler_table(db_path):
+    with _connect(db_path) as conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS scheduled_tasks (
+                            name TEXT PRIMARY KEY,
+                            interval REAL NOT NULL,
+                            next_run REAL NOT NULL,
+                            owner TEXT,
+                            lease_until REAL,
+                            last_run REAL,
+                            last_duration REAL,
+                            last_result TEXT,
+                            last_error TEXT,
+                            runs INTEGER NOT NULL DEFAULT 0,
+                            failures INTEGER NOT NULL DEFAULT 0)''')
+        conn.commit()
+
+
+class Scheduler:
+    def __init__(self, db_path, poll_interval=5.0):
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self._tasks = {}  # name -> (interval, fn, lease_seconds)
+        self._pid = None
+        self._owner = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def every(self, name, seconds, fn, initial_delay=0.0, lease_seconds=None):
+        """Run ``fn()`` every ``seconds`` (first run ``initial_delay`` after the task is first registered)."""
+        self._tasks[name] = (seconds, fn, lease_seconds or max(60.0, seconds / 2))
+        init_scheduler_table(self.db_path)
+        with _connect(self.db_path) as conn:
+            conn.execute("INSERT OR IGNORE INTO scheduled_tasks (name, interval, next_run) VALUES (?, ?, ?)",
+                         (name, seconds, time.time() + initial_delay))
+            # A changed interval applies from the next run on
+            conn.execute("UPDATE scheduled_tasks SET interval = ? WHERE name = ?", (seconds, name))
+        return self
+
+    def start(self):
+        """Start the scheduler loop in this process (idempotent, fork-aware)."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._owner = f"{socket.gethostname()}:{self._pid}:{uuid.uuid4().hex[:6]}"
+            threading.Thread(target=self._loop, name="scheduler", daemon=True).start()
+            print(f"⏰ Scheduler started ({len(self._tasks)} tasks, owner {self._owner})")
+
+    def run_now(self, name):
+        """Make ``name`` due immediately (whichever process ticks first runs it)."""
+        with _connect(self.db_path) as conn:
+            conn.execute("UPDATE scheduled_tasks SET next_run = ? WHERE name = ?", (time.time(), name))
+        self._wake.set()
+
+    def status(self):
+        """Schedule and last outcome of this process's registered tasks."""
+        rows = _connect(self.db_path).execute("SELECT * FROM scheduled_tasks ORDER BY name").fetchall()
+        return [dict(r) for r in rows if r["name"] in self._tasks]
+
+    # ==========================================
+    #           LOOP
+    # ==========================================
+
+    def _loop(self):
+        while True:
+            for name in list(self._tasks):
+                try:
+                    if self._claim(name):
+                        self._run(name)
+                except Exception as e:
+                    print(f"⚠️ Scheduler error in {name}: {e}")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def _claim(self, name):
+        now = time.time()
+        with _connect(self.db_path) as conn:
+            cur = conn.execute('''UPDATE scheduled_tasks SET owner = ?, lease_until = ?
+                                  WHERE name = ? AND next_run <= ? AND (lease_until IS NULL OR lease_until < ?)''',
+                               (self._owner, now + self._tasks[name][2], name, now, now))
+        return cur.rowcount == 1
+
+    def _run(self, name):
+        interval, fn, _ = self._tasks[name]
+        started = time.time()
+        result, error = None, None
+        try:
+            result = fn()
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            print(f"⚠️ Scheduled task {name} failed: {error}")
+        finished = time.time()
+        with _connect(self.db_path) as conn:
+            # Schedule from the start so runs don't drift by their own duration
+            conn.execute('''UPDATE scheduled_tasks SET next_run = ?, owner = NULL, lease_until = NULL,
+                            last_run = ?, last_duration = ?, last_result = ?, last_error = ?,
+                            runs = runs + 1, failures = failures + ?
+                            WHERE name = ? AND owner = ?''',
+                         (max(started + interval, finished), started, round(finished - started, 3),
+                          json.dumps(result, default=str)[:1000] if result is not None else None,
+                          error, 1 if error else 0, name, self._owner))
@@ -0,0 +1,135 @@
+# utils/scratch.py
+"""
+Per-job scratch directories for renders.
+
+Each render job gets its own directory, ``<root>/<job_id>.<host>.<pid>``, for
+everything it writes besides its output: MoviePy's temp audio track, ffmpeg
+concat lists and overlay images, and encoded segments. Two renders never
+share a temp file, so they can run side by side in one process or in many.
+
+* ``ScratchSpace.job(job_id)`` creates the directory and makes it
+  ``current()`` for the code running the job. It is a context variable, so
+  threads don't see each other's. The directory is removed when the job
+  ends, whether it succeeded or failed.
+* A worker process that dies mid-job can't clean up after itself. The
+  dispatcher removes the crashed job's directory (``discard``), and
+  ``sweep`` removes every directory whose process is gone on this host or
+  that is older than ``max_age``. Dispatchers sweep when they start, and the
+  scheduler sweeps periodically.
+* ``check()`` enforces the quotas: a job's directory may hold at most
+  ``quota_bytes``, and the filesystem must keep ``min_free_bytes`` free.
+  Renders call it from their progress callback, so a runaway job fails with
+  ``ScratchQuotaError`` instead of filling the disk.
+
+To keep temp files in memory, point the root at a tmpfs (e.g. /dev/shm/...)
+and set a quota that fits.
+
+Code that needs a temp file or directory uses ``current()`` as the ``dir``
+(outside a job it is None, meaning the system temp dir), or ``path(name)``.
+"""
+import contextvars
+import os
+import shutil
+import socket
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+
+_current = contextvars.ContextVar("scratch_dir", default=None)
+
+
+class ScratchQuotaError(Exception):
+    """A render outgrew its scratch quota, or the scratch filesystem is nearly full."""
+
+
+def current():
+    """The running job's scratch directory, or None outside a job."""
+    return _current.get()
+
+
+def path(name):
+    """A fresh path for a temp file called ``name``, in the job's scratch directory if there is one."""
+    return os.path.join(current() or tempfile.gettempdir(), f"{uuid.uuid4().hex[:8]}_{name}")
+
+
+def _usage(folder):
+    total = 0
+    for root, _, files in os.walk(folder):
+        for name in files:
+            try: total += os.lstat(os.path.join(root, name)).st_size
+            except OSError: pass
+    return total
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class ScratchSpace:
+    def __init__(self, root, quota_bytes=0, min_free_bytes=0, max_age=24 * 3600):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.min_free_bytes = min_free_bytes
+        self.max_age = max_age
+
+    @contextmanager
+    def job(self, job_id):
+        """Create the job's directory and make it ``current()`` until the block exits; then remove it."""
+        os.makedirs(self.root, exist_ok=True)
+        folder = os.path.join(self.root, f"{job_id}.{socket.gethostname()}.{os.getpid()}")
+        os.makedirs(folder, exist_ok=True)
+        token = _current.set(folder)
+        try:
+            yield folder
+        finally:
+            _current.reset(token)
+            shutil.rmtree(folder, ignore_errors=True)
+
+    def check(self, folder=None):
+        """Raise ScratchQuotaError if ``folder`` (default: the current job's) is over quota or the disk is full."""
+        folder = folder or current()
+        if folder is None:
+            return
+        if self.quota_bytes:
+            used = _usage(folder)
+            if used > self.quota_bytes:
+                raise ScratchQuotaError(f"Render used {used // 2**20} MB of scratch space "
+                                        f"(limit {self.quota_bytes // 2**20} MB)")
+        if self.min_free_bytes and shutil.disk_usage(folder).free < self.min_free_bytes:
+            raise ScratchQuotaError("Scratch disk is almost full, please try again later")
+
+    def discard(self, job_id):
+        """Remove ``job_id``'s directories (for a worker that died before cleaning up)."""
+        if not os.path.isdir(self.root):
+            return 0
+        removed = 0
+        for name in os.listdir(self.root):
+            if name.split(".")[0] == job_id:
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+                removed += 1
+        return removed
+
+    def sweep(self):
+        """Remove directories left by dead processes on this host, and any older than ``max_age``."""
+        if not os.path.isdir(self.root):
+            return 0
+        host, cutoff, removed = socket.gethostname(), time.time() - self.max_age, 0
+        for name in os.listdir(self.root):
+            folder = os.path.join(self.root, name)
+            _, _, rest = name.partition(".")
+            owner_host, _, pid = rest.rpartition(".")
+            try:
+                orphan = owner_host == host and pid.isdigit() and not _alive(int(pid))
+                if orphan or os.path.getmtime(folder) < cutoff:
+                    shutil.rmtree(folder, ignore_errors=True)
+                    removed += 1
+            except OSError:
+                continue
+        return removed
@@ -0,0 +1,127 @@
+# utils/segment_render.py
+"""
+Segment-parallel encoding for MoviePy renders.
+
+``write_videofile`` pushes every frame through one Python loop into one
+ffmpeg, so a long render keeps about one core busy. ``render`` instead splits
+the output timeline into segments of whole GOPs. Each segment goes to a
+spawned worker process, which rebuilds the clip with ``build(*args)`` and
+encodes only its own frames. The segments are then joined with the concat
+demuxer (stream copy, no re-encode), and the audio, rendered once by the
+parent, is muxed in the same pass.
+
+Segment boundaries fall on frame numbers that are multiples of the GOP
+length, and every worker encodes with the same settings and a fixed ``-g``.
+So each segment starts exactly where a serial encode with that ``-g`` would
+put a keyframe, and the joined file is one ordinary H.264 stream.
+
+``build`` must be a module-level function (workers get it by name) returning
+``(clip, sources)``: the clip to encode and the clips to close afterwards.
+
+RENDER_SEGMENT_WORKERS (0 or 1 turns this off) and RENDER_SEGMENT_SECONDS
+are read from the environment of the render worker process.
+"""
+import math
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from utils import ffmpeg_tools, metrics, scratch
+
+GOP_SECONDS = 2.0
+CONTAINERS = {".mp4", ".mov", ".m4v", ".mkv"}
+AUDIO_FPS = 44100  # what write_videofile uses
+
+
+def settings():
+    """(workers, segment_seconds) for this process."""
+    workers = int(os.getenv("RENDER_SEGMENT_WORKERS", min(os.cpu_count() or 1, 8)))
+    return workers, float(os.getenv("RENDER_SEGMENT_SECONDS", 10))
+
+
+def gop_frames(fps):
+    return max(int(round(fps * GOP_SECONDS)), 1)
+
+
+def frame_count(duration, fps):
+    # Frames at t = i / fps for every t < duration, like write_videofile
+    return max(int(math.ceil(duration * fps - 1e-6)), 1)
+
+
+def plan(duration, fps, output_path, workers=None, segment_seconds=None):
+    """``[(first_frame, frames), ...]``, or None when a serial encode is the better choice."""
+    default_workers, default_seconds = settings()
+    workers = default_workers if workers is None else workers
+    segment_seconds = segment_seconds or default_seconds
+    if workers < 2 or not fps or not duration or os.path.splitext(output_path)[1].lower() not in CONTAINERS:
+        return None
+    total = frame_count(duration, fps)
+    gop = gop_frames(fps)
+    size = max(int(round(segment_seconds * fps / gop)), 1) * gop
+    if total < 2 * size:
+        return None
+    return [(first, min(size, total - first)) for first in range(0, total, size)]
+
+
+def _encode_segment(build, args, first, count, fps, path, preset, threads):
+    """Worker: rebuild the clip and encode frames ``first`` .. ``first + count - 1`` to ``path``."""
+    from moviepy.video.io.ffmpeg_writer import FFMPEG_VideoWriter
+
+    clip, sources = build(*args)
+    try:
+        writer = FFMPEG_VideoWriter(path, clip.size, fps, codec="libx264", preset=preset, threads=threads,
+                                    ffmpeg_params=["-g", str(gop_frames(fps))])
+        try:
+            for i in range(first, first + count):
+                writer.write_frame(clip.get_frame(i / fps).astype("uint8", copy=False))
+        finally:
+            writer.close()
+    finally:
+        for source in sources:
+            source.close()
+    return count
+
+
+def render(build, args, clip, output_path, segments, action, progress=None, preset="medium", workers=None):
+    """Encode ``clip`` (already built by the caller from ``build(*args)``) segment by segment in parallel."""
+    workers = min(workers or settings()[0], len(segments))
+    fps = clip.fps
+    total = sum(count for _, count in segments)
+    threads = max((os.cpu_count() or 1) // workers, 1)
+
+    with tempfile.TemporaryDirectory(prefix="segments_", dir=scratch.current()) as tmp:
+        audio = None
+        if clip.audio is not None:
+            audio = os.path.join(tmp, "audio.m4a")
+            with metrics.timed("render_stage_duration_seconds", action=action, stage="audio"):
+                clip.audio.write_audiofile(audio, fps=AUDIO_FPS, codec="aac", logger=None)
+
+        parts = [os.path.join(tmp, f"segment{i:04d}.mp4") for i in range(len(segments))]
+        started = time.perf_counter()
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        try:
+            futures = [pool.submit(_encode_segment, build, args, first, count, fps, part, preset, threads)
+                       for (first, count), part in zip(segments, parts)]
+            done = 0
+            for future in as_completed(futures):
+                done += future.result()
+                if progress: progress(done / total)
+        finally:
+            # On failure, don't wait for the other segments
+            pool.shutdown(wait=True, cancel_futures=True)
+        metrics.observe("render_stage_duration_seconds", time.perf_counter() - started, action=action, stage="encode")
+
+        listing = os.path.join(tmp, "segments.txt")
+        with open(listing, "w") as f:
+            for part in parts:
+                f.write(f"file '{part}'\n")
+        inputs, maps = ["-f", "concat", "-safe", "0", "-i", listing], ["-map", "0:v:0"]
+        if audio:
+            inputs += ["-i", audio]
+            maps += ["-map", "1:a:0"]
+        faststart = ["-movflags", "+faststart"] if output_path.lower().endswith((".mp4", ".mov", ".m4v")) else []
+        with metrics.timed("render_stage_duration_seconds", action=action, stage="mux"):
+            ffmpeg_tools.run_ffmpeg([*inputs, *maps, "-c", "copy", *faststart, output_path])
+    return {"segments": len(segments), "workers": workers}
@@ -0,0 +1,130 @@
+# utils/snapshots.py
+"""
+Precomputed trend and hashtag snapshots.
+
+The scheduler writes one row per region and run: the merged trend list (with
+the per-source report it came from), and separately the hashtag set and
+viral tip the recommendations prompt produces for that region. Pages read
+the latest row instead of calling any upstream. The older rows are the
+history behind the trend-over-time view, pruned after ``keep_days``.
+
+Which regions get snapshots: the configured ones plus whatever users have
+asked for recently (``note_request``).
+"""
+import json
+import time
+
+from utils import db
+
+
+def _connect(db_path):
+    return db.connect(db_path)
+
+
+def region_key(region):
+    return " ".join((region or "").split()).lower()
+
+
+def init_snapshot_tables(db_path):
+    with _connect(db_path) as conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS trend_snapshots (
+                            id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            region TEXT NOT NULL,
+                            taken_at REAL NOT NULL,
+                            trends TEXT NOT NULL,
+                            sources TEXT)''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_trend_snapshots_region ON trend_snapshots (region, taken_at DESC)")
+        conn.execute('''CREATE TABLE IF NOT EXISTS hashtag_snapshots (
+                            id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            region TEXT NOT NULL,
+                            taken_at REAL NOT NULL,
+                            hashtags TEXT NOT NULL,
+                            tip TEXT)''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_hashtag_snapshots_region ON hashtag_snapshots (region, taken_at DESC)")
+        conn.execute('''CREATE TABLE IF NOT EXISTS snapshot_regions (
+                            region TEXT PRIMARY KEY,
+                            label TEXT NOT NULL,
+                            requests INTEGER NOT NULL DEFAULT 0,
+                            last_requested REAL)''')
+        conn.commit()
+
+
+class SnapshotStore:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._ready = False
+
+    def _conn(self):
+        if not self._ready:
+            init_snapshot_tables(self.db_path)
+            self._ready = True
+        return _connect(self.db_path)
+
+    # ==========================================
+    #           REGIONS
+    # ==========================================
+
+    def note_request(self, region):
+        with self._conn() as conn:
+            conn.execute('''INSERT INTO snapshot_regions (region, label, requests, last_requested) VALUES (?, ?, 1, ?)
+                            ON CONFLICT(region) DO UPDATE SET requests = requests + 1,
+                                                              last_requested = excluded.last_requested''',
+                         (region_key(region), region.strip(), time.time()))
+
+    def regions(self, configured=(), limit=20, within=7 * 24 * 3600):
+        """``configured`` regions first, then the most requested recent ones, without duplicates."""
+        rows = self._conn().execute('''SELECT label FROM snapshot_regions WHERE last_requested > ?
+                                       ORDER BY requests DESC LIMIT ?''', (time.time() - within, limit)).fetchall()
+        seen, out = set(), []
+        for label in [*configured, *(r["label"] for r in rows)]:
+            if region_key(label) not in seen:
+                seen.add(region_key(label))
+                out.append(label)
+        return out[:max(limit, len(configured))]
+
+    # ==========================================
+    #           TRENDS
+    # ==========================================
+
+    def save_trends(self, region, trends, sources=None):
+        with self._conn() as conn:
+            conn.execute("INSERT INTO trend_snapshots (region, taken_at, trends, sources) VALUES (?, ?, ?, ?)",
+                         (region_key(region), time.time(), json.dumps(trends), json.dumps(sources or {})))
+
+    def latest_trends(self, region):
+        """``{"taken_at", "trends", "sources"}`` of the newest snapshot, or None."""
+        row = self._conn().execute('''SELECT taken_at, trends, sources FROM trend_snapshots WHERE region = ?
+                                      ORDER BY taken_at DESC LIMIT 1''', (region_key(region),)).fetchone()
+        if row is None:
+            return None
+        return {"taken_at": row["taken_at"], "trends": json.loads(row["trends"]), "sources": json.loads(row["sources"] or "{}")}
+
+    def trend_history(self, region, since=None, limit=200):
+        """Snapshots of ``region`` newer than ``since``, oldest first."""
+        rows = self._conn().execute('''SELECT taken_at, trends FROM trend_snapshots WHERE region = ? AND taken_at > ?
+                                       ORDER BY taken_at DESC LIMIT ?''',
+                                    (region_key(region), since or 0, limit)).fetchall()
+        return [{"taken_at": r["taken_at"], "trends": json.loads(r["trends"])} for r in reversed(rows)]
+
+    # ==========================================
+    #           HASHTAGS
+    # ==========================================
+
+    def save_hashtags(self, region, hashtags, tip=None):
+        with self._conn() as conn:
+            conn.execute("INSERT INTO hashtag_snapshots (region, taken_at, hashtags, tip) VALUES (?, ?, ?, ?)",
+                         (region_key(region), time.time(), json.dumps(hashtags), tip))
+
+    def latest_hashtags(self, region):
+        row = self._conn().execute('''SELECT taken_at, hashtags, tip FROM hashtag_snapshots WHERE region = ?
+                                      ORDER BY taken_at DESC LIMIT 1''', (region_key(region),)).fetchone()
+        if row is None:
+            return None
+        return {"taken_at": row["taken_at"], "hashtags": json.loads(row["hashtags"]), "tip": row["tip"]}
+
+    def prune(self, keep_days=30):
+        cutoff = time.time() - keep_days * 24 * 3600
+        with self._conn() as conn:
+            n = conn.execute("DELETE FROM trend_snapshots WHERE taken_at < ?", (cutoff,)).rowcount
+            n += conn.execute("DELETE FROM hashtag_snapshots WHERE taken_at < ?", (cutoff,)).rowcount
+        return n
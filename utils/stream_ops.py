@@ -0,0 +1,309 @@
+# utils/stream_ops.py
+"""
+Container-level ffmpeg operations that avoid a full MoviePy decode/encode.
+
+Trim modes:
+  copy     - the cut starts on a keyframe, so both streams are copied as-is
+  smart    - re-encode only the partial GOP before the first keyframe in the
+             range, stream-copy the rest and join the two (H.264 only). Only
+             the in-point is smart; the out-point is a plain copy cut
+  reencode - not possible without decoding; the caller falls back to MoviePy
+"""
+import os
+import tempfile
+
+from utils import ffmpeg_tools, scratch
+
+# Smart cut needs an encoder that can produce a bitstream compatible with the copied part
+SMART_CUT_ENCODERS = {"h264": "libx264"}
+X264_PROFILES = {"baseline": "baseline", "constrained baseline": "baseline", "main": "main",
+                 "high": "high", "high 10": "high10", "high 4:2:2": "high422", "high 4:4:4 predictive": "high444"}
+FASTSTART_EXTS = {".mp4", ".mov", ".m4v"}
+# The re-encoded head must agree with the source on these, or the joined stream may not play
+SMART_CUT_MATCH = ("width", "height", "pix_fmt", "profile", "level")
+
+
+def _container_args(out_path):
+    return ["-movflags", "+faststart"] if os.path.splitext(out_path)[1].lower() in FASTSTART_EXTS else []
+
+
+# ==========================================
+#           TRIM
+# ==========================================
+
+def plan_trim(path, start, end, mode="auto", info=None, keyframes=None):
+    """Decide how to cut ``path`` between ``start`` and ``end`` seconds.
+
+    ``mode`` is "auto", "copy" (snap the start back to the previous keyframe
+    rather than re-encoding anything) or "reencode". Returns a dict with the
+    chosen ``mode`` plus the (possibly snapped) start/end and the keyframe
+    the copied part begins on.
+    """
+    info = info or ffmpeg_tools.probe(path)
+    duration = info["duration"] or 0
+    if not end or (duration and end > duration): end = duration
+    if start >= end:
+        raise ValueError("Invalid start/end times")
+
+    plan = {"mode": "reencode", "start": start, "end": end, "keyframe": None, "snapped": False}
+    if mode == "reencode" or not info["video_codec"]:
+        return plan
+
+    kfs = keyframes if keyframes is not None else ffmpeg_tools.keyframes(path)
+    if not kfs:
+        return plan
+
+    tol = max(0.5 / info["fps"], 0.01) if info["fps"] else 0.02
+    previous = max((k for k in kfs if k <= start + tol), default=None)
+    following = min((k for k in kfs if k >= start - tol), default=None)
+
+    if following is not None and abs(following - start) <= tol:
+        plan.update(mode="copy", start=following, keyframe=following)
+    elif previous is not None and abs(previous - start) <= tol:
+        plan.update(mode="copy", start=previous, keyframe=previous)
+    elif mode == "copy" and previous is not None:
+        plan.update(mode="copy", start=previous, keyframe=previous, snapped=True)
+    elif (info["video_codec"] in SMART_CUT_ENCODERS and following is not None
+          and following < end - tol):
+        plan.update(mode="smart", keyframe=following)
+    return plan
+
+
+def stream_copy_trim(path, out_path, start, end):
+    ffmpeg_tools.run_ffmpeg([
+        "-ss", f"{start:.6f}", "-i", path, "-t", f"{end - start:.6f}",
+        "-map", "0:v:0", "-map", "0:a:0?", "-c", "copy",
+        "-avoid_negative_ts", "make_zero", *_container_args(out_path), out_path])
+
+
+def _stream_param(info, key):
+    value = info.get(key)
+    return (value or "").lower() if key == "profile" else value
+
+
+def _mismatched(info, reference):
+    """The SMART_CUT_MATCH parameters on which ``info`` differs from ``reference``."""
+    return [k for k in SMART_CUT_MATCH if _stream_param(info, k) != _stream_param(reference, k)]
+
+
+def smart_cut_trim(path, out_path, start, end, keyframe, info, progress=None):
+    """Re-encode [start, keyframe), stream-copy [keyframe, end) and join them.
+
+    Only the start is cut frame-accurately. The end is not re-encoded: copying
+    stops at the last packet before ``end``, which with B-frames can drop the
+    final frame or two.
+
+    The head is encoded with the source's profile, level and pixel format, and
+    checked after encoding. If the source doesn't report them, or the head
+    comes out different, this raises RuntimeError and the caller re-encodes
+    the whole range instead.
+    """
+    if not info.get("level"):
+        info = {**info, **ffmpeg_tools.probe(path)}  # the media index doesn't record the level
+    encoder = SMART_CUT_ENCODERS[info["video_codec"]]
+    profile = X264_PROFILES.get((info.get("profile") or "").lower())
+    if not (profile and info.get("level") and info.get("pix_fmt")):
+        raise RuntimeError("Smart cut needs the source's H.264 profile, level and pixel format")
+
+    with tempfile.TemporaryDirectory(prefix="smartcut_", dir=scratch.current()) as tmp:
+        head = os.path.join(tmp, "head.ts")
+        tail = os.path.join(tmp, "tail.ts")
+        listing = os.path.join(tmp, "parts.txt")
+
+        # Match the source stream so the decoder sees one continuous bitstream
+        encode_args = ["-c:v", encoder, "-preset", "fast", "-crf", "16", "-profile:v", profile,
+                       "-level:v", f"{info['level'] / 10:g}", "-pix_fmt", info["pix_fmt"]]
+        if info.get("fps"): encode_args += ["-r", f"{info['fps']}"]
+
+        ffmpeg_tools.run_ffmpeg(["-ss", f"{start:.6f}", "-i", path, "-t", f"{keyframe - start:.6f}",
+                                 "-map", "0:v:0", "-an", *encode_args, "-f", "mpegts", head])
+        mismatched = _mismatched(ffmpeg_tools.probe(head), info)
+        if mismatched:
+            raise RuntimeError(f"Smart cut head doesn't match the source stream ({', '.join(mismatched)})")
+        if progress: progress(0.4)
+        ffmpeg_tools.run_ffmpeg(["-ss", f"{keyframe:.6f}", "-i", path, "-t", f"{end - keyframe:.6f}",
+                                 "-map", "0:v:0", "-an", "-c:v", "copy", "-avoid_negative_ts", "make_zero",
+                                 "-f", "mpegts", tail])
+        if progress: progress(0.7)
+
+        with open(listing, "w") as f:
+            for part in (head, tail):
+                escaped = os.path.abspath(part).replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        # Audio packets are all sync points, so the audio track can be copied over the whole range
+        audio_args = ["-c:a", "copy"] if info.get("audio_codec") == "aac" else ["-c:a", "aac", "-b:a", "192k"]
+        ffmpeg_tools.run_ffmpeg([
+            "-f", "concat", "-safe", "0", "-i", listing,
+            "-ss", f"{start:.6f}", "-t", f"{end - start:.6f}", "-i", path,
+            "-map", "0:v:0", "-map", "1:a:0?", "-c:v", "copy", *audio_args,
+            "-shortest", *_container_args(out_path), out_path])
+
+
+def trim(path, out_path, plan, info=None, progress=None):
+    """Execute a ``plan_trim`` plan. Only "copy" and "smart" plans are handled here."""
+    if plan["mode"] == "copy":
+        stream_copy_trim(path, out_path, plan["start"], plan["end"])
+    elif plan["mode"] == "smart":
+        smart_cut_trim(path, out_path, plan["start"], plan["end"], plan["keyframe"],
+                       info or ffmpeg_tools.probe(path), progress=progress)
+    else:
+        raise ValueError(f"Trim mode {plan['mode']} needs a full re-encode")
+    if progress: progress(1.0)
+    return plan["mode"]
+
+
+# ==========================================
+#           MERGE (CONCAT)
+# ==========================================
+
+CONCAT_AUDIO_CODECS = {"aac", "mp3", None}
+
+
+def stream_signature(info):
+    """Everything that must match for two files to be joined without re-encoding."""
+    return (info["video_codec"], (info.get("profile") or "").lower(), info["width"], info["height"],
+            round(info["fps"] or 0, 2), info.get("pix_fmt"),
+            info["audio_codec"], info.get("audio_sample_rate"), info.get("audio_channels"))
+
+
+def plan_merge(infos):
+    """Pick the target format for a merge and which inputs need normalizing.
+
+    The target is the most common H.264 signature among the inputs, so the
+    usual "ten clips from the same phone" case needs no re-encoding at all.
+    Returns ``{"mode": "copy" | "partial" | "reencode", "target": info,
+    "normalize": [index, ...]}``.
+    """
+    signatures = [stream_signature(i) for i in infos]
+    candidates = [s for s in signatures if s[0] in SMART_CUT_ENCODERS and s[6] in CONCAT_AUDIO_CODECS]
+    if candidates:
+        target_sig = max(candidates, key=candidates.count)
+        target = infos[signatures.index(target_sig)]
+        normalize = [i for i, s in enumerate(signatures) if s != target_sig]
+    else:
+        # Nothing copyable: normalize everything to H.264/AAC at the first clip's size
+        target = _reencode_target(infos)
+        normalize = list(range(len(infos)))
+
+    if not normalize:
+        mode = "copy"
+    elif len(normalize) == len(infos):
+        mode = "reencode"
+    else:
+        mode = "partial"
+    return {"mode": mode, "target": target, "normalize": normalize}
+
+
+def _reencode_target(infos):
+    first = infos[0]
+    return dict(first, video_codec="h264", profile="High", level=None, pix_fmt="yuv420p",
+                fps=first["fps"] or 30, audio_codec="aac",
+                audio_sample_rate=first.get("audio_sample_rate") or 44100,
+                audio_channels=first.get("audio_channels") or 2)
+
+
+def normalize_clip(path, out_path, info, target, out_format="mpegts"):
+    """Re-encode one clip so it matches ``target`` exactly (size, fps, codecs, audio layout).
+
+    The H.264 level is pinned too when ``target`` has one.
+    """
+    w, h, fps = target["width"], target["height"], target["fps"]
+    vf = (f"scale={w}:{h}:force_original_aspect_ratio=decrease,pad={w}:{h}:(ow-iw)/2:(oh-ih)/2,"
+          f"setsar=1,fps={fps},format={target.get('pix_fmt') or 'yuv420p'}")
+    args = ["-i", path]
+    audio_map = "0:a:0"
+    if target["audio_codec"] and not info["audio_codec"]:
+        # Silent track so the audio layout matches the other clips
+        layout = "mono" if target.get("audio_channels") == 1 else "stereo"
+        args += ["-f", "lavfi", "-t", f"{info['duration']:.6f}",
+                 "-i", f"anullsrc=r={target.get('audio_sample_rate') or 44100}:cl={layout}"]
+        audio_map = "1:a:0"
+
+    args += ["-map", "0:v:0", "-vf", vf, "-c:v", SMART_CUT_ENCODERS["h264"], "-preset", "fast", "-crf", "18"]
+    profile = X264_PROFILES.get((target.get("profile") or "").lower())
+    if profile: args += ["-profile:v", profile]
+    if target.get("level"): args += ["-level:v", f"{target['level'] / 10:g}"]
+    if target["audio_codec"]:
+        args += ["-map", audio_map, "-c:a", "aac" if target["audio_codec"] == "aac" else "libmp3lame",
+                 "-ar", str(target.get("audio_sample_rate") or 44100), "-ac", str(target.get("audio_channels") or 2)]
+    else:
+        args += ["-an"]
+    ffmpeg_tools.run_ffmpeg([*args, "-f", out_format, out_path])
+
+
+def _partial_target(paths, plan):
+    """The target with its level filled in, or None if a normalized clip can't be made to match it."""
+    target = plan["target"]
+    if not target.get("level"):
+        # The media index doesn't record the level; any clip that is copied as-is has the target's
+        copied = next(i for i in range(len(paths)) if i not in plan["normalize"])
+        target = {**target, **ffmpeg_tools.probe(paths[copied])}
+    if X264_PROFILES.get((target.get("profile") or "").lower()) and target.get("level") and target.get("pix_fmt"):
+        return target
+    return None
+
+
+def _mpegts_parts(paths, infos, plan, tmp, progress=None):
+    """Write every input to ``tmp`` as MPEG-TS, normalizing the ones the plan says to.
+
+    In a "partial" plan each normalized part is checked against the target,
+    since it gets joined to copied parts; RuntimeError if it doesn't match.
+    """
+    parts = []
+    for i, (path, info) in enumerate(zip(paths, infos)):
+        part = os.path.join(tmp, f"part{i:03d}.ts")
+        if i in plan["normalize"]:
+            normalize_clip(path, part, info, plan["target"])
+            if plan["mode"] == "partial":
+                mismatched = _mismatched(ffmpeg_tools.probe(part), plan["target"])
+                if mismatched:
+                    raise RuntimeError(f"Clip {i + 1} doesn't match the merge target ({', '.join(mismatched)})")
+        else:
+            ffmpeg_tools.run_ffmpeg(["-i", path, "-map", "0:v:0", "-map", "0:a:0?", "-c", "copy",
+                                     "-f", "mpegts", part])
+        parts.append(part)
+        if progress: progress(0.9 * (i + 1) / len(paths))
+    return parts
+
+
+def concat(paths, out_path, infos=None, progress=None):
+    """Join ``paths`` with the concat demuxer, normalizing only the clips that differ.
+
+    In a partial merge the normalized clips are encoded with the target's
+    profile, level and pixel format and checked afterwards. If the target
+    doesn't report them, or a clip comes out different, every clip is
+    re-encoded instead.
+
+    Returns the merge plan (its ``mode`` says how much had to be re-encoded).
+    """
+    infos = infos or [ffmpeg_tools.probe(p) for p in paths]
+    plan = plan_merge(infos)
+    if plan["mode"] == "partial":
+        target = _partial_target(paths, plan)
+        if target: plan["target"] = target
+        else: plan.update(mode="reencode", target=_reencode_target(infos), normalize=list(range(len(infos))))
+
+    with tempfile.TemporaryDirectory(prefix="concat_", dir=scratch.current()) as tmp:
+        listing = os.path.join(tmp, "parts.txt")
+        if plan["mode"] == "copy":
+            parts = paths
+        else:
+            # Mixed encoders: go through MPEG-TS so every part carries its own SPS/PPS in-band
+            try:
+                parts = _mpegts_parts(paths, infos, plan, tmp, progress)
+            except RuntimeError as e:
+                if plan["mode"] != "partial":
+                    raise
+                print(f"⚠️ Partial merge not possible, re-encoding every clip: {e}")
+                plan.update(mode="reencode", target=_reencode_target(infos), normalize=list(range(len(infos))))
+                parts = _mpegts_parts(paths, infos, plan, tmp, progress)
+
+        with open(listing, "w") as f:
+            for part in parts:
+                escaped = os.path.abspath(part).replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        audio_args = ["-bsf:a", "aac_adtstoasc"] if plan["mode"] != "copy" and plan["target"]["audio_codec"] == "aac" else []
+        ffmpeg_tools.run_ffmpeg(["-f", "concat", "-safe", "0", "-i", listing, "-map", "0:v:0", "-map", "0:a:0?",
+                                 "-c", "copy", *audio_args, *_container_args(out_path), out_path])
+    if progress: progress(1.0)
+    return plan
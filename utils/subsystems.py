@@ -0,0 +1,84 @@
+# utils/subsystems.py
+"""
+Lazily built subsystems, for a fast cold start.
+
+A ``Subsystem`` stands in for a module-level object, such as the AI client
+or the video engine module. It imports and builds the real object the first
+time one of its attributes is used, so ``ai.generate(...)`` works
+unchanged, and a login page hit never pays for MoviePy, PIL or the HTTP
+client stack.
+
+Long-lived workers can load everything up front instead with ``preload``.
+
+Every load is timed. ``report()`` lists each subsystem's load time next to
+the app's own import time, and each load also goes to the
+``subsystem_load_seconds`` histogram (utils/metrics.py).
+"""
+import threading
+import time
+
+from utils import metrics
+
+_registry = {}
+_startup = {"seconds": None}
+
+
+class Subsystem:
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+        self.seconds = None
+        self._obj = None
+        self._loaded = False
+        self._lock = threading.Lock()
+        _registry[name] = self
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def get(self):
+        """The real object, built on the first call."""
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    started = time.perf_counter()
+                    self._obj = self.factory()
+                    self.seconds = time.perf_counter() - started
+                    self._loaded = True
+                    metrics.observe("subsystem_load_seconds", self.seconds, subsystem=self.name)
+        return self._obj
+
+    def __getattr__(self, attr):
+        # Only reached for attributes the proxy itself doesn't have
+        return getattr(self.get(), attr)
+
+    def __repr__(self):
+        return f"<Subsystem {self.name} ({'loaded' if self._loaded else 'not loaded'})>"
+
+
+def preload(names="all"):
+    """Load the named subsystems (or all) now. Returns {name: seconds}."""
+    wanted = list(_registry) if names == "all" else [n for n in names if n in _registry]
+    for name in wanted:
+        try:
+            _registry[name].get()
+        except Exception as e:
+            print(f"⚠️ Could not preload {name}: {e}")
+    return {name: _registry[name].seconds for name in wanted}
+
+
+def mark_ready(started):
+    """Record that the app finished importing (it started at perf_counter() ``started``); returns the seconds taken."""
+    _startup["seconds"] = time.perf_counter() - started
+    metrics.observe("app_import_seconds", _startup["seconds"])
+    return _startup["seconds"]
+
+
+def report():
+    seconds = _startup["seconds"]
+    return {
+        "app_import_seconds": round(seconds, 4) if seconds is not None else None,
+        "subsystems": {name: {"loaded": s.loaded, "load_seconds": round(s.seconds, 4) if s.seconds is not None else None}
+                       for name, s in _registry.items()},
+    }
@@ -0,0 +1,233 @@
+# utils/text_render.py
+"""
+Caption rendering with Pillow/FreeType, for MoviePy renders and EDL overlays.
+
+This replaces MoviePy's ``TextClip``, which shelled out to ImageMagick for
+every caption, and ``CompositeVideoClip``, which blended a full-frame layer
+into every frame.
+
+* Fonts are loaded once per size (``font``). Words are rasterized once per
+  size and stroke width (``_word``), and each caption is assembled from those
+  cached masks, so a caption-heavy render draws each distinct word once.
+* A finished caption (``render``) is cached as well. It holds premultiplied
+  color and alpha arrays cropped to the text's bounding box, with the stroke,
+  drop shadow and background box already flattened in.
+* ``Captioner`` draws a list of timed captions through ``clip.fl``. Frames
+  without an active caption pass through untouched, and an active caption
+  blends only the pixels under its bounding box.
+
+Captions are dicts in the EDL overlay shape (see ``edl.validate_caption``):
+``text``, ``start``, ``end``, ``position``, ``fontsize``, ``color``,
+``shadow`` and ``box``. Only ``text`` is required here.
+"""
+import math
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+FONT_CANDIDATES = ("DejaVuSans-Bold.ttf", "Arial Bold.ttf", "arialbd.ttf")
+POSITIONS = ("top", "center", "bottom")
+MARGIN = 0.05          # top/bottom captions sit this fraction of the frame height from the edge
+LINE_SPACING = 0.15    # extra gap between wrapped lines, as a fraction of the font size
+BOX_OPACITY = 0.6      # background box alpha, unless its color has one
+SHADOW_OPACITY = 0.6
+
+
+@lru_cache(maxsize=32)
+def font(size, fonts=FONT_CANDIDATES):
+    """The first of ``fonts`` installed, at ``size``; Pillow's built-in font if none is."""
+    for name in fonts:
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    return ImageFont.load_default(size=size)
+
+
+def _frozen(array):
+    array.flags.writeable = False
+    return array
+
+
+@lru_cache(maxsize=2048)
+def _word(word, size, stroke, fonts):
+    """Fill and stroke masks of ``word`` plus their offset from the pen position on the baseline."""
+    f = font(size, fonts)
+    left, top, right, bottom = f.getbbox(word, stroke_width=stroke, anchor="ls")
+    shape = (max(right - left, 1), max(bottom - top, 1))
+    fill, outline = Image.new("L", shape), Image.new("L", shape)
+    ImageDraw.Draw(fill).text((-left, -top), word, font=f, fill=255, anchor="ls")
+    ImageDraw.Draw(outline).text((-left, -top), word, font=f, fill=255, anchor="ls",
+                                 stroke_width=stroke, stroke_fill=255)
+    return _frozen(np.array(fill)), _frozen(np.array(outline)), left, top
+
+
+def _stamp(canvas, mask, x, y):
+    # Max, not paste: neighbouring words' strokes may overlap
+    h, w = mask.shape
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + w, canvas.shape[1]), min(y + h, canvas.shape[0])
+    if x0 < x1 and y0 < y1:
+        target = canvas[y0:y1, x0:x1]
+        np.maximum(target, mask[y0 - y:y1 - y, x0 - x:x1 - x], out=target)
+
+
+def _wrap(text, f, max_width, stroke):
+    """Greedy word wrap: a list of lines, each a list of words."""
+    space = f.getlength(" ")
+    lines = []
+    for paragraph in text.splitlines() or [""]:
+        line, width = [], 0.0
+        for word in paragraph.split():
+            advance = f.getlength(word)
+            if line and max_width and width + space + advance + 2 * stroke > max_width:
+                lines.append(line)
+                line, width = [], 0.0
+            width += (space if line else 0) + advance
+            line.append(word)
+        lines.append(line)
+    return lines
+
+
+def _rgba(color, opacity=1.0):
+    rgba = ImageColor.getrgb(color)
+    alpha = rgba[3] / 255 if len(rgba) == 4 else opacity
+    return np.array(rgba[:3], dtype=np.float32), alpha
+
+
+class Caption:
+    """A rasterized caption: premultiplied color (0-255) and alpha (0-1), cropped to its bounding box."""
+
+    def __init__(self, rgb, alpha):
+        self.rgb = _frozen(rgb)
+        self.alpha = _frozen(alpha)
+        self.inverse = _frozen(1.0 - alpha)
+        self.height, self.width = alpha.shape[:2]
+
+    def blend(self, frame, x, y):
+        """Draw onto ``frame`` (an HxWx3 uint8 array, changed in place) with the top-left corner at (x, y)."""
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + self.width, frame.shape[1]), min(y + self.height, frame.shape[0])
+        if x0 >= x1 or y0 >= y1:
+            return frame
+        rows, cols = slice(y0 - y, y1 - y), slice(x0 - x, x1 - x)
+        region = frame[y0:y1, x0:x1]
+        region[:] = region * self.inverse[rows, cols] + self.rgb[rows, cols] + 0.5
+        return frame
+
+    def image(self):
+        """The caption as a straight-alpha RGBA image, e.g. for ffmpeg's overlay filter."""
+        rgb = self.rgb / np.maximum(self.alpha, 1e-6)
+        rgba = np.dstack([rgb, self.alpha * 255]).round().clip(0, 255).astype(np.uint8)
+        return Image.fromarray(rgba, "RGBA")
+
+
+def _stroke(fontsize, stroke_width):
+    return max(int(round(fontsize / 25)), 1) if stroke_width is None else stroke_width
+
+
+def _layout(text, fontsize, stroke, max_width, fonts):
+    f = font(fontsize, fonts)
+    ascent, descent = f.getmetrics()
+    line_height = ascent + descent + int(fontsize * LINE_SPACING)
+    margin = stroke + 2  # room for glyphs that overhang their advance
+    lines = _wrap(text, f, max_width, stroke)
+    space = f.getlength(" ")
+    widths = [sum(f.getlength(w) for w in words) + space * max(len(words) - 1, 0) for words in lines]
+    text_w = int(math.ceil(max(widths))) + 2 * margin
+    text_h = line_height * (len(lines) - 1) + ascent + descent + 2 * margin
+    return f, lines, widths, line_height, margin, text_w, text_h
+
+
+def measure(text, fontsize=50, stroke_width=None, max_width=None, fonts=FONT_CANDIDATES):
+    """(width, height) ``render`` would give the bare text, without rasterizing anything."""
+    *_, text_w, text_h = _layout(text, fontsize, _stroke(fontsize, stroke_width), max_width, fonts)
+    return text_w, text_h
+
+
+@lru_cache(maxsize=16)
+def render(text, fontsize=50, color="white", stroke_color="black", stroke_width=None,
+           shadow=False, box=None, max_width=None, fonts=FONT_CANDIDATES):
+    """Rasterize ``text``, centered and wrapped to ``max_width`` pixels. Cached; treat the result as read-only."""
+    stroke = _stroke(fontsize, stroke_width)
+    f, lines, widths, line_height, margin, text_w, text_h = _layout(text, fontsize, stroke, max_width, fonts)
+    ascent, space = f.getmetrics()[0], f.getlength(" ")
+    offset = max(int(round(fontsize * 0.06)), 1) if shadow else 0
+    pad = int(round(fontsize * 0.3)) if box else 0
+    height, width = text_h + 2 * pad + offset, text_w + 2 * pad + offset
+
+    fill = np.zeros((height, width), dtype=np.uint8)
+    outline = np.zeros((height, width), dtype=np.uint8)
+    for i, words in enumerate(lines):
+        x = pad + margin + (text_w - 2 * margin - widths[i]) / 2
+        baseline = pad + margin + ascent + i * line_height
+        for word in words:
+            word_fill, word_outline, left, top = _word(word, fontsize, stroke, fonts)
+            _stamp(fill, word_fill, int(round(x)) + left, baseline + top)
+            _stamp(outline, word_outline, int(round(x)) + left, baseline + top)
+            x += f.getlength(word) + space
+
+    # Flatten the layers bottom to top with the "over" operator
+    rgb = np.zeros((height, width, 3), dtype=np.float32)
+    alpha = np.zeros((height, width, 1), dtype=np.float32)
+
+    def over(mask, color, opacity=1.0):
+        paint, a = _rgba(color, opacity)
+        coverage = mask[..., None] * np.float32(a)
+        rgb[:] = paint * coverage + rgb * (1 - coverage)
+        alpha[:] = coverage + alpha * (1 - coverage)
+
+    if box:
+        panel = np.zeros((height, width), dtype=np.float32)
+        panel[:height - offset, :width - offset] = 1
+        over(panel, box, BOX_OPACITY)
+    if shadow:
+        shade = np.zeros((height, width), dtype=np.float32)
+        shade[offset:, offset:] = outline[:height - offset, :width - offset] / 255
+        over(shade, "black", SHADOW_OPACITY)
+    if stroke:
+        over(outline / np.float32(255), stroke_color)
+    over(fill / np.float32(255), color)
+    return Caption(rgb, alpha)
+
+
+def render_caption(caption, max_width, scale=1.0):
+    """``render`` for a caption dict, with its font size scaled by ``scale`` (e.g. for proxies)."""
+    return render(caption["text"], fontsize=max(int(round(caption.get("fontsize", 50) * scale)), 8),
+                  color=caption.get("color", "white"), shadow=bool(caption.get("shadow")),
+                  box=caption.get("box") or None, max_width=int(max_width))
+
+
+def place(caption, frame_w, frame_h, position="bottom", margin=MARGIN):
+    """Top-left corner of ``caption`` centered horizontally at ``position`` in the frame."""
+    x = (frame_w - caption.width) // 2
+    if position == "top":
+        return x, int(frame_h * margin)
+    if position == "center":
+        return x, (frame_h - caption.height) // 2
+    return x, frame_h - caption.height - int(frame_h * margin)
+
+
+class Captioner:
+    """A ``clip.fl`` filter that draws timed captions onto a clip of ``size`` (w, h)."""
+
+    def __init__(self, captions, size, scale=1.0):
+        w, h = size
+        self.segments = []
+        for c in captions:
+            caption = render_caption(c, w * 0.9, scale)
+            x, y = place(caption, w, h, c.get("position", "bottom"))
+            end = c.get("end")
+            self.segments.append((c.get("start", 0), math.inf if end is None else end, caption, x, y))
+        self.segments.sort(key=lambda s: s[0])
+
+    def __call__(self, get_frame, t):
+        frame = get_frame(t)
+        active = [s for s in self.segments if s[0] <= t < s[1]]
+        if not active:
+            return frame
+        frame = np.array(frame)  # the reader may hand out a shared buffer
+        for _, _, caption, x, y in active:
+            caption.blend(frame, x, y)
+        return frame
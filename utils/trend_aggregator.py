@@ -0,0 +1,295 @@
+# utils/trend_aggregator.py
+"""
+Trend aggregation across several sources at once.
+
+Every source (Google Trends and Google News via SerpAPI, YouTube via
+SerpAPI, Reddit's public listings, the AI trend generator) is queried in
+parallel on a shared thread pool. ``collect`` waits only until the slowest
+source's own timeout, and a source that misses it is reported as ``timeout``
+with the results of the others returned (``partial``). The late answer is
+still cached when it arrives, so the next request gets it.
+
+Each source's results are cached per region for the source's ``ttl``,
+independently of the other sources. An expired entry is refreshed, but it is
+still used if the refresh fails or runs late.
+
+Results are merged by normalized title and ranked with reciprocal rank
+fusion: a trend scores ``weight / (RRF_K + rank)`` in every source that has
+it. Trends that several sources agree on therefore rise to the top.
+
+Sources are plain objects with ``name``, ``timeout``, ``ttl``, ``weight``,
+``configured`` and ``fetch(region)``. The HTTP ones take a ``base_url`` so
+they can be pointed at a local stub server.
+"""
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils import metrics
+
+RRF_K = 3
+DEFAULT_SOURCES = "google_trends,google_news,youtube,reddit,ai"
+
+GEO_CODES = {"india": "IN", "usa": "US", "us": "US", "united states": "US", "uk": "GB",
+             "united kingdom": "GB", "australia": "AU", "canada": "CA"}
+
+
+def geo_code(region):
+    region = (region or "").strip().lower()
+    return next((code for name, code in GEO_CODES.items() if name == region or region.endswith(f", {name}")), "US")
+
+
+def _session():
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_maxsize=8, max_retries=0))
+    session.mount("http://", HTTPAdapter(pool_maxsize=8, max_retries=0))
+    return session
+
+
+# ==========================================
+#           SOURCES
+# ==========================================
+
+class TrendSource:
+    name = "source"
+
+    def __init__(self, timeout=4.0, ttl=900, weight=1.0):
+        self.timeout = timeout
+        self.ttl = ttl
+        self.weight = weight
+
+    @property
+    def configured(self):
+        return True
+
+    def fetch(self, region):
+        """Trend titles for ``region``, best first."""
+        raise NotImplementedError
+
+
+class SerpApiSource(TrendSource):
+    engine = None
+
+    def __init__(self, api_key, base_url="https://serpapi.com", **kwargs):
+        super().__init__(**kwargs)
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.session = _session()
+
+    @property
+    def configured(self):
+        return bool(self.api_key)
+
+    def _search(self, **params):
+        r = self.session.get(f"{self.base_url}/search.json",
+                             params={"engine": self.engine, "api_key": self.api_key, **params}, timeout=self.timeout)
+        r.raise_for_status()
+        data = r.json()
+        if data.get("error"):
+            raise RuntimeError(data["error"])
+        return data
+
+
+class GoogleTrendsSource(SerpApiSource):
+    name = "google_trends"
+    engine = "google_trends_trending_now"
+
+    def fetch(self, region):
+        data = self._search(geo=geo_code(region))
+        return [t["query"] for t in data.get("trending_searches", []) if t.get("query")]
+
+
+class GoogleNewsSource(SerpApiSource):
+    name = "google_news"
+    engine = "google_news"
+
+    def fetch(self, region):
+        data = self._search(q="trending topics", gl=geo_code(region).lower())
+        return [n["title"] for n in data.get("news_results", []) if n.get("title")]
+
+
+class YouTubeSource(SerpApiSource):
+    name = "youtube"
+    engine = "youtube"
+
+    def __init__(self, api_key, keyword="viral memes", **kwargs):
+        super().__init__(api_key, **kwargs)
+        self.keyword = keyword
+
+    def fetch(self, region):
+        data = self._search(search_query=self.keyword, gl=geo_code(region).lower())
+        return [v["title"] for v in data.get("video_results", []) if v.get("title")]
+
+
+class RedditSource(TrendSource):
+    """Hot posts from public subreddit listings; no credentials needed."""
+    name = "reddit"
+
+    def __init__(self, subreddits=("popular",), base_url="https://www.reddit.com",
+                 user_agent="HypeItUpBot/0.1", limit=15, **kwargs):
+        super().__init__(**kwargs)
+        self.subreddits = subreddits
+        self.base_url = base_url.rstrip("/")
+        self.limit = limit
+        self.session = _session()
+        self.session.headers["User-Agent"] = user_agent
+
+    def fetch(self, region):
+        r = self.session.get(f"{self.base_url}/r/{'+'.join(self.subreddits)}/hot.json",
+                             params={"limit": self.limit, "geo_filter": geo_code(region)}, timeout=self.timeout)
+        r.raise_for_status()
+        posts = r.json().get("data", {}).get("children", [])
+        return [p["data"]["title"] for p in posts if not p["data"].get("stickied") and p["data"].get("title")]
+
+
+class FunctionSource(TrendSource):
+    """Wrap any ``fn(region) -> list`` (e.g. the cached AI trend generator) as a source."""
+
+    def __init__(self, name, fn, configured=True, **kwargs):
+        super().__init__(**kwargs)
+        self.name = name
+        self.fn = fn
+        self._configured = configured
+
+    @property
+    def configured(self):
+        return self._configured
+
+    def fetch(self, region):
+        return list(self.fn(region))
+
+
+# ==========================================
+#           AGGREGATOR
+# ==========================================
+
+def normalize_title(title):
+    return " ".join(re.sub(r"[^\w#]+", " ", title.lower()).split())
+
+
+class TrendAggregator:
+    def __init__(self, sources, max_workers=8):
+        self.sources = [s for s in sources if s.configured]
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="trend-source")
+        self._cache = {}     # (source name, region key) -> (titles, fetched_at)
+        self._inflight = {}  # same key -> Future, so concurrent requests share one call per source
+        self._lock = threading.Lock()
+
+    def add(self, source):
+        if source.configured:
+            self.sources.append(source)
+
+    def _fetch(self, source, key, region):
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is None:
+                future = self._inflight[key] = self._pool.submit(self._run, source, key, region)
+        return future
+
+    def _run(self, source, key, region):
+        started = time.monotonic()
+        try:
+            with metrics.timed("external_call_duration_seconds", service=f"trends_{source.name}", outcome="ok"):
+                titles = source.fetch(region)
+            with self._lock:
+                self._cache[key] = (titles, time.time())
+            return titles, time.monotonic() - started
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def collect(self, region, limit=10, only=None):
+        """Merged trends for ``region`` plus a per-source status report."""
+        region_key = " ".join(region.split()).lower()
+        sources = [s for s in self.sources if only is None or s.name in only]
+        report, results, pending = {}, {}, {}
+
+        for source in sources:
+            key = (source.name, region_key)
+            cached = self._cache.get(key)
+            if cached and time.time() - cached[1] < source.ttl:
+                results[source.name] = cached[0]
+                report[source.name] = {"status": "cached", "count": len(cached[0])}
+            else:
+                pending[self._fetch(source, key, region)] = (source, cached)
+
+        if pending:
+            started = time.monotonic()
+            timeout = max(source.timeout for source, _ in pending.values())
+            wait(pending, timeout=timeout)
+            for future, (source, cached) in pending.items():
+                elapsed = round(time.monotonic() - started, 3)
+                if future.done() and future.exception() is None:
+                    titles, latency = future.result()
+                    results[source.name] = titles
+                    report[source.name] = {"status": "ok", "count": len(titles), "latency": round(latency, 3)}
+                    continue
+                status = "timeout" if not future.done() else "error"
+                report[source.name] = {"status": status, "latency": elapsed}
+                if status == "error":
+                    report[source.name]["error"] = str(future.exception())
+                if cached:  # an expired answer beats none
+                    results[source.name] = cached[0]
+                    report[source.name].update(stale=True, count=len(cached[0]))
+
+        return {"trends": self.merge(results, limit),
+                "sources": report,
+                "partial": any(r["status"] in ("timeout", "error") for r in report.values())}
+
+    def merge(self, results, limit=10):
+        weights = {s.name: s.weight for s in self.sources}
+        merged = {}
+        for name, titles in results.items():
+            for rank, title in enumerate(titles):
+                key = normalize_title(title)
+                if not key:
+                    continue
+                entry = merged.setdefault(key, {"title": title.strip(), "score": 0.0, "sources": []})
+                if name in entry["sources"]:
+                    continue  # a source repeating itself doesn't count twice
+                entry["score"] += weights.get(name, 1.0) / (RRF_K + rank)
+                entry["sources"].append(name)
+        ranked = sorted(merged.values(), key=lambda e: -e["score"])[:limit]
+        for entry in ranked:
+            entry["score"] = round(entry["score"], 4)
+        return ranked
+
+
+def enabled_sources():
+    return set(os.getenv("TREND_SOURCES", DEFAULT_SOURCES).split(","))
+
+
+def default_sources():
+    """Sources configured from the environment; TREND_SOURCES picks which ones run."""
+    serp_key = os.getenv("SERPAPI_KEY")
+    serp_url = os.getenv("SERPAPI_BASE_URL", "https://serpapi.com")
+    timeout = float(os.getenv("TREND_SOURCE_TIMEOUT", 4))
+    enabled = enabled_sources()
+    sources = [
+        GoogleTrendsSource(serp_key, base_url=serp_url, timeout=timeout, ttl=900, weight=1.5),
+        GoogleNewsSource(serp_key, base_url=serp_url, timeout=timeout, ttl=900),
+        YouTubeSource(serp_key, base_url=serp_url, timeout=timeout, ttl=1800),
+        RedditSource(subreddits=tuple(os.getenv("REDDIT_SUBREDDITS", "popular").split(",")),
+                     base_url=os.getenv("REDDIT_BASE_URL", "https://www.reddit.com"),
+                     user_agent=os.getenv("REDDIT_USER_AGENT", "HypeItUpBot/0.1"),
+                     timeout=timeout, ttl=600, weight=0.8),
+    ]
+    return [s for s in sources if s.name in enabled]
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_aggregator():
+    """The process-wide aggregator (one thread pool, one per-source cache)."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = TrendAggregator(default_sources())
+        return _default
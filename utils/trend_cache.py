@@ -0,0 +1,215 @@
+# utils/trend_cache.py
+"""
+Cache for AI-generated trend lists, keyed by (model, region).
+
+Within ``ttl`` an entry is served as is. For ``stale_ttl`` after that it is
+still served, while one background refresh revalidates it
+(stale-while-revalidate). Only a region that was never fetched, or has been
+stale for too long, makes the request wait on the model.
+
+Concurrent misses for the same key are coalesced. Inside a process, the
+first caller fetches and the rest wait on its result. Across processes, a
+lease on the SQLite row makes other workers poll for the leader's answer
+instead of calling the model again. Failed fetches are never cached.
+
+Every lookup counts towards the region's popularity, and ``warm`` (run by
+the app's scheduler) keeps the most requested regions fresh so their pages
+never wait.
+"""
+import json
+import threading
+import time
+
+from utils import db
+
+LEASE_SECONDS = 60
+POLL_INTERVAL = 0.25
+
+
+def _connect(db_path):
+    return db.connect(db_path)
+
+
+def init_trend_table(db_path):
+    with _connect(db_path) as conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS trend_cache (
+                            key TEXT PRIMARY KEY,
+                            region TEXT NOT NULL,
+                            model TEXT NOT NULL,
+                            trends TEXT,
+                            fetched_at REAL,
+                            lease_until REAL,
+                            requests INTEGER NOT NULL DEFAULT 0,
+                            last_requested REAL)''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_trend_cache_popular ON trend_cache (requests DESC)")
+        conn.commit()
+
+
+class TrendCache:
+    def __init__(self, db_path, fetch, model, ttl=3600, stale_ttl=24 * 3600, wait=30):
+        """``fetch(region, model)`` returns a list of trends and raises on failure."""
+        self.db_path = db_path
+        self.fetch = fetch
+        self.model = model
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.wait = wait
+        self._ready = False
+        self._memory = {}      # key -> (trends, fetched_at)
+        self._inflight = {}    # key -> threading.Event of the caller fetching it
+        self._lock = threading.Lock()
+
+    def _conn(self):
+        if not self._ready:
+            init_trend_table(self.db_path)
+            self._ready = True
+        return _connect(self.db_path)
+
+    @staticmethod
+    def key(region, model):
+        return f"{model}:{' '.join(region.split()).lower()}"
+
+    # ==========================================
+    #           LOOKUP
+    # ==========================================
+
+    def get(self, region, model=None, count=True):
+        """Trends for ``region``; raises if there is nothing cached and the fetch fails."""
+        model = model or self.model
+        key = self.key(region, model)
+        if count:
+            with self._conn() as conn:
+                conn.execute('''INSERT INTO trend_cache (key, region, model, requests, last_requested)
+                                VALUES (?, ?, ?, 1, ?)
+                                ON CONFLICT(key) DO UPDATE SET requests = requests + 1,
+                                                               last_requested = excluded.last_requested''',
+                             (key, region.strip(), model, time.time()))
+
+        trends, fetched_at = self._cached(key)
+        age = time.time() - fetched_at if trends is not None else None
+        if age is not None and age < self.ttl:
+            return trends
+        if age is not None and age < self.ttl + self.stale_ttl:
+            self._refresh_async(key, region, model)
+            return trends
+        try:
+            return self._refresh(key, region, model)
+        except Exception:
+            if trends is not None:
+                return trends  # too old to serve normally, but better than an error page
+            raise
+
+    def _cached(self, key):
+        hit = self._memory.get(key)
+        if hit and time.time() - hit[1] < self.ttl:
+            return hit
+        # Another worker may have refreshed it since
+        row = self._conn().execute("SELECT trends, fetched_at FROM trend_cache WHERE key = ?", (key,)).fetchone()
+        if row and row["trends"] is not None:
+            hit = (json.loads(row["trends"]), row["fetched_at"])
+            self._memory[key] = hit
+        return hit or (None, 0.0)
+
+    # ==========================================
+    #           REFRESH (COALESCED)
+    # ==========================================
+
+    def _refresh_async(self, key, region, model):
+        with self._lock:
+            if key in self._inflight:
+                return
+        threading.Thread(target=self._refresh_quietly, args=(key, region, model),
+                         name="trend-refresh", daemon=True).start()
+
+    def _refresh_quietly(self, key, region, model):
+        try:
+            self._refresh(key, region, model)
+        except Exception as e:
+            print(f"⚠️ Trend refresh failed for {region}: {e}")
+
+    def _refresh(self, key, region, model):
+        with self._lock:
+            event = self._inflight.get(key)
+            leader = event is None
+            if leader:
+                event = self._inflight[key] = threading.Event()
+        if not leader:
+            event.wait(self.wait)
+            trends, _ = self._memory.get(key, (None, 0.0))
+            if trends is None:
+                raise RuntimeError("Trend refresh failed")
+            return trends
+
+        try:
+            before = self._memory.get(key, (None, 0.0))[1]
+            if self._take_lease(key, region, model):
+                trends = None
+                try:
+                    trends = self.fetch(region, model)
+                finally:
+                    self._store(key, trends)  # also releases the lease if fetch raised
+                return trends
+            return self._await_other_worker(key, before)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    def _take_lease(self, key, region, model):
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute("INSERT OR IGNORE INTO trend_cache (key, region, model) VALUES (?, ?, ?)",
+                         (key, region.strip(), model))
+            cur = conn.execute('''UPDATE trend_cache SET lease_until = ?
+                                  WHERE key = ? AND (lease_until IS NULL OR lease_until < ?)''',
+                               (now + LEASE_SECONDS, key, now))
+        return cur.rowcount == 1
+
+    def _store(self, key, trends):
+        with self._conn() as conn:
+            if trends is None:
+                conn.execute("UPDATE trend_cache SET lease_until = NULL WHERE key = ?", (key,))
+                return
+            now = time.time()
+            conn.execute("UPDATE trend_cache SET trends = ?, fetched_at = ?, lease_until = NULL WHERE key = ?",
+                         (json.dumps(trends), now, key))
+        self._memory[key] = (trends, now)
+
+    def _await_other_worker(self, key, before):
+        deadline = time.time() + self.wait
+        while time.time() < deadline:
+            time.sleep(POLL_INTERVAL)
+            row = self._conn().execute("SELECT trends, fetched_at, lease_until FROM trend_cache WHERE key = ?",
+                                       (key,)).fetchone()
+            if row["trends"] is not None and row["fetched_at"] > before:
+                trends = json.loads(row["trends"])
+                self._memory[key] = (trends, row["fetched_at"])
+                return trends
+            if row["lease_until"] is None:
+                break  # the other worker gave up
+        raise RuntimeError("Trend refresh failed")
+
+    # ==========================================
+    #           WARMER
+    # ==========================================
+
+    def popular(self, limit=10, within=7 * 24 * 3600):
+        """The most requested (region, model) pairs of the last ``within`` seconds."""
+        rows = self._conn().execute('''SELECT region, model FROM trend_cache WHERE last_requested > ?
+                                       ORDER BY requests DESC LIMIT ?''', (time.time() - within, limit)).fetchall()
+        return [(r["region"], r["model"]) for r in rows]
+
+    def warm(self, limit=10):
+        """Refresh the most requested regions that are (nearly) due. Returns how many were fetched."""
+        refreshed = 0
+        for region, model in self.popular(limit):
+            key = self.key(region, model)
+            trends, fetched_at = self._cached(key)
+            if trends is not None and time.time() - fetched_at < self.ttl * 0.8:
+                continue
+            try:
+                self._refresh(key, region, model)
+                refreshed += 1
+            except Exception as e:
+                print(f"⚠️ Trend warm-up failed for {region}: {e}")
+        return refreshed
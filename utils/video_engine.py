@@ -0,0 +1,506 @@
+# utils/video_engine.py
+"""
+MoviePy render functions used by the job workers.
+
+Every action takes a plain ``params`` dict (built from the editor form by
+``params_from_form``) plus the uploads folder, and returns a result dict with
+the ``output`` filename. Nothing here touches Flask's request/session, so the
+functions can run inside a worker process.
+
+With ``params["preview"]`` set, an action reads the low-resolution proxy
+instead of the original and writes to the previews folder (utils/proxies.py).
+Export always renders from the original.
+
+Each render's stages (open, audio, encode, mux) and its total are timed
+into the ``render_stage_duration_seconds`` histogram (utils/metrics.py).
+
+MoviePy renders long enough to be worth it are encoded segment-parallel
+(utils/segment_render.py): each action describes its clip with a
+module-level builder, so worker processes can rebuild the clip and each
+encode a slice of it.
+
+Temp files (MoviePy's audio track, concat lists, segments) go to the job's
+scratch directory (utils/scratch.py), never the working directory.
+"""
+import json
+import os
+import subprocess
+import time
+import uuid
+
+from utils import edl, ffmpeg_tools, metrics, proxies, scratch, segment_render, stream_ops, text_render
+from utils.files import generate_unique_filename, safe_float
+
+# 🔹 Progress reporting
+def _make_logger(progress):
+    """Wrap a ``progress(fraction)`` callback as a proglog logger for write_videofile.
+
+    The logger also notes when each bar first moves (``started``), which splits
+    write_videofile into its audio and video/mux passes for the stage timings.
+    """
+    from proglog import ProgressBarLogger
+
+    class _JobProgressLogger(ProgressBarLogger):
+        def __init__(self):
+            super().__init__()
+            self.started = {}
+
+        def bars_callback(self, bar, attr, value, old_value=None):
+            self.started.setdefault(bar, time.perf_counter())
+            # 't' is the video frame bar; 'chunk' (audio) finishes almost instantly
+            if progress is None or bar != "t" or attr != "index":
+                return
+            total = self.bars[bar].get("total") or 0
+            if total:
+                progress(min(value / total, 1.0))
+
+    return _JobProgressLogger()
+
+
+def _stage(action, stage):
+    return metrics.timed("render_stage_duration_seconds", action=action, stage=stage)
+
+
+def _write_video(clip, output_path, action, progress=None, **kwargs):
+    """``clip.write_videofile`` timed as "audio" (the temp audio track) and "encode" (frames, muxed with it)."""
+    logger = _make_logger(progress)
+    if clip.audio is not None:
+        # MoviePy's default temp audio name is derived from the output name; keep it in the job's scratch
+        kwargs.setdefault("temp_audiofile", scratch.path("audio.m4a"))
+    started = time.perf_counter()
+    clip.write_videofile(output_path, logger=logger, **kwargs)
+    video_started = logger.started.get("t", started)
+    if "chunk" in logger.started:
+        metrics.observe("render_stage_duration_seconds", video_started - logger.started["chunk"], action=action, stage="audio")
+    metrics.observe("render_stage_duration_seconds", time.perf_counter() - video_started, action=action, stage="encode")
+
+
+def _encode(action, build, args, output_path, progress=None, **kwargs):
+    """Build the clip with ``build(*args)`` and encode it; returns its duration.
+
+    Long renders are split into segments encoded by parallel workers
+    (utils/segment_render.py), which rebuild the clip from the same ``build``
+    and ``args``. Short ones go through ``write_videofile`` as before.
+    """
+    with _stage(action, "open"):
+        clip, sources = build(*args)
+    try:
+        segments = segment_render.plan(clip.duration, clip.fps, output_path)
+        if segments:
+            segment_render.render(build, args, clip, output_path, segments, action, progress=progress,
+                                  preset=kwargs.get("preset", "medium"))
+        else:
+            _write_video(clip, output_path, action, progress, codec="libx264", audio_codec="aac", **kwargs)
+        return clip.duration
+    finally:
+        for source in sources:
+            source.close()
+
+
+# 🔹 Clip builders: (clip to encode, clips to close). Module-level, so segment workers can rebuild the clip.
+def _trim_clip(path, start, end):
+    from moviepy.editor import VideoFileClip
+    clip = VideoFileClip(path)
+    if not end or end > clip.duration: end = clip.duration
+    if start >= end:
+        clip.close()
+        raise ValueError("Invalid start/end times")
+    return clip.subclip(start, end), [clip]
+
+
+def _text_clip(path, captions, source_height=None):
+    from moviepy.editor import VideoFileClip
+    clip = VideoFileClip(path)
+    # Keep the captions the same size relative to the frame when previewing on the proxy
+    scale = clip.h / source_height if source_height else 1.0
+    return clip.fl(text_render.Captioner(captions, clip.size, scale)), [clip]
+
+
+def _audio_clip(video_path, audio_path):
+    from moviepy.editor import VideoFileClip, AudioFileClip, concatenate_audioclips
+    video, audio = VideoFileClip(video_path), AudioFileClip(audio_path)
+    # Logic: Loop audio if shorter, trim if longer
+    if audio.duration < video.duration:
+        loops_needed = int(video.duration / audio.duration) + 1
+        final_audio = concatenate_audioclips([audio] * loops_needed).subclip(0, video.duration)
+    else:
+        final_audio = audio.subclip(0, video.duration)
+    return video.set_audio(final_audio), [video, audio]
+
+
+def _merge_clip(paths):
+    from moviepy.editor import VideoFileClip, concatenate_videoclips
+    clips = []
+    try:
+        for path in paths:
+            clips.append(VideoFileClip(path))
+        return concatenate_videoclips(clips, method="compose"), clips
+    except Exception:
+        for c in clips: c.close()
+        raise
+
+
+def _export_clip(path):
+    from moviepy.editor import VideoFileClip
+    clip = VideoFileClip(path)
+    return clip, [clip]
+
+
+def _output(upload_folder, filename):
+    return os.path.join(upload_folder, filename)
+
+
+# 🔹 Preview vs. full-quality sources and destinations
+def _ensure_proxy(filename, upload_folder, media=None):
+    path = media.proxy_path(filename) if media else None
+    if path is None and proxies.is_fresh(upload_folder, filename):
+        path = proxies.proxy_path(upload_folder, filename)
+    if path is None:
+        # Upload-time generation hasn't run (or failed); build it now, once
+        info = media.probe_info(filename) if media else None
+        made = proxies.generate(upload_folder, filename, info=info)
+        if media: media.set_proxy(filename, made["proxy"], made["strip"])
+        path = proxies.proxy_path(upload_folder, filename)
+    return path
+
+
+def _source(params, filename, upload_folder, media=None):
+    if params.get("preview"):
+        return _ensure_proxy(filename, upload_folder, media)
+    return os.path.join(upload_folder, filename)
+
+
+def _destination(params, upload_folder, source_filename, prefix, ext=None):
+    """(path, name) for the render output; previews go to the previews folder."""
+    if ext:
+        source_filename = os.path.splitext(source_filename)[0] + ext
+    if params.get("preview"):
+        return proxies.preview_output(upload_folder, source_filename, prefix)
+    name = generate_unique_filename(source_filename, prefix=prefix)
+    return _output(upload_folder, name), name
+
+
+# ==========================================
+#           FORM → PARAMS
+# ==========================================
+
+def params_from_form(action, form, upload_folder, media=None):
+    """Validate the editor form for ``action`` and return the job params.
+
+    Raises ValueError with a user-facing message when the form is incomplete.
+    ``media`` (a MediaIndex) lets us check times against the cached duration.
+    """
+    params = _params_for(action, form, upload_folder, media)
+    if action in PREVIEW_ACTIONS and str(form.get("preview", "")).lower() in ("1", "true", "on", "yes"):
+        params["preview"] = True
+    return params
+
+
+def _params_for(action, form, upload_folder, media=None):
+    def _require_file(name, missing_msg, not_found_msg="Video file not found"):
+        if not name:
+            raise ValueError(missing_msg)
+        if not os.path.exists(os.path.join(upload_folder, name)):
+            raise ValueError(not_found_msg)
+        return name
+
+    if action == "trim":
+        video = _require_file(form.get("video"), "No video selected")
+        start = safe_float(form.get("start"), 0)
+        end = safe_float(form.get("end"), 0)
+        entry = media.get(video) if media else None
+        if entry and entry.get("duration"):
+            if not end or end > entry["duration"]: end = entry["duration"]
+        if start < 0 or (end and start >= end):
+            raise ValueError("Invalid start/end times")
+        mode = form.get("mode") or "auto"
+        if mode not in TRIM_MODES:
+            raise ValueError(f"Unknown trim mode: {mode}")
+        return {"video": video, "start": start, "end": end, "mode": mode}
+
+    if action == "add_text":
+        if not form.get("video") or not (form.get("text") or form.get("captions")):
+            raise ValueError("Missing video or text")
+        video = _require_file(form.get("video"), "Missing video or text")
+        if not form.get("captions"):
+            return {"video": video, "text": form.get("text")}
+        # Timed captions: a JSON list of EDL-style text overlays
+        try:
+            captions = json.loads(form.get("captions"))
+        except ValueError:
+            raise ValueError("Captions are not valid JSON")
+        if not isinstance(captions, list) or not captions:
+            raise ValueError("Captions must be a non-empty list")
+        if len(captions) > edl.MAX_OVERLAYS:
+            raise ValueError(f"Too many captions (max {edl.MAX_OVERLAYS})")
+        info = media.probe_info(video) if media else ffmpeg_tools.probe(os.path.join(upload_folder, video))
+        duration = info["duration"] or 0
+        return {"video": video,
+                "captions": [edl.validate_caption(c, f"Caption {n}", duration) for n, c in enumerate(captions, 1)]}
+
+    if action == "add_audio":
+        if not form.get("video") or not form.get("audio"):
+            raise ValueError("Missing video or audio")
+        video = _require_file(form.get("video"), "Missing video or audio", "File not found")
+        audio = _require_file(form.get("audio"), "Missing video or audio", "File not found")
+        return {"video": video, "audio": audio}
+
+    if action == "merge":
+        names = form.getlist("videos") if hasattr(form, "getlist") else form.get("videos", [])
+        if not names or len(names) < 2:
+            raise ValueError("Select at least 2 videos to merge (Hold Ctrl/Cmd to select multiple)")
+        videos = [n for n in names if os.path.exists(os.path.join(upload_folder, n))]
+        if len(videos) < 2:
+            raise ValueError("Not enough valid videos found")
+        return {"videos": videos}
+
+    if action == "export":
+        video = _require_file(form.get("video"), "No video selected")
+        return {"video": video}
+
+    if action == "edl":
+        if not form.get("edl"):
+            raise ValueError("Missing edit list")
+        return {"edl": edl.validate(form.get("edl"), upload_folder, media=media)}
+
+    raise ValueError("Unknown action")
+
+
+# ==========================================
+#           RENDER ACTIONS
+# ==========================================
+
+PREVIEW_ACTIONS = ("trim", "add_text", "add_audio", "merge", "edl")
+TRIM_MODES = ("auto", "copy", "reencode")
+TRIM_MODE_LABELS = {"copy": "stream copy", "smart": "smart cut", "reencode": "re-encoded"}
+
+
+def trim(params, upload_folder, progress=None, media=None):
+    video_filename = params["video"]
+    start, end = params["start"], params["end"]
+    preview = params.get("preview", False)
+    path = _source(params, video_filename, upload_folder, media)
+    output_path, output_filename = _destination(params, upload_folder, video_filename, "trimmed")
+
+    # Fast path: cut at the container level whenever the keyframes allow it
+    if params.get("mode", "auto") != "reencode":
+        try:
+            # The index describes originals; a proxy is small enough to probe directly
+            use_index = media is not None and not preview
+            info = media.probe_info(video_filename) if use_index else ffmpeg_tools.probe(path)
+            kfs = media.keyframes(video_filename) if use_index else None
+            plan = stream_ops.plan_trim(path, start, end, params.get("mode", "auto"), info=info, keyframes=kfs)
+            if plan["mode"] != "reencode":
+                if plan["mode"] == "smart" and not output_path.endswith(".mp4"):
+                    output_path, output_filename = _destination(params, upload_folder, video_filename,
+                                                                "trimmed", ext=".mp4")
+                with _stage("trim", "mux"):
+                    stream_ops.trim(path, output_path, plan, info=info, progress=progress)
+                return _trim_result(output_filename, plan, preview)
+            end = plan["end"]
+        except (RuntimeError, OSError, subprocess.SubprocessError) as e:
+            print(f"⚠️ Stream trim failed, re-encoding instead: {e}")
+
+    duration = _encode("trim", _trim_clip, (path, start, end), output_path, progress)
+    return _trim_result(output_filename, {"mode": "reencode", "start": start, "end": start + duration, "snapped": False},
+                        preview)
+
+
+def _trim_result(output_filename, plan, preview=False):
+    label = TRIM_MODE_LABELS[plan["mode"]]
+    message = f"✅ {'Preview trimmed' if preview else 'Trimmed successfully'} ({label}): {output_filename}"
+    if plan.get("snapped"):
+        message += f" — start snapped to keyframe at {plan['start']:.2f}s"
+    return {"output": output_filename, "message": message, "mode": plan["mode"],
+            "start": plan["start"], "end": plan["end"], "preview": preview}
+
+
+def add_text(params, upload_folder, progress=None, media=None):
+    video_filename = params["video"]
+    preview = params.get("preview", False)
+    path = _source(params, video_filename, upload_folder, media)
+    output_path, output_filename = _destination(params, upload_folder, video_filename, "text")
+    captions = params.get("captions") or [{"text": params["text"], "fontsize": RENDER_SETTINGS["text_size"]}]
+
+    entry = media.get(video_filename) if preview and media else None
+    _encode("add_text", _text_clip, (path, captions, entry and entry.get("height")), output_path, progress,
+            preset="ultrafast" if preview else "medium")
+    return {"output": output_filename, "message": f"✅ Text {'preview' if preview else 'added'}: {output_filename}",
+            "preview": preview}
+
+
+def add_audio(params, upload_folder, progress=None, media=None):
+    video_name = params["video"]
+    preview = params.get("preview", False)
+    vid_path = _source(params, video_name, upload_folder, media)
+    aud_path = os.path.join(upload_folder, params["audio"])
+    output_path, output_filename = _destination(params, upload_folder, video_name, "audio")
+
+    _encode("add_audio", _audio_clip, (vid_path, aud_path), output_path, progress,
+            preset="ultrafast" if preview else "medium")
+    return {"output": output_filename, "message": f"✅ Audio {'preview' if preview else 'merged'}: {output_filename}",
+            "preview": preview}
+
+
+MERGE_MODE_LABELS = {"copy": "no re-encode", "partial": "normalized {n} clip(s)", "reencode": "re-encoded"}
+
+
+def merge(params, upload_folder, progress=None, media=None):
+    preview = params.get("preview", False)
+    names = [n for n in params["videos"] if os.path.exists(os.path.join(upload_folder, n))]
+    if len(names) < 2:
+        raise ValueError("Not enough valid videos found")
+    paths = [_source(params, n, upload_folder, media) for n in names]
+    if preview:
+        output_path, output_filename = proxies.preview_output(upload_folder, "merged.mp4", "")
+    else:
+        output_filename = f"merged_{uuid.uuid4().hex[:8]}.mp4"
+        output_path = _output(upload_folder, output_filename)
+
+    # Fast path: concat demuxer, re-encoding only the clips that don't match the rest
+    try:
+        infos = [media.probe_info(n) for n in names] if media and not preview else None
+        with _stage("merge", "mux"):
+            plan = stream_ops.concat(paths, output_path, infos=infos, progress=progress)
+        label = MERGE_MODE_LABELS[plan["mode"]].format(n=len(plan["normalize"]))
+        return {"output": output_filename, "mode": plan["mode"], "normalized": len(plan["normalize"]),
+                "message": f"✅ Videos merged{' (preview)' if preview else ''} ({label}): {output_filename}",
+                "preview": preview}
+    except (RuntimeError, OSError, subprocess.SubprocessError) as e:
+        print(f"⚠️ Stream merge failed, compositing with MoviePy instead: {e}")
+
+    _encode("merge", _merge_clip, (paths,), output_path, progress, preset="ultrafast" if preview else "medium")
+    return {"output": output_filename, "mode": "reencode", "normalized": len(paths),
+            "message": f"✅ Videos merged{' (preview)' if preview else ''}: {output_filename}", "preview": preview}
+
+
+def export(params, upload_folder, progress=None, media=None):
+    video_filename = params["video"]
+    path = os.path.join(upload_folder, video_filename)
+
+    output_filename = generate_unique_filename(video_filename, prefix='export')
+    # Re-encoding
+    _encode("export", _export_clip, (path,), _output(upload_folder, output_filename), progress)
+    return {"output": output_filename, "message": f"✅ Exported successfully: {output_filename}"}
+
+
+def render_edl(params, upload_folder, progress=None, media=None):
+    """Render a validated edit-decision list (utils/edl.py) in a single encode."""
+    timeline = params["edl"]
+    preview = params.get("preview", False)
+
+    paths, crop_scale = {}, {}
+    for clip in timeline["clips"]:
+        name = clip["source"]
+        if name in paths:
+            continue
+        paths[name] = _source(params, name, upload_folder, media)
+        if preview and clip["crop"]:
+            # Crops are in the original's pixels; map them onto the proxy
+            original = media.probe_info(name) if media else ffmpeg_tools.probe(os.path.join(upload_folder, name))
+            read = ffmpeg_tools.probe(paths[name])
+            if original["height"] and read["height"]:
+                crop_scale[name] = read["height"] / original["height"]
+    for track in timeline["audio"]:
+        paths.setdefault(track["source"], os.path.join(upload_folder, track["source"]))
+
+    if preview:
+        output_path, output_filename = proxies.preview_output(upload_folder, "edit.mp4", "")
+    else:
+        output_filename = f"edit_{uuid.uuid4().hex[:8]}.mp4"
+        output_path = _output(upload_folder, output_filename)
+    with _stage("edl", "encode"):
+        edl.render(timeline, paths, output_path, progress=progress, preview=preview, crop_scale=crop_scale)
+
+    summary = f"{len(timeline['clips'])} clip(s), {len(timeline['overlays'])} caption(s), {len(timeline['audio'])} soundtrack(s)"
+    return {"output": output_filename, "preview": preview, "duration": round(edl.duration(timeline), 3),
+            "message": f"✅ Timeline {'preview ' if preview else ''}rendered in one pass ({summary}): {output_filename}"}
+
+
+def make_proxy(params, upload_folder, progress=None, media=None):
+    """Internal action queued after an upload: build the proxy and thumbnail strip."""
+    filename = params["video"]
+    info = media.probe_info(filename) if media else None
+    with _stage("proxy", "encode"):
+        made = proxies.generate(upload_folder, filename, info=info, progress=progress)
+    if media: media.set_proxy(filename, made["proxy"], made["strip"])
+    return {"output": None, "proxy": made["proxy"], "strip": made["strip"],
+            "message": f"✅ Proxy ready: {filename}"}
+
+
+# Everything besides the params that changes what a render produces (part of the cache key).
+# Bump "version" whenever a render function starts producing different output.
+RENDER_SETTINGS = {"version": 2, "video_codec": "libx264", "audio_codec": "aac",
+                   "text_font": text_render.FONT_CANDIDATES[0], "text_size": 50}
+
+
+ACTIONS = {
+    "trim": trim,
+    "add_text": add_text,
+    "add_audio": add_audio,
+    "merge": merge,
+    "export": export,
+    "edl": render_edl,
+}
+
+# Queued by the app itself, never accepted from the editor form
+INTERNAL_ACTIONS = {
+    "proxy": make_proxy,
+}
+
+
+def _result_folder(upload_folder, params_or_result):
+    return proxies.preview_folder(upload_folder) if params_or_result.get("preview") else upload_folder
+
+
+def cache_key(cache, action, params, upload_folder, compute=True):
+    """Render-cache key for a user-facing action (None for internal actions or unknown digests)."""
+    if cache is None or action not in ACTIONS:
+        return None
+    return cache.key(action, params, settings=RENDER_SETTINGS, source_folder=upload_folder, compute=compute)
+
+
+def cached_result(cache, action, params, upload_folder, compute=True, record_miss=True):
+    """The cached result for an identical earlier render, or None."""
+    if cache is None:
+        return None
+    key = cache_key(cache, action, params, upload_folder, compute=compute)
+    return _reused(cache.lookup(key, folder=_result_folder(upload_folder, params), record_miss=record_miss))
+
+
+def _reused(hit):
+    if hit:
+        hit["message"] = f"⚡ Reused an identical render: {hit['output']}"
+    return hit
+
+
+def run(action, params, upload_folder, progress=None, media=None, cache=None):
+    """Dispatch ``action`` to its render function.
+
+    With a MediaIndex, source metadata comes from the index and the output is
+    indexed as soon as it is written, so it lists with its duration right away.
+    Previews are throwaway and stay out of the index. With a RenderCache, an
+    identical earlier render is returned instead of encoding again.
+    """
+    func = ACTIONS.get(action) or INTERNAL_ACTIONS.get(action)
+    if func is None:
+        raise ValueError(f"Unknown action: {action}")
+
+    key = cache_key(cache, action, params, upload_folder)
+    if key:
+        hit = _reused(cache.lookup(key, folder=_result_folder(upload_folder, params)))
+        if hit:
+            if progress: progress(1.0)
+            return hit
+
+    with _stage(action, "total"):
+        result = func(params, upload_folder, progress=progress, media=media)
+    if media is not None and result.get("output") and not result.get("preview"):
+        media.index_file(result["output"])
+    if key and result.get("output"):
+        cache.store(key, action, result, os.path.join(_result_folder(upload_folder, result), result["output"]))
+    if cache and action == "proxy":
+        # Hash the new upload now so the web process can answer repeat renders
+        # of it from the cache without reading the file itself
+        cache.digest(os.path.join(upload_folder, params["video"]))
+    return result